@@ -9,14 +9,17 @@
 '''
 from collections import OrderedDict
 
-import requests
+import itertools
 import json
+import requests
 import time
 
 from argus_tal import timeseries_id as ts_id
 from argus_tal import query_api
 from argus_tal import timestamp as ts
 from argus_tal import basic_types as bt
+from argus_tal import exceptions as excp
+from argus_tal import http_session_pool as hspool
 from argus_tal.timeseries_datadict import LookupQualifier, TimeseriesDataDict
 
 
@@ -26,7 +29,13 @@ class StateSetProcessor(object):
                  tsdb_hostname_or_ip, tsdb_port, flag_msec_query_response,
                  flag_interpolation_needed=True,
                  additional_query_window=30,
-                 error_tsid=None):
+                 error_tsid=None,
+                 http_session_pool=None,
+                 query_coalescer=None,
+                 query_cache=None,
+                 segment_store=None,
+                 negative_cache=None,
+                 request_policy=None):
 
         self.__name = str(name)
 
@@ -39,6 +48,36 @@ class StateSetProcessor(object):
         self.__tsdb_hostname_or_ip = tsdb_hostname_or_ip
         self.__tsdb_port_num = tsdb_port
 
+        # Both the reads and the writes go over this pool of persistent
+        # connections, so pushing N state results every period doesn't cost
+        # N new TCP connections. Defaults to the process wide pool.
+        if http_session_pool == None:
+            http_session_pool = hspool.get_default_pool()
+        self.__http_session_pool = http_session_pool
+
+        # Processors sharing a QueryCoalescer (e.g. the process wide one) and
+        # querying the same series and window at the same time send only 1 of
+        # those queries. None disables coalescing.
+        self.__query_coalescer = query_coalescer
+
+        # Successive windows overlap (see additional_query_window). With a
+        # QueryResultCache, only the part of each window not already fetched
+        # is queried. None disables caching.
+        self.__query_cache = query_cache
+
+        # Sealed (historical) blocks of data are read from this on-disk
+        # SegmentStore, if any, so that re-runs over the same past days don't
+        # download them again.
+        self.__segment_store = segment_store
+
+        # A dead sensor comes back empty every period. With a NegativeCache,
+        # series known to be empty are not queried again (for its ttl).
+        self.__negative_cache = negative_cache
+
+        # With an argus_tal RequestPolicy, queries have a deadline and slow
+        # or failed requests are hedged / retried. None: 1 request per query.
+        self.__request_policy = request_policy
+
         # Flag to control the response time granularity.
         #
         # Default OpenTSDB query response is with seconds timestamp. This flag
@@ -123,16 +162,46 @@ class StateSetProcessor(object):
             start_timestamp, end_timestamp,
             list_ts_ids,
             bt.Aggregator.NONE,
-            flag_ms_response=self.__flag_msec_response
+            flag_ms_response=self.__flag_msec_response,
+            http_session_pool=self.__http_session_pool,
+            query_coalescer=self.__query_coalescer,
+            query_cache=self.__query_cache,
+            segment_store=self.__segment_store,
+            negative_cache=self.__negative_cache,
+            request_policy=self.__request_policy
         )
 
+        # -3: no data at all (e.g. dead sensors, possibly known from the
+        # negative cache without any request) i.e. an empty result map.
         rv = foo.populate_ts_data()
-        assert rv == 0
+        assert rv == 0 or rv == -3
 
         result_map = foo.get_result_map()
 
         return result_map
 
+    def __iter_timeseries_data(self, list_ts_ids, start_timestamp,
+                               end_timestamp):
+        # Same query as getTimeSeriesData(), but yields each
+        # TimeseriesDataDict as soon as it has been received, so that
+        # processing one timeseries overlaps with receiving the next.
+        # Raises argus_tal.exceptions.QueryFailed if the query fails, which
+        # one_shot() records as a system error for the period.
+        query_obj = query_api.QueryApi(
+            self.__tsdb_hostname_or_ip, self.__tsdb_port_num,
+            start_timestamp, end_timestamp,
+            list_ts_ids,
+            bt.Aggregator.NONE,
+            flag_ms_response=self.__flag_msec_response,
+            http_session_pool=self.__http_session_pool,
+            query_coalescer=self.__query_coalescer,
+            query_cache=self.__query_cache,
+            segment_store=self.__segment_store,
+            negative_cache=self.__negative_cache,
+            request_policy=self.__request_policy
+        )
+        return query_obj.iter_results()
+
     def __push_data(self, timestamp, metric, value, tags):
         url = 'http://%s:%d/api/put' % (self.__tsdb_hostname_or_ip,
                                         self.__tsdb_port_num)
@@ -142,9 +211,18 @@ class StateSetProcessor(object):
         datapoint['timestamp'] = timestamp
         datapoint['value'] = value
         datapoint['tags'] = tags
-        response = requests.post(url, data=json.dumps(datapoint), headers=headers)
+        response = self.__http_session_pool.post(
+            url, data=json.dumps(datapoint), headers=headers)
         return response, datapoint['timestamp']
 
+    def __push_error(self, start_time, end_time, error):
+        # The states of period [start_time, end_time] couldn't be computed:
+        # the whole period is written to the error timeseries instead.
+        print(error)
+        print("ERROR: Processing Start:" + str(start_time) + " End:" + str(end_time))
+        self.__push_data(end_time, self.__error_tsid.metric_id,
+                         end_time - start_time, self.__error_tsid.filters)
+
     def __calculate_y_intercept(self, p1_coordinates, p2_coordinates, x_intercept):
         x1, y1 = p1_coordinates
         x2, y2 = p2_coordinates
@@ -213,25 +291,37 @@ class StateSetProcessor(object):
 
         pseudo_start_timestamp = ts.Timestamp(start_time - self.__additional_query_window)
         pseudo_end_timestamp = ts.Timestamp(end_time + self.__additional_query_window)
-        tsdd_map = self.getTimeSeriesData(list(self.__read_tsids),
-                                          pseudo_start_timestamp,
-                                          pseudo_end_timestamp)
+        tsdd_iter = self.__iter_timeseries_data(list(self.__read_tsids),
+                                                pseudo_start_timestamp,
+                                                pseudo_end_timestamp)
         result_map = {}
 
+        # -3: none of the timeseries has data (e.g. dead sensors, maybe known
+        # from the negative cache without any query) i.e. an empty result map.
+        # The query only fails so before yielding anything.
+        try:
+            tsdd_iter = itertools.chain([next(tsdd_iter)], tsdd_iter)
+        except StopIteration:
+            return result_map
+        except excp.QueryFailed as e:
+            if e.error_code != -3:
+                raise
+            return result_map
+
         # If interpolation is not requested, we're done here. Lets build
         # result_map and return.
         if not self.__flag_interpolation_enabled:
-            for fqid, tsdd in tsdd_map.items():
+            for tsdd in tsdd_iter:
                 tsid = tsdd.get_timeseries_id()
                 result_map.update({tsid.fqid: tsdd})
             return result_map
 
         # Looks like interpolation is needed...let the fun begin !
 
-        # We got a query response from getTimeSeriesData(). We're now going to
-        # process the query results for interpolation and guarantee that
-        # a datapoint exists at the requested periodicty.
-        for fqid, tsdd in tsdd_map.items():
+        # We're now going to process the query results for interpolation and
+        # guarantee that a datapoint exists at the requested periodicty. Each
+        # timeseries is processed as soon as it has been received.
+        for tsdd in tsdd_iter:
             data_points = OrderedDict()
             tsid = tsdd.get_timeseries_id()
 
@@ -289,7 +379,24 @@ class StateSetProcessor(object):
         current_time = start_time
         while current_time < end_time:
             current_period_end_time = current_time + output_granularity_in_sec
-            result_map = self.__build_sync_interpolated_data(current_time, current_period_end_time, 1)
+            try:
+                result_map = self.__build_sync_interpolated_data(current_time, current_period_end_time, 1)
+            except excp.QueryFailed as e:
+                # No data to compute this period's states from (e.g. HTTP
+                # error, bad response): same as a failed computation.
+                self.__push_error(current_time, current_period_end_time, e)
+                current_time = current_period_end_time
+                continue
+
+            # Periods without data for some input timeseries (e.g. a dead
+            # sensor) can't be computed either.
+            missing_tsids = [str(tsid) for tsid in self.__read_tsids
+                             if tsid.fqid not in result_map]
+            if len(missing_tsids) > 0:
+                self.__push_error(current_time, current_period_end_time,
+                                  "No data for: %s" % ", ".join(missing_tsids))
+                current_time = current_period_end_time
+                continue
 
             time_spent_list = []
             error = False
@@ -298,10 +405,8 @@ class StateSetProcessor(object):
                     time_spent = t_state.do_computation(result_map)
                     time_spent_list.append((t_state.write_tsid.metric_id, time_spent, t_state.write_tsid.filters))
                 except ValueError as e:
-                    print(e)
-                    print("ERROR: Processing Start:" + str(current_time) + " End:" + str(current_period_end_time))
                     error = True
-                    self.__push_data(current_period_end_time, self.__error_tsid.metric_id, current_period_end_time - current_time, self.__error_tsid.filters)
+                    self.__push_error(current_time, current_period_end_time, e)
                     break
 
             if not error:
@@ -324,6 +429,11 @@ class StateSetProcessor(object):
        - computes state set using query result,
        - writes the result back to TSDB
 
+    A period whose query fails (e.g. no response within the deadline of the
+    request_policy from a stalled TSD) is recorded as a system error. If the
+    TSD can't even take that write, the period is only logged. Either way the
+    next period goes on as usual.
+
     FIXME: Parag to remove this "blocking_start" restriction later once he's
            wrapped his head around Python's asyncio primitivies. For now, we
            live with this.
@@ -333,7 +443,11 @@ class StateSetProcessor(object):
         while True:
             start_time = time.time()
             end_time = start_time + periodicity_in_sec
-            self.one_shot(start_time, end_time, periodicity_in_sec)
+            try:
+                self.one_shot(start_time, end_time, periodicity_in_sec)
+            except requests.exceptions.RequestException as e:
+                print(e)
+                print("ERROR: Writing results Start:" + str(start_time) + " End:" + str(end_time))
             time.sleep(periodicity_in_sec)
             pass
         return
@@ -42,7 +42,8 @@ import jsonschema
 
 class StateSetProcessorBuilder(object):
     def __init__(self, state_set_json_schema_file_path,
-                 tsdb_hostname_or_ip, tsdb_port):
+                 tsdb_hostname_or_ip, tsdb_port, segment_store=None,
+                 negative_cache=None, request_policy=None):
         # From the POV of state set processor construction, this class is
         # stateless.
         self.__build_success_count = 0
@@ -54,6 +55,13 @@ class StateSetProcessorBuilder(object):
         self.__tsdb_hostname_or_ip = tsdb_hostname_or_ip
         self.__tsdb_port_num = tsdb_port
 
+        # Optional argus_tal SegmentStore shared by all the processors built.
+        self.__segment_store = segment_store
+        # Optional argus_tal NegativeCache shared by all the processors built.
+        self.__negative_cache = negative_cache
+        # Optional argus_tal RequestPolicy shared by all the processors built.
+        self.__request_policy = request_policy
+
         self.__state_set_json_schema = None
         with open(state_set_json_schema_file_path, 'r') as file:
             self.__state_set_json_schema = json.load(file)
@@ -160,4 +168,7 @@ class StateSetProcessorBuilder(object):
                                  self.__tsdb_hostname_or_ip,
                                  self.__tsdb_port_num,
                                  flag_msec_query_resp,
-                                 error_tsid=error_tsid)
+                                 error_tsid=error_tsid,
+                                 segment_store=self.__segment_store,
+                                 negative_cache=self.__negative_cache,
+                                 request_policy=self.__request_policy)
@@ -21,6 +21,7 @@ import unittest
 from collections import OrderedDict
 from json import loads
 from unittest.mock import Mock, patch
+import requests
 import json
 import importlib.resources as pkg_resources
 sys.path.append("..")
@@ -39,6 +40,8 @@ from argus_tal import query_api
 from argus_tal import basic_types as bt
 from argus_tal import timestamp as ts
 from argus_tal import query_urlgen as qurlgen
+from argus_tal import negative_cache
+from argus_tal import request_policy
 
 import pandas as pd
 
@@ -56,6 +59,10 @@ class Integration_Tests(unittest.TestCase):
         The query URL is constructed based on (timeseries_id, start_time & end_time) being used for a test case.
         '''
         self.__test_result_dict = {}
+        # If set, every read gets a response with this HTTP status code.
+        self.__read_error_code = None
+        # If set, every read gets a response without any timeseries.
+        self.__flag_read_empty = False
 
     def __setup_testcase_data(self, start,
                               end,
@@ -116,10 +123,19 @@ class Integration_Tests(unittest.TestCase):
             tsids.append(tsid)
         self.__setup_testcase_data(start, end, self.__tsdb_ip, self.__tsdb_port, tsids)
 
-    def __mocked_tsdb_read(self, url):
+    def __mocked_tsdb_read(self, url, **kwargs):
         resp_mock = Mock()
-        self.__fulfill_query(url)
+        if self.__read_error_code != None:
+            resp_mock.status_code = self.__read_error_code
+            return resp_mock
+        if self.__flag_read_empty:
+            self.__test_result_dict[url] = (200, [])
+        else:
+            self.__fulfill_query(url)
         resp_mock.status_code, resp_mock.json.return_value = self.__test_result_dict[url]
+        resp_mock.content = json.dumps(resp_mock.json.return_value).encode()
+        resp_mock.iter_content.return_value = [resp_mock.content]
+        resp_mock.raw.tell.return_value = len(resp_mock.content)
         return resp_mock
     
     def __mocked_tsdb_write(self, url, data, headers):
@@ -134,22 +150,24 @@ class Integration_Tests(unittest.TestCase):
         if(self.__replace_new_vals):
             self.__test_output_df = self.__test_output_df.drop_duplicates()
 
-    def __common_test_driver(self, t1, t2, tsids, applique_file, output_granularity=30):
+    def __common_test_driver(self, t1, t2, tsids, applique_file, output_granularity=30, negative_cache=None):
         """
         This method is a common test driver that is used by all tests. This method:
         --- enables the mocking of TSDB read & write
         --- constructs an applique using supplied file and runs it using one_shot
         --- the result is pushed to self.__test_output_df
         """
-        with patch('argus_quilt.state_set_processor.requests') as mock_tsdb, patch('argus_tal.query_api.requests') as mock_tsdb2:
-            mock_tsdb.post.side_effect = self.__mocked_tsdb_write
-            mock_tsdb2.get.side_effect = self.__mocked_tsdb_read
+        with patch('requests.Session.post') as mock_tsdb_post, patch('requests.Session.get') as mock_tsdb_get:
+            mock_tsdb_post.side_effect = self.__mocked_tsdb_write
+            mock_tsdb_get.side_effect = self.__mocked_tsdb_read
+            self.__mock_tsdb_get = mock_tsdb_get
 
             self.__setup_testcase_data(t1, t2, self.__tsdb_ip, self.__tsdb_port, tsids)
 
             with pkg_resources.path( \
                 "argus_quilt", "SCHEMA_DEFN_state_set.json") as schema_file:
-                    builder = StateSetProcessorBuilder(schema_file, self.__tsdb_ip, self.__tsdb_port)
+                    builder = StateSetProcessorBuilder(schema_file, self.__tsdb_ip, self.__tsdb_port,
+                                                       negative_cache=negative_cache)
                     __location__ = os.path.realpath(os.path.join(os.getcwd(),
                                                     os.path.dirname(__file__)))
                     with open(os.path.join(__location__, applique_file)) as file:
@@ -188,3 +206,74 @@ class Integration_Tests(unittest.TestCase):
         file_path = os.path.join(this_dir, 'test_data/expected_output_case3.csv')
         print(pd.read_csv(file_path))
         pd.testing.assert_frame_equal(self.__test_output_df, pd.read_csv(file_path), check_dtype=False, check_exact=False)
+
+    def testQueryError(self):
+        # Every period whose query fails is a system error, and processing
+        # goes on with the next period.
+        tsid1 = TimeseriesID("mock_data", {"input":"Melt-Temp"})
+        tsid2 = TimeseriesID("mock_data", {"input":"Barrel-Temp"})
+        self.__read_error_code = 500
+        self.__common_test_driver(1616083200, 1616083360, [tsid1, tsid2], "test_appliques/test_applique_1.json")
+        this_dir = os.path.dirname(os.path.realpath(__file__))
+        file_path = os.path.join(this_dir, 'test_data/expected_output_case3.csv')
+        pd.testing.assert_frame_equal(self.__test_output_df, pd.read_csv(file_path), check_dtype=False, check_exact=False)
+
+    def testNoData(self):
+        # Dead sensors: the periods are system errors, none fails the run.
+        tsid1 = TimeseriesID("mock_data", {"input":"Melt-Temp"})
+        tsid2 = TimeseriesID("mock_data", {"input":"Barrel-Temp"})
+        self.__flag_read_empty = True
+        cache = negative_cache.NegativeCache(ttl=60)
+        self.__common_test_driver(1616083200, 1616083360, [tsid1, tsid2], "test_appliques/test_applique_1.json",
+                                  negative_cache=cache)
+        self.assertGreater(self.__mock_tsdb_get.call_count, 0)
+        this_dir = os.path.dirname(os.path.realpath(__file__))
+        file_path = os.path.join(this_dir, 'test_data/expected_output_case3.csv')
+        pd.testing.assert_frame_equal(self.__test_output_df, pd.read_csv(file_path), check_dtype=False, check_exact=False)
+
+        # Known to be empty: no more queries.
+        self.__common_test_driver(1616083200, 1616083360, [tsid1, tsid2], "test_appliques/test_applique_1.json",
+                                  negative_cache=cache)
+        self.assertEqual(self.__mock_tsdb_get.call_count, 0)
+        pd.testing.assert_frame_equal(self.__test_output_df, pd.read_csv(file_path), check_dtype=False, check_exact=False)
+
+    def testStalledTSDB(self):
+        # No response within the deadline: each period is a system error and
+        # blocking_start() goes on with the next one.
+        def stalled_read(url, **kwargs):
+            assert kwargs['timeout'] <= 0.05
+            raise requests.exceptions.ReadTimeout("Stalled")
+        flag_write_fails = [False]
+        def write(url, data, headers):
+            if flag_write_fails[0]:
+                raise requests.exceptions.ConnectionError("Stalled")
+            self.__mocked_tsdb_write(url, data, headers)
+        class StopLoop(Exception):
+            pass
+        periods = []
+        def sleep(secs):
+            periods.append(secs)
+            flag_write_fails[0] = True  # Even the error can't be written.
+            if len(periods) == 2:
+                raise StopLoop()
+
+        policy = request_policy.RequestPolicy(deadline=0.05, max_retries=0)
+        with patch('requests.Session.post') as mock_tsdb_post, patch('requests.Session.get') as mock_tsdb_get, \
+             patch('argus_quilt.state_set_processor.time.sleep', side_effect=sleep):
+            mock_tsdb_post.side_effect = write
+            mock_tsdb_get.side_effect = stalled_read
+            with pkg_resources.path( \
+                "argus_quilt", "SCHEMA_DEFN_state_set.json") as schema_file:
+                    builder = StateSetProcessorBuilder(schema_file, self.__tsdb_ip, self.__tsdb_port,
+                                                       request_policy=policy)
+                    this_dir = os.path.dirname(os.path.realpath(__file__))
+                    with open(os.path.join(this_dir, "test_appliques/test_applique_1.json")) as file:
+                        processor = builder.build(json.load(file))
+                    with self.assertRaises(StopLoop):
+                        processor.blocking_start(30)
+
+        self.assertEqual(mock_tsdb_get.call_count, 2)
+        self.assertEqual(mock_tsdb_post.call_count, 2)
+        self.assertEqual(list(self.__test_output_df['state']), ['system_error'])
+        self.assertEqual(list(self.__test_output_df['value']), [30.0])
+        self.assertEqual(policy.get_stats()['failures'], 2)
@@ -9,6 +9,7 @@
 
 from argus_tal import query_api
 from argus_tal import basic_types as bt
+from argus_tal import http_session_pool as hspool
 
 from enum import Enum, auto
 
@@ -38,11 +39,22 @@ class MachineAnalyticsBase(object):
   '''
   def __init__(self, machine_type,
                      data_source_IP_address,
-                     data_source_TCP_port):
+                     data_source_TCP_port,
+                     http_session_pool=None,
+                     query_coalescer=None):
     self.__machine_type = machine_type
     self.__data_source_IP_address = data_source_IP_address
     self.__data_source_TCP_port = data_source_TCP_port
 
+    # Queries reuse persistent connections from this pool (the process wide
+    # one by default) instead of opening a new connection each time.
+    if http_session_pool == None:
+      http_session_pool = hspool.get_default_pool()
+    self.__http_session_pool = http_session_pool
+    # Identical queries in flight at the same time (e.g. from analytics
+    # sharing the process wide coalescer) are sent only once. None: disabled.
+    self.__query_coalescer = query_coalescer
+
   def machine_type(self):
     return self.__machine_type
 
@@ -57,6 +69,8 @@ class MachineAnalyticsBase(object):
           [timeseries_id],
           bt.Aggregator.NONE,
           flag_compute_rate,
+          http_session_pool=self.__http_session_pool,
+          query_coalescer=self.__query_coalescer
           )
 
       rv = query_obj.populate_ts_data()
@@ -69,3 +83,24 @@ class MachineAnalyticsBase(object):
       #     for kk, vv in result:
       #         print("\t%s->%d" % (kk, vv))
       return result_list[0]
+
+  def get_fleet_timeseries_data(self, timeseries_pattern,
+                                      start_timestamp,
+                                      end_timestamp,
+                                      flag_compute_rate=False):
+      '''Same as get_timeseries_data(), for all the timeseries matched by a
+         TimeseriesPattern (e.g. 1 per machine) in a single query. Returns a
+         map of TimeseriesID -> TimeseriesDataDict.'''
+      query_obj = query_api.QueryApi(
+          self.__data_source_IP_address, self.__data_source_TCP_port,
+          start_timestamp, end_timestamp,
+          [timeseries_pattern],
+          bt.Aggregator.NONE,
+          flag_compute_rate,
+          http_session_pool=self.__http_session_pool,
+          query_coalescer=self.__query_coalescer
+          )
+
+      rv = query_obj.populate_ts_data()
+      assert rv == 0
+      return query_obj.get_result_map_for(timeseries_pattern)
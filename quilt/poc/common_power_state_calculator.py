@@ -90,6 +90,11 @@ class PowerStateCalculator(MachineAnalyticsBase):
       start_value = 0
       state_transition_list = []
 
+      # Value of the datapoint preceding each datapoint in result, looked up
+      # in a single batch rather than once per datapoint inside the loop.
+      _, prev_values, _ = result.get_datapoints(result.get_timestamps(),
+                                                LQ.NEAREST_SMALLER)
+
       #Below block traverses the result and forms tuple of start and end timestamps with powerstate
       #FIXME_Vishwas: Discuss this with Vishwas !
       for idx, (kk, vv) in enumerate(result):
@@ -99,7 +104,7 @@ class PowerStateCalculator(MachineAnalyticsBase):
           elif idx == len(result) - 1:  # Last element in the result
               end_key = kk
               state_transition_list.append(tuple((start_key, end_key, start_value)))
-          elif vv == result.get_datapoint(kk, LQ.NEAREST_SMALLER)[1]:
+          elif vv == prev_values[idx]:
               continue
           else:
               end_key = kk
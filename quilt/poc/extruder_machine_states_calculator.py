@@ -34,9 +34,16 @@ class ExtruderMachineStateCalculator(MachineAnalyticsBase):
   def is_parameter_changing(rate_v):
     return rate_v < -1 or rate_v > 1
 
-  def compute_time_in_stable_state(ts_id, cur_time, window_start_time):
-    tmp_time, _ = ts_id.get_datapoint(cur_time, LQ.NEAREST_SMALLER)
-    return tmp_time - window_start_time
+  def compute_time_in_stable_state(prev_time, window_start_time):
+    # prev_time: timestamp of the datapoint preceding the current one.
+    return int(prev_time) - window_start_time
+
+  def get_prev_timestamps(data):
+    # Timestamp of the datapoint preceding each datapoint of data, looked up
+    # in a single batch rather than once per datapoint inside the loops.
+    prev_times, _, _ = data.get_datapoints(data.get_timestamps(),
+                                           LQ.NEAREST_SMALLER)
+    return prev_times
 
   def __init__(self, data_source_IP_address,
                      data_source_TCP_port,
@@ -102,17 +109,18 @@ class ExtruderMachineStateCalculator(MachineAnalyticsBase):
               # *always* going to have a small variation even if the underlying
               # temperature is stable.
               StartTime = 0
-              for tt , rate_v in melt_temp_change_rate:
+              prev_times = __class__.get_prev_timestamps(melt_temp_change_rate)
+              for idx, (tt , rate_v) in enumerate(melt_temp_change_rate):
                   if __class__.is_parameter_changing(rate_v):  #Parameter is changing.
                       if StartTime != 0:
-                          total_ready_time += __class__.compute_time_in_stable_state(melt_temp_change_rate, tt, StartTime)
+                          total_ready_time += __class__.compute_time_in_stable_state(prev_times[idx], StartTime)
                           StartTime = 0
                   else: #Rate in stable proceed to next datapoint
                       assert __class__.is_parameter_stable(rate_v)
                       if StartTime == 0:
                           StartTime = tt
                       elif tt == melt_temp_change_rate.get_max_key() and StartTime != 0: #rate in range throught dataset so add time on the last entry
-                          total_ready_time += __class__.compute_time_in_stable_state(melt_temp_change_rate, tt, StartTime)
+                          total_ready_time += __class__.compute_time_in_stable_state(prev_times[idx], StartTime)
       return total_ready_time
 
 
@@ -130,6 +138,7 @@ class ExtruderMachineStateCalculator(MachineAnalyticsBase):
               EndKey = 0
               tempStateList = []
               purgeStart = 0
+              prev_times = __class__.get_prev_timestamps(data)
               i=0
               for k, v in data:
                   if i == len(data) and Startkey != 0: #if whole dataset has zero line speed, create tuple at last value
@@ -142,7 +151,7 @@ class ExtruderMachineStateCalculator(MachineAnalyticsBase):
                       i += 1
                       continue
                   elif v > 1000 and Startkey != 0: #If speed non zero, stop and make a tuple with start and end
-                      EndKey = data.get_datapoint(k, LQ.NEAREST_SMALLER)[0]
+                      EndKey = int(prev_times[i])
                       tempStateList.append(tuple((Startkey, EndKey)))
                       Startkey = 0
                   i += 1
@@ -167,14 +176,15 @@ class ExtruderMachineStateCalculator(MachineAnalyticsBase):
                       self.__melt_temperature_ts_id,
                       start_timestamp, end_timestamp)
 
-                  for k,v in meltdata:
+                  prev_times = __class__.get_prev_timestamps(meltdata)
+                  for idx, (k,v) in enumerate(meltdata):
                       if v > 160 or v < 147: #Stable target temperature, provided by caller (JOB Parameters)
                           if purgeStart != 0:
-                              total_purge_time += meltdata.get_datapoint(k, LQ.NEAREST_SMALLER)[0] - purgeStart
+                              total_purge_time += int(prev_times[idx]) - purgeStart
                               purgeStart = 0
                       elif 147.0 <= v <= 160.0:
                           if purgeStart == 0:
                               purgeStart = k
                           elif k == meltdata.get_max_key() and purgeStart != 0:
-                              total_purge_time += meltdata.get_datapoint(k, LQ.NEAREST_SMALLER)[0] - purgeStart
+                              total_purge_time += int(prev_times[idx]) - purgeStart
       return total_purge_time
@@ -117,7 +117,7 @@
 import os
 import sys
 from collections import OrderedDict
-from json import loads
+from json import dumps, loads
 
 from .context import argus_quilt
 from argus_quilt.filter_primitive import FilteredTimeseries, FilterQualifier, filtering_criterion_ops
@@ -217,11 +217,13 @@ class FilterPrimitive_Tests(unittest.TestCase):
     def mocked_requests_get(self, url):
         resp_mock = Mock()
         resp_mock.status_code, resp_mock.json.return_value = self.__test_result_dict[url]
+        resp_mock.content = dumps(resp_mock.json.return_value).encode()
+        resp_mock.raw.tell.return_value = len(resp_mock.content)
         return resp_mock
 
     def mock_filter_series_helper(self, t1, t2):
-        with patch('argus_tal.query_api.requests') as mock_tsdb:
-            mock_tsdb.get.side_effect = self.mocked_requests_get
+        with patch('requests.Session.get') as mock_tsdb_get:
+            mock_tsdb_get.side_effect = self.mocked_requests_get
 
             self.__setup_testcase_data(
                 t1, t2,
@@ -236,8 +238,8 @@ class FilterPrimitive_Tests(unittest.TestCase):
             return filtered_result
 
     def mock_filter_series_helper_temp(self, t1, t2):
-        with patch('argus_tal.query_api.requests') as mock_tsdb:
-            mock_tsdb.get.side_effect = self.mocked_requests_get
+        with patch('requests.Session.get') as mock_tsdb_get:
+            mock_tsdb_get.side_effect = self.mocked_requests_get
 
             self.__setup_testcase_data(
                 t1, t2,
@@ -290,8 +292,8 @@ class FilterPrimitive_Tests(unittest.TestCase):
         self.assertEqual(marker.get_prev_element(), 200)
 
     def testFilteredDataDictInit(self):
-        with patch('argus_tal.query_api.requests') as mock_tsdb:
-            mock_tsdb.get.side_effect = self.mocked_requests_get
+        with patch('requests.Session.get') as mock_tsdb_get:
+            mock_tsdb_get.side_effect = self.mocked_requests_get
 
             self.__setup_testcase_data(
                 1587947403, 1587949197,
@@ -68,6 +68,7 @@
 
 import os
 import random
+from json import dumps
 import sys
 
 # FIXME: We're cheating a little here until we've sorted out how to
@@ -332,6 +333,8 @@ class PSC_Tests(unittest.TestCase):
     print("GENERATED URL: %s" % url)
     resp_mock = Mock()
     resp_mock.status_code, resp_mock.json.return_value = self.__test_result_dict[url]
+    resp_mock.content = dumps(resp_mock.json.return_value).encode()
+    resp_mock.raw.tell.return_value = len(resp_mock.content)
     return resp_mock
 
   def testAllSubtestCasesForFixedPeriod(self):
@@ -346,10 +349,10 @@ class PSC_Tests(unittest.TestCase):
       test_case_label, time_window_params = tc_data # Unpack test case data
       print("\nTesting: %s" % test_case_label)
       with self.subTest():
-        with patch('argus_tal.query_api.requests') as mock_tsdb:
+        with patch('requests.Session.get') as mock_tsdb_get:
 
           # Setup mock handler
-          mock_tsdb.get.side_effect = self.mocked_requests_get
+          mock_tsdb_get.side_effect = self.mocked_requests_get
 
           # Setup test case data that PowerStateCalculator consumes.
           start_ts, end_ts, \
@@ -371,7 +374,7 @@ class PSC_Tests(unittest.TestCase):
           computed_result = power_state_calc_obj.compute_result(start_ts,
                                                                 end_ts)
 
-          mock_tsdb.get.assert_called_once()
+          mock_tsdb_get.assert_called_once()
 
           # Verify that PowerStateCalculator object matches expected results
           # by comparing against generated timeseries data.
@@ -410,10 +413,10 @@ class PSC_Tests(unittest.TestCase):
       test_case_label, time_window_params = tc_data # Unpack test case data
       print("\nTesting: %s" % test_case_label)
       with self.subTest():
-        with patch('argus_tal.query_api.requests') as mock_tsdb:
+        with patch('requests.Session.get') as mock_tsdb_get:
 
           # Setup mock handler
-          mock_tsdb.get.side_effect = self.mocked_requests_get
+          mock_tsdb_get.side_effect = self.mocked_requests_get
 
           # Setup test case data that PowerStateCalculator consumes.
           start_ts, end_ts, \
@@ -435,7 +438,7 @@ class PSC_Tests(unittest.TestCase):
           computed_result = power_state_calc_obj.compute_result(start_ts,
                                                                 end_ts)
 
-          mock_tsdb.get.assert_called_once()
+          mock_tsdb_get.assert_called_once()
 
           # Verify that PowerStateCalculator object matches expected results
           # by comparing against generated timeseries data.
@@ -9,6 +9,7 @@ from extruder_machine_states_calculator import ExtruderMachineStateCalculator
 from all_machines_common_base import ComputationMode
 from argus_tal import timeseries_id as ts_id
 from argus_tal import timestamp as ts
+from argus_tal.timeseries_datadict import TimeseriesDataDict
 
 import unittest
 from unittest import mock
@@ -43,6 +44,38 @@ class ESMC_Tests(unittest.TestCase):
   def testUsingMock(self, mock_get):
     pass
 
+  def testReadyAndPurgeTimesUsingMock(self):
+    # 10 sec data. The machine is on for the first 100 secs.
+    t0 = 1000
+    def dps(values):
+      return {t0 + ii * 10: vv for ii, vv in enumerate(values)}
+    series = {
+        ("melt_temperature", True):
+            dps([5, 0.5, 0.2, -0.5, 3, 0.1, 0, 0.4, -2, 0.3, 0.2]),
+        ("melt_temperature", False):
+            dps([140, 150, 155, 158, 170, 150, 152, 149, 150, 145, 150]),
+        ("line_speed", False):
+            dps([2000, 500, 300, 200, 1500, 800, 700, 2000, 100, 50, 20]),
+        ("screw_speed", False): dps([50] * 11),
+    }
+    def get_timeseries_data(self, tsid, start, end, flag_compute_rate=False):
+      return TimeseriesDataDict(tsid, {
+          kk: vv for kk, vv in series[(tsid.metric_id, flag_compute_rate)].items()
+          if start.value <= kk <= end.value})
+
+    ts_ids = [ts_id.TimeseriesID(metric, {"machine_name": "90mm_extruder"})
+              for metric in ["power_state", "melt_temperature", "line_speed",
+                             "screw_speed"]]
+    state_list = [(t0, t0 + 100, 1.0), (t0 + 100, t0 + 200, 0.0)]
+    with mock.patch.object(ExtruderMachineStateCalculator,
+                           'get_timeseries_data', get_timeseries_data):
+      machine_usage = ExtruderMachineStateCalculator(
+          "ignored_host", 4242, ComputationMode.ON_DEMAND, *ts_ids)
+      self.assertEqual(40, machine_usage.
+          _ExtruderMachineStateCalculator__calculate_ready_time(state_list))
+      self.assertEqual(50, machine_usage.
+          _ExtruderMachineStateCalculator__calculate_purge_time(state_list))
+
   # NOTE: This does not use mock and make the actual HTTP request.
   def testUsingRealTSDBData_REMOVE_THIS(self):
     power_state_ts_id = ts_id.TimeseriesID(
@@ -19,7 +19,7 @@ import os
 import sys
 import unittest
 from collections import OrderedDict
-from json import loads
+from json import dumps, loads
 from unittest.mock import Mock, patch
 
 from .context import argus_quilt
@@ -123,11 +123,13 @@ class Stepify_Tests(unittest.TestCase):
     def mocked_requests_get(self, url):
         resp_mock = Mock()
         resp_mock.status_code, resp_mock.json.return_value = self.__test_result_dict[url]
+        resp_mock.content = dumps(resp_mock.json.return_value).encode()
+        resp_mock.raw.tell.return_value = len(resp_mock.content)
         return resp_mock
 
     def mock_stepify_helper(self, t1, t2):
-        with patch('argus_tal.query_api.requests') as mock_tsdb:
-            mock_tsdb.get.side_effect = self.mocked_requests_get
+        with patch('requests.Session.get') as mock_tsdb_get:
+            mock_tsdb_get.side_effect = self.mocked_requests_get
 
             self.__setup_testcase_data(
                 t1, t2,
@@ -10,9 +10,11 @@ import argus_quilt
 import importlib.resources as pkg_resources
 
 from argus_quilt.state_set_processor_builder import StateSetProcessorBuilder
+from argus_tal.segment_store import SegmentStore
 
 
-def generate_quilt(quilt_run_description, state_spec_filepath):
+def generate_quilt(quilt_run_description, state_spec_filepath,
+                   segment_store=None):
     now = datetime.datetime.now()
     start_time_str = now.strftime("%Y-%m-%d %H:%M:%S")
     log_str_prefix = "%s [%s]" % (start_time_str, quilt_run_description)
@@ -22,7 +24,8 @@ def generate_quilt(quilt_run_description, state_spec_filepath):
     try:
         with pkg_resources.path( \
                 "argus_quilt", "SCHEMA_DEFN_state_set.json") as schema_file:
-            builder = StateSetProcessorBuilder(schema_file, "localhost", 4242)
+            builder = StateSetProcessorBuilder(schema_file, "localhost", 4242,
+                                               segment_store=segment_store)
             with open(state_spec_filepath) as file:
                 state_set_json_schema = json.load(file)
             processor = builder.build(state_set_json_schema)
@@ -38,8 +41,13 @@ def generate_quilt(quilt_run_description, state_spec_filepath):
         print("%s: run success" % log_str_prefix)
 
 def main():
-    generate_quilt("Coarse state quilt", "/home/ubuntu/quilt/appliques/extruder_states_coarse.json")
-    generate_quilt("Fine state quilt", "/home/ubuntu/quilt/appliques/extruder_states_fine.json")
+    # With ARGUS_SEGMENT_STORE_DIR set, sealed data read by both quilts (or
+    # by a re-run) is downloaded only once.
+    segment_store = None
+    if os.environ.get("ARGUS_SEGMENT_STORE_DIR"):
+        segment_store = SegmentStore(os.environ["ARGUS_SEGMENT_STORE_DIR"])
+    generate_quilt("Coarse state quilt", "/home/ubuntu/quilt/appliques/extruder_states_coarse.json", segment_store)
+    generate_quilt("Fine state quilt", "/home/ubuntu/quilt/appliques/extruder_states_fine.json", segment_store)
 
 if __name__ == '__main__':
     main()
@@ -9,13 +9,20 @@ import argus_quilt
 import importlib.resources as pkg_resources
 
 from argus_quilt.state_set_processor_builder import StateSetProcessorBuilder
+from argus_tal.segment_store import SegmentStore
 
 
 def main():
 
     with pkg_resources.path( \
             "argus_quilt", "SCHEMA_DEFN_state_set.json") as schema_file:
-        builder = StateSetProcessorBuilder(schema_file, "localhost", 4242)
+        # Past days don't change: with ARGUS_SEGMENT_STORE_DIR set, they're
+        # kept on disk and only downloaded on the first run.
+        segment_store = None
+        if os.environ.get("ARGUS_SEGMENT_STORE_DIR"):
+            segment_store = SegmentStore(os.environ["ARGUS_SEGMENT_STORE_DIR"])
+        builder = StateSetProcessorBuilder(schema_file, "localhost", 4242,
+                                           segment_store=segment_store)
         __location__ = os.path.realpath(os.path.join(os.getcwd(),
                                         os.path.dirname(__file__)))
         with open(os.path.join(__location__, \
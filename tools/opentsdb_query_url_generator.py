@@ -14,6 +14,11 @@
       curl "`./opentsdb_query_url_generator.py 65mm_extruder 5m-ago 1m-ago`"
       (note: The URL needs to be embedded to inside double quotes (") for
              the command to work).
+
+      To query all the sensor metrics the TSDB knows of (instead of the
+      hardcoded list below):
+        ./opentsdb_query_url_generator.py 65mm_extruder 5m-ago 1m-ago \
+            --discover_metrics
        
 
 '''
@@ -31,6 +36,8 @@ parser.add_argument("end_time", \
                     help="End time for query.")
 parser.add_argument("--h", \
                     help="Simple too to generate the OpenTSBD query URL.")
+parser.add_argument("--discover_metrics", action="store_true", \
+                    help="Get the metric list from the TSDB.")
 args = parser.parse_args()
 
 metric_prefix="machine.sensor"
@@ -40,8 +47,16 @@ metric_list = ["raw_melt_temperature", "raw_melt_pressure", \
                "raw_barrel_temperature_1", "raw_barrel_temperature_2", \
                "raw_machine_powerOn_state", "raw_wire_output_diameter"]
 
-query_str="http://34.221.154.248:4242/api/query?start=%s&end=%s" % \
-         (args.start_time, args.end_time)
+tsdb_host, tsdb_port = "34.221.154.248", 4242
+
+if args.discover_metrics:
+  from argus_tal import metric_catalog
+  catalog = metric_catalog.MetricCatalog(tsdb_host, tsdb_port)
+  metric_list = [metric[len(metric_prefix) + 1:] \
+                 for metric in catalog.metrics(metric_prefix + ".")]
+
+query_str="http://%s:%d/api/query?start=%s&end=%s" % \
+         (tsdb_host, tsdb_port, args.start_time, args.end_time)
 
 for metric in metric_list:
   query_str="%s&m=sum:%s.%s\{machine_name=%s\}" % (query_str, metric_prefix, \
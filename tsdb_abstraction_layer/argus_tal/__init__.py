@@ -1,8 +1,22 @@
 # Please keep the imports alphabetically sorted.
+from . import aggregate_index
+from . import async_query_api
 from . import basic_types
+from . import compressed_timeseries_datadict
 from . import exceptions
+from . import http_session_pool
+from . import metric_catalog
+from . import negative_cache
+from . import ring_buffer_timeseries
+from . import segment_store
+from . import stats_pyramid
+from . import streaming_decoder
 from . import timeseries_datadict
 from . import timeseries_id
+from . import timeseries_pattern
 from . import timestamp
 from . import query_api
+from . import query_cache
+from . import query_coalescer
 from . import query_urlgen
+from . import request_policy
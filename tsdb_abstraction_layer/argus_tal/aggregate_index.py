@@ -0,0 +1,155 @@
+'''
+  aggregate_index.py
+
+  Defines the AggregateIndex class, an optional precomputed index over a
+  TimeseriesDataDict for answering time weighted aggregate queries over
+  arbitrary time windows without walking the datapoints.
+
+  The timeseries is treated as a piecewise linear function of time i.e.
+  values between 2 consecutive datapoints are linearly interpolated. Window
+  boundaries that fall between datapoints are interpolated the same way.
+
+  Supported queries and their cost (N = number of datapoints):
+    integral(t1, t2)  Area under the curve from t1 to t2.        O(logN)
+    mean(t1, t2)      Time weighted mean i.e. integral / (t2-t1). O(logN)
+    min(t1, t2)       Smallest value from t1 to t2.              O(logN)
+    max(t1, t2)       Largest value from t1 to t2.               O(logN)
+  The O(logN) comes only from locating t1 and t2. The aggregation itself is
+  O(1).
+
+  Building the index is O(NlogN) time and memory:
+    - cumulative trapezoidal integrals and counts of NaN trapezoids: 1 float
+      and 1 int per datapoint.
+    - a sparse table each for min and max: logN floats per datapoint.
+  Thus build it for timeseries on which many window queries will be made,
+  e.g. time spent per hour or per state interval.
+
+  Windows are clipped to the time span of the timeseries. A query over a
+  window that doesn't overlap the timeseries at all returns None. A NaN
+  value (e.g. from FillPolicy.NAN) makes the results NaN for the windows
+  that cover it or are interpolated from it, and only for those.
+
+  Usage:
+    agg_idx = AggregateIndex(tsdd_obj)
+    for (t1, t2) in state_intervals:
+      avg_temperature = agg_idx.mean(t1, t2)
+      peak_temperature = agg_idx.max(t1, t2)
+'''
+
+import numpy as np
+
+class AggregateIndex(object):
+  def __init__(self, tsdd_obj):
+    self.__ts_keys_arr = tsdd_obj.get_timestamps()
+    self.__ts_values_arr = tsdd_obj.get_values()
+
+    # __cum_integral_arr[i] is the integral from the first timestamp upto the
+    # i-th timestamp, NaN trapezoids (i.e. with a NaN value at either end)
+    # counting as 0. __cum_nan_arr[i] is the number of NaN trapezoids in
+    # there. Thus a NaN only affects the windows which overlap it.
+    self.__cum_integral_arr = np.zeros(len(self.__ts_keys_arr))
+    self.__cum_nan_arr = np.zeros(len(self.__ts_keys_arr), dtype=np.int64)
+    if len(self.__ts_keys_arr) > 1:
+      areas = np.diff(self.__ts_keys_arr) * \
+              (self.__ts_values_arr[1:] + self.__ts_values_arr[:-1]) / 2.0
+      nan_areas = np.isnan(areas)
+      np.cumsum(np.where(nan_areas, 0.0, areas),
+                out=self.__cum_integral_arr[1:])
+      np.cumsum(nan_areas, out=self.__cum_nan_arr[1:])
+
+    # Sparse tables: level k holds the min (max) of each run of 2^k values
+    # starting at that index.
+    self.__min_table = self.__build_sparse_table(np.minimum)
+    self.__max_table = self.__build_sparse_table(np.maximum)
+
+  def integral(self, timestamp1, timestamp2):
+    window = self.__clip_window(timestamp1, timestamp2)
+    if window == None:
+      return None
+    return self.__window_integral(*window)
+
+  def mean(self, timestamp1, timestamp2):
+    window = self.__clip_window(timestamp1, timestamp2)
+    if window == None:
+      return None
+    clipped_t1, clipped_t2 = window
+    if clipped_t1 == clipped_t2:
+      return self.__value_at(clipped_t1)
+    return self.__window_integral(clipped_t1, clipped_t2) / \
+           (clipped_t2 - clipped_t1)
+
+  def min(self, timestamp1, timestamp2):
+    return self.__range_extreme(timestamp1, timestamp2, self.__min_table, min)
+
+  def max(self, timestamp1, timestamp2):
+    return self.__range_extreme(timestamp1, timestamp2, self.__max_table, max)
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __build_sparse_table(self, combine_func):
+    table = [self.__ts_values_arr]
+    run_len = 1
+    while 2 * run_len <= len(self.__ts_values_arr):
+      prev_level = table[-1]
+      table.append(combine_func(prev_level[:-run_len], prev_level[run_len:]))
+      run_len *= 2
+    return table
+
+  def __clip_window(self, timestamp1, timestamp2):
+    # Returns the window clipped to the span of the timeseries, or None if
+    # there's no overlap.
+    assert timestamp1 <= timestamp2
+    if len(self.__ts_keys_arr) == 0 or \
+       timestamp2 < self.__ts_keys_arr[0] or \
+       timestamp1 > self.__ts_keys_arr[-1]:
+      return None
+    return max(timestamp1, int(self.__ts_keys_arr[0])), \
+           min(timestamp2, int(self.__ts_keys_arr[-1]))
+
+  def __value_at(self, timestamp):
+    return float(np.interp(timestamp, self.__ts_keys_arr, self.__ts_values_arr))
+
+  def __integral_upto(self, timestamp):
+    # Integral from the first timestamp to the supplied timestamp, which must
+    # be within the span of the timeseries. Adds the partial trapezoid from
+    # the nearest datapoint at or before timestamp.
+    idx = int(np.searchsorted(self.__ts_keys_arr, timestamp, side='right')) - 1
+    prev_key = int(self.__ts_keys_arr[idx])
+    prev_value = float(self.__ts_values_arr[idx])
+    return float(self.__cum_integral_arr[idx]) + (timestamp - prev_key) * \
+           (prev_value + self.__value_at(timestamp)) / 2.0
+
+  def __window_integral(self, clipped_t1, clipped_t2):
+    # Integral over a window clipped to the span of the timeseries. NaN if
+    # the window overlaps a NaN trapezoid.
+    first_idx = int(np.searchsorted(self.__ts_keys_arr, clipped_t1,
+                                    side='right')) - 1
+    last_idx = int(np.searchsorted(self.__ts_keys_arr, clipped_t2,
+                                   side='left'))
+    if last_idx > first_idx and \
+       self.__cum_nan_arr[last_idx] != self.__cum_nan_arr[first_idx]:
+      return float('nan')
+    return self.__integral_upto(clipped_t2) - self.__integral_upto(clipped_t1)
+
+  def __range_extreme(self, timestamp1, timestamp2, table, pick_func):
+    window = self.__clip_window(timestamp1, timestamp2)
+    if window == None:
+      return None
+    clipped_t1, clipped_t2 = window
+
+    # Since values are interpolated linearly, the extreme is either at one of
+    # the window edges or at a datapoint within the window.
+    candidates = [self.__value_at(clipped_t1), self.__value_at(clipped_t2)]
+    first_idx = int(np.searchsorted(self.__ts_keys_arr, clipped_t1,
+                                    side='left'))
+    last_idx = int(np.searchsorted(self.__ts_keys_arr, clipped_t2,
+                                   side='right')) - 1
+    if first_idx <= last_idx:
+      level = (last_idx - first_idx + 1).bit_length() - 1
+      candidates.append(float(table[level][first_idx]))
+      candidates.append(float(table[level][last_idx - (1 << level) + 1]))
+    # The builtin min()/max() would skip a NaN, or not, depending on order.
+    if np.isnan(candidates).any():
+      return float('nan')
+    return pick_func(candidates)
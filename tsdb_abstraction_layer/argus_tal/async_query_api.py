@@ -0,0 +1,129 @@
+'''
+  asyncio flavour of the QueryApi.
+
+  AsyncQueryApi takes exactly the same arguments as QueryApi and returns the
+  very same results (TimeseriesDataDict objects), but populate_ts_data() is a
+  coroutine. Thus code running in an event loop can issue several queries at
+  once instead of serializing on network latency, and existing code can
+  switch over one call site at a time.
+
+  This is a thread based wrapper, not a native asyncio client: the HTTP
+  request (and the parsing of its response) is run on a worker thread over
+  the shared pool of persistent connections (see http_session_pool.py), so
+  the event loop is never blocked.
+
+  iter_results() isn't offered, as it blocks on the network between the
+  timeseries it yields. Use populate_ts_data(), or run
+  QueryApi.iter_results() on a worker thread.
+
+Example usage:
+    q1 = AsyncQueryApi("10.121.32.1", 4242, t1, t2, [ts_id1], Aggregator.NONE)
+    q2 = AsyncQueryApi("10.121.32.1", 4242, t2, t3, [ts_id1], Aggregator.NONE)
+
+    # Either, one at a time ...
+    rv = await q1.populate_ts_data()
+
+    # ... or many at once, with at most 4 queries in flight.
+    rv_list = await gather_queries([q1, q2], max_concurrency=4)
+    for q_obj, rv in zip([q1, q2], rv_list):
+      if rv == 0:
+        ... q_obj.get_result_map() ...
+
+    # From synchronous code:
+    rv_list = asyncio.run(gather_queries([q1, q2]))
+'''
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from . import http_session_pool as hspool
+from . import query_api
+
+class AsyncQueryApi(object):
+  '''See QueryApi for the description of the constructor arguments.'''
+  def __init__(self, *args, **kwargs):
+    self.__query_api = query_api.QueryApi(*args, **kwargs)
+
+  async def populate_ts_data(self, executor=None):
+    '''Coroutine equivalent of QueryApi.populate_ts_data(), with the same
+       return values. executor is the concurrent.futures.Executor on which the
+       query is run, None means the event loop's default executor.'''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor,
+                                      self.__query_api.populate_ts_data)
+
+  def get_result_set(self):
+    return self.__query_api.get_result_set()
+
+  def get_result_map(self):
+    return self.__query_api.get_result_map()
+
+  def get_result_map_for(self, tsid):
+    return self.__query_api.get_result_map_for(tsid)
+
+  def get_result_as_dataframes(self):
+    return self.__query_api.get_result_as_dataframes()
+
+  @property
+  def http_status_code(self):
+    return self.__query_api.http_status_code
+
+  @property
+  def transfer_stats(self):
+    return self.__query_api.transfer_stats
+
+  @property
+  def query_telemetry(self):
+    return self.__query_api.query_telemetry
+
+
+DEFAULT_MAX_CONCURRENCY = hspool.DEFAULT_MAX_CONNECTIONS_PER_HOST
+
+async def gather_queries(query_obj_list,
+                         max_concurrency=DEFAULT_MAX_CONCURRENCY):
+  '''
+  Runs populate_ts_data() for all the AsyncQueryApi objects in
+  query_obj_list, keeping at most max_concurrency of them in flight. Returns
+  the list of their return values, in the same order as query_obj_list.
+
+  Results are then accessed from each query object as usual. A query that
+  returns an error doesn't affect the others. As with QueryApi, exceptions
+  (e.g. the TSDB could not be reached) are raised to the caller.
+
+  Keep max_concurrency at or below the max_connections_per_host of the HTTP
+  session pool in use, otherwise the extra queries open connections that
+  aren't kept.
+
+  If gathering is cancelled (or a query raises), the queries not started yet
+  are dropped. Those in flight run to completion on their worker threads, in
+  the background: the event loop doesn't wait for them.
+  '''
+  assert max_concurrency > 0
+  if len(query_obj_list) == 0:
+    return []
+  executor = _DroppingExecutor(max_workers=max_concurrency)
+  try:
+    return list(await asyncio.gather(
+        *[q_obj.populate_ts_data(executor) for q_obj in query_obj_list]))
+  finally:
+    # Not a "with" block: waiting for the worker threads would block the
+    # event loop.
+    executor.drop_pending()
+    executor.shutdown(wait=False)
+
+
+class _DroppingExecutor(ThreadPoolExecutor):
+  # A ThreadPoolExecutor which can drop the calls not started yet, as
+  # shutdown(cancel_futures=True) does from python 3.9 on.
+  def __init__(self, *args, **kwargs):
+    super(_DroppingExecutor, self).__init__(*args, **kwargs)
+    self.__futures = []
+
+  def submit(self, *args, **kwargs):
+    future = super(_DroppingExecutor, self).submit(*args, **kwargs)
+    self.__futures.append(future)
+    return future
+
+  def drop_pending(self):
+    for future in self.__futures:
+      future.cancel()   # No effect on those running or done.
@@ -8,12 +8,18 @@ class Tsdb(Enum):
   PROMETHEUS = 2
   METRICTANK = 3
 
-# Query response aggregator
+# Query response aggregator. Also used as the downsampling function.
 class Aggregator(Enum):
   NONE = 1
-  ''' These will be supported in follow-up commits.
   SUM = 2
   COUNT = 3
   MIN = 4
   MAX = 5
-  '''
+  AVG = 6
+
+# What a downsampled query returns for buckets without any datapoint.
+class FillPolicy(Enum):
+  NONE = 1    # Bucket left out (interpolated over when aggregating).
+  NAN = 2     # NaN.
+  NULL = 3    # null in the response, NaN once parsed.
+  ZERO = 4    # 0.
@@ -0,0 +1,397 @@
+'''
+  compressed_timeseries_datadict.py
+
+  This file defines the CompressedTimeseriesDataDict class, a compressed (and
+  immutable) in-memory form of a TimeseriesDataDict.
+
+  Encoding:
+  ========
+  Datapoints are split into blocks of a fixed number of datapoints. The first
+  timestamp and value of every block are stored as is. The remaining
+  datapoints of a block are encoded into a bitstream using the scheme
+  described in Facebook's Gorilla paper:
+
+    Timestamps: The delta-of-delta (dod) between consecutive timestamps is
+      stored using a variable length encoding:
+         '0'                    dod == 0
+         '10'   + 7 bits        -63 <= dod <= 64
+         '110'  + 9 bits        -255 <= dod <= 256
+         '1110' + 12 bits       -2047 <= dod <= 2048
+         '1111' + 64 bits       otherwise (the delta itself is stored)
+      A regularly sampled timeseries thus costs 1 bit per timestamp.
+
+    Values: Each value is XOR'd with the previous value (as 64bit IEEE 754
+      patterns). Only the meaningful bits of the XOR are stored:
+         '0'                    XOR is 0 i.e. value didn't change
+         '10' + meaningful bits meaningful bits fit in the previous window
+         '11' + 5 bits (leading zeros) + 6 bits (length - 1) + meaningful bits
+      A slowly varying timeseries typically costs a handful of bits per value.
+
+  Since the XOR is over the bit patterns the encoding is lossless, including
+  for NaN and infinities.
+
+  Random access:
+  =============
+  The first and last timestamps of all blocks are kept in (uncompressed) numpy
+  arrays. A lookup does a binary search over those to find the one block that
+  can hold the answer and decodes only that block.
+'''
+
+import numpy as np
+
+from . import timeseries_datadict as tsdd
+from .timeseries_datadict import LookupQualifier
+
+# Default number of datapoints per block. Larger blocks compress slightly
+# better, smaller blocks make random access cheaper.
+DEFAULT_BLOCK_SIZE = 1024
+
+# (prefix bits, prefix length, payload length, smallest dod) for each of the
+# bounded delta-of-delta buckets. The payload stores (dod - smallest dod).
+_DOD_BUCKETS = [
+  (0b10, 2, 7, -63),
+  (0b110, 3, 9, -255),
+  (0b1110, 4, 12, -2047),
+]
+_DOD_FALLBACK_PREFIX = 0b1111
+_DOD_FALLBACK_PREFIX_LEN = 4
+
+_MAX_LEADING_ZEROS = 31  # largest value that fits in the 5 bit field.
+
+
+class _BitWriter(object):
+  '''Accumulates variable length bit fields. Bits are kept as a list of '0'/'1'
+     strings, which keeps appends cheap in pure Python.'''
+  def __init__(self):
+    self.__parts = []
+    self.__num_bits = 0
+
+  def write(self, value, num_bits):
+    self.__parts.append(format(value, '0%db' % num_bits))
+    self.__num_bits += num_bits
+
+  def to_bytes(self):
+    if self.__num_bits == 0:
+      return b''
+    return int(''.join(self.__parts), 2).to_bytes(
+        (self.__num_bits + 7) // 8, 'big')
+
+  @property
+  def num_bits(self):
+    return self.__num_bits
+
+
+class _BitReader(object):
+  def __init__(self, data, num_bits):
+    if num_bits == 0:
+      self.__bits = ''
+    else:
+      # to_bytes() above pads with leading zeros to the next byte boundary.
+      pad_bits = len(data) * 8 - num_bits
+      self.__bits = format(int.from_bytes(data, 'big'),
+                           '0%db' % (len(data) * 8))[pad_bits:]
+    self.__pos = 0
+
+  def read(self, num_bits):
+    value = int(self.__bits[self.__pos:self.__pos + num_bits], 2)
+    self.__pos += num_bits
+    return value
+
+  def read_bit(self):
+    bit = self.__bits[self.__pos] == '1'
+    self.__pos += 1
+    return bit
+
+
+def _encode_block(keys, value_bits):
+  '''keys and value_bits are lists of Python ints (timestamps and the IEEE 754
+     patterns of the values). Encodes all datapoints except the first one.
+     Returns (bytes, number of bits).'''
+  writer = _BitWriter()
+  prev_key, prev_delta = keys[0], 0
+  prev_bits = value_bits[0]
+  prev_leading, prev_trailing = None, None
+
+  for idx in range(1, len(keys)):
+    # Timestamp
+    delta = keys[idx] - prev_key
+    dod = delta - prev_delta
+    if dod == 0:
+      writer.write(0, 1)
+    else:
+      for prefix, prefix_len, payload_len, min_dod in _DOD_BUCKETS:
+        if min_dod <= dod < min_dod + (1 << payload_len):
+          writer.write(prefix, prefix_len)
+          writer.write(dod - min_dod, payload_len)
+          break
+      else:
+        writer.write(_DOD_FALLBACK_PREFIX, _DOD_FALLBACK_PREFIX_LEN)
+        writer.write(delta, 64)
+    prev_key, prev_delta = keys[idx], delta
+
+    # Value
+    xor = value_bits[idx] ^ prev_bits
+    prev_bits = value_bits[idx]
+    if xor == 0:
+      writer.write(0, 1)
+      continue
+    leading = min(64 - xor.bit_length(), _MAX_LEADING_ZEROS)
+    trailing = (xor & -xor).bit_length() - 1
+    if prev_leading != None and \
+       leading >= prev_leading and trailing >= prev_trailing:
+      writer.write(0b10, 2)
+      writer.write(xor >> prev_trailing, 64 - prev_leading - prev_trailing)
+    else:
+      meaningful_len = 64 - leading - trailing
+      writer.write(0b11, 2)
+      writer.write(leading, 5)
+      writer.write(meaningful_len - 1, 6)
+      writer.write(xor >> trailing, meaningful_len)
+      prev_leading, prev_trailing = leading, trailing
+
+  return writer.to_bytes(), writer.num_bits
+
+
+def _decode_block(first_key, first_value_bits, count, data, num_bits):
+  '''Inverse of _encode_block(). Returns (keys, values) numpy arrays.'''
+  reader = _BitReader(data, num_bits)
+  keys = [first_key]
+  value_bits = [first_value_bits]
+  prev_delta = 0
+  prev_leading, prev_trailing = None, None
+
+  for _ in range(1, count):
+    # Timestamp
+    if not reader.read_bit():
+      delta = prev_delta
+    else:
+      # Each prefix is a run of '1's terminated by a '0', except for the
+      # fallback ('1111'). The first '1' has been consumed already.
+      for prefix, prefix_len, payload_len, min_dod in _DOD_BUCKETS:
+        if not reader.read_bit():
+          delta = prev_delta + reader.read(payload_len) + min_dod
+          break
+      else:
+        delta = reader.read(64)
+    keys.append(keys[-1] + delta)
+    prev_delta = delta
+
+    # Value
+    if not reader.read_bit():
+      value_bits.append(value_bits[-1])
+      continue
+    if not reader.read_bit():
+      meaningful_len = 64 - prev_leading - prev_trailing
+      xor = reader.read(meaningful_len) << prev_trailing
+    else:
+      prev_leading = reader.read(5)
+      meaningful_len = reader.read(6) + 1
+      prev_trailing = 64 - prev_leading - meaningful_len
+      xor = reader.read(meaningful_len) << prev_trailing
+    value_bits.append(value_bits[-1] ^ xor)
+
+  return np.array(keys, dtype=np.int64), \
+         np.array(value_bits, dtype=np.uint64).view(np.float64)
+
+
+'''
+  A compressed, immutable timeseries. Intended for holding long histories in
+  memory e.g. for caches and continuous processing.
+
+  Supports the same read API as TimeseriesDataDict i.e. get_timeseries_id(),
+  get_datapoint(), get_iter_slice(), get_min_key() / get_max_key(),
+  is_empty(), iteration and len(). Iteration decodes one block at a time.
+
+  Additional API:
+    from_timeseries_datadict(tsdd_obj, block_size=DEFAULT_BLOCK_SIZE)
+      Compresses an existing TimeseriesDataDict.
+
+    to_timeseries_datadict()
+      Decompresses into a TimeseriesDataDict. The round trip is lossless.
+
+    get_compressed_size()
+      Number of bytes used by the compressed bitstreams and block index.
+
+  Usage:
+    c_obj = CompressedTimeseriesDataDict.from_timeseries_datadict(tsdd_obj)
+    for timestamp, value in c_obj:
+      ...
+    (timestamp, value) = c_obj.get_datapoint(ts, LookupQualifier.NEAREST_SMALLER)
+'''
+class CompressedTimeseriesDataDict(object):
+  '''
+    ts_id_obj: TimeseriesID identifying the timeseries.
+
+    datapoints_dict: A dictionary of timestamps to data values (as accepted by
+                     TimeseriesDataDict).
+  '''
+  def __init__(self, ts_id_obj, datapoints_dict,
+               block_size=DEFAULT_BLOCK_SIZE):
+    self.__init_from_columns(
+        tsdd.TimeseriesDataDict(ts_id_obj, datapoints_dict), block_size)
+
+  @classmethod
+  def from_timeseries_datadict(cls, tsdd_obj, block_size=DEFAULT_BLOCK_SIZE):
+    c_obj = cls.__new__(cls)
+    c_obj.__init_from_columns(tsdd_obj, block_size)
+    return c_obj
+
+  def __init_from_columns(self, tsdd_obj, block_size):
+    assert block_size > 0
+    self.__ts_id_obj = tsdd_obj.get_timeseries_id()
+    self.__num_dps = len(tsdd_obj)
+
+    keys_arr = tsdd_obj.get_timestamps()
+    value_bits_arr = tsdd_obj.get_values().view(np.uint64)
+    block_starts = list(range(0, self.__num_dps, block_size))
+
+    # Block index. All of these are indexed by block number.
+    self.__block_offsets = np.array(block_starts, dtype=np.int64)
+    self.__block_first_keys = keys_arr[block_starts].copy()
+    self.__block_last_keys = keys_arr[
+        [min(start + block_size, self.__num_dps) - 1 for start in block_starts]
+    ].copy()
+    self.__block_first_value_bits = value_bits_arr[block_starts].copy()
+    self.__block_counts = []
+    self.__block_data = []      # bytes objects holding the bitstreams
+    self.__block_num_bits = []
+
+    for start in block_starts:
+      end = min(start + block_size, self.__num_dps)
+      data, num_bits = _encode_block(keys_arr[start:end].tolist(),
+                                     value_bits_arr[start:end].tolist())
+      self.__block_counts.append(end - start)
+      self.__block_data.append(data)
+      self.__block_num_bits.append(num_bits)
+
+    # Most recently decoded block: (block number, keys, values). Lookups tend
+    # to be close to each other, so this saves repeated decoding.
+    self.__decoded_block = (None, None, None)
+
+  def to_timeseries_datadict(self):
+    keys_list, values_list = [], []
+    for block_idx in range(len(self.__block_counts)):
+      keys, values = self.__decode(block_idx)
+      keys_list.append(keys)
+      values_list.append(values)
+    if len(keys_list) == 0:
+      return tsdd.TimeseriesDataDict(self.__ts_id_obj, {})
+    return tsdd.TimeseriesDataDict.from_arrays(self.__ts_id_obj,
+                                               np.concatenate(keys_list),
+                                               np.concatenate(values_list))
+
+  def get_compressed_size(self):
+    return sum(len(data) for data in self.__block_data) + \
+           self.__block_offsets.nbytes + self.__block_first_keys.nbytes + \
+           self.__block_last_keys.nbytes + \
+           self.__block_first_value_bits.nbytes
+
+  def get_timeseries_id(self):
+    return self.__ts_id_obj
+
+  def get_iter_slice(self, timestamp1, lookup_qualifier1,
+                           timestamp2, lookup_qualifier2):
+    '''See TimeseriesDataDict.get_iter_slice().'''
+    return (self.__search(timestamp1, lookup_qualifier1)[0],
+            self.__search(timestamp2, lookup_qualifier2)[0])
+
+  def get_datapoint(self, timestamp, lookup_qualifier):
+    '''See TimeseriesDataDict.get_datapoint().'''
+    if lookup_qualifier == LookupQualifier.EXACT_MATCH:
+      return timestamp, self.__search(int(timestamp), lookup_qualifier)[2]
+    idx, key, value = self.__search(timestamp, lookup_qualifier)
+    if idx == None:
+      return timestamp, None
+    return key, value
+
+  def get_min_key(self):
+    return int(self.__block_first_keys[0])
+
+  def get_max_key(self):
+    return int(self.__block_last_keys[-1])
+
+  def is_empty(self):
+    return self.__num_dps == 0
+
+  #############################################################################
+  # Non-public methods BUT supporting a public interface start here e.g.
+  # iteration, len() etc. start here.
+  #############################################################################
+  def __iter__(self):
+    for block_idx in range(len(self.__block_counts)):
+      keys, values = self.__decode(block_idx)
+      yield from zip(keys.tolist(), values.tolist())
+
+  def __len__(self):
+    return self.__num_dps
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __decode(self, block_idx):
+    cached_idx, keys, values = self.__decoded_block
+    if cached_idx != block_idx:
+      keys, values = _decode_block(int(self.__block_first_keys[block_idx]),
+                                   int(self.__block_first_value_bits[block_idx]),
+                                   self.__block_counts[block_idx],
+                                   self.__block_data[block_idx],
+                                   self.__block_num_bits[block_idx])
+      self.__decoded_block = (block_idx, keys, values)
+    return keys, values
+
+  def __search(self, timestamp, lookup_qualifier):
+    '''
+    Returns (index, timestamp, value) of the datapoint selected by
+    lookup_qualifier, or (None, None, None) if there's no such datapoint.
+
+    First the block holding the answer is found using the block index:
+      - Nearest smaller (or exact) key lies in the last block whose first key
+        is smaller than (or equal to) the supplied timestamp.
+      - Nearest larger key lies in the first block whose last key is larger
+        than the supplied timestamp.
+    Then a regular lookup is done within that block. If no block qualifies,
+    the *_WEAK qualifiers fall back to the first/last datapoint overall.
+    '''
+    num_blocks = len(self.__block_counts)
+    if num_blocks == 0:
+      return None, None, None
+
+    if lookup_qualifier == LookupQualifier.EXACT_MATCH:
+      block_idx = int(np.searchsorted(self.__block_first_keys, timestamp,
+                                      side='right')) - 1
+      block_qualifier = lookup_qualifier
+    elif lookup_qualifier == LookupQualifier.NEAREST_SMALLER or \
+         lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK:
+      block_idx = int(np.searchsorted(self.__block_first_keys, timestamp,
+                                      side='left')) - 1
+      block_qualifier = LookupQualifier.NEAREST_SMALLER
+      if block_idx < 0 and \
+         lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK:
+        return self.__datapoint_at(0, 0)
+    else:
+      assert lookup_qualifier == LookupQualifier.NEAREST_LARGER or \
+             lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK
+      block_idx = int(np.searchsorted(self.__block_last_keys, timestamp,
+                                      side='right'))
+      block_qualifier = LookupQualifier.NEAREST_LARGER
+      if block_idx == num_blocks:
+        if lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK:
+          return self.__datapoint_at(num_blocks - 1, -1)
+        block_idx = -1
+
+    if block_idx < 0:
+      return None, None, None
+
+    keys, values = self.__decode(block_idx)
+    idx = tsdd._search_timestamp_index(keys, timestamp, block_qualifier)
+    if idx == None:
+      return None, None, None
+    return self.__datapoint_at(block_idx, idx)
+
+  def __datapoint_at(self, block_idx, idx_in_block):
+    # Returns (index, timestamp, value) for a position within a block.
+    # idx_in_block may be negative to count from the end of the block.
+    keys, values = self.__decode(block_idx)
+    idx_in_block = idx_in_block % len(keys)
+    return int(self.__block_offsets[block_idx]) + idx_in_block, \
+           int(keys[idx_in_block]), float(values[idx_in_block])
@@ -32,3 +32,29 @@ class WildcardedTimeseriesId(TsdbAbstractionLayerError):
   def __init__(self, err_str):
     super(TsdbAbstractionLayerError, self).__init__(type(self).__name__, \
                                                     err_str)
+
+'''
+  A TimeseriesPattern tag value OpenTSDB can't filter on e.g. "m1|m*" (a
+  value is either a wildcard or a literal_or list) or "m1||m2".
+'''
+class InvalidTimeseriesPattern(TsdbAbstractionLayerError):
+  def __init__(self, err_str):
+    super(InvalidTimeseriesPattern, self).__init__(type(self).__name__, \
+                                                   err_str)
+
+'''
+  Downsample spec OpenTSDB wouldn't accept e.g. an interval of "5 mins".
+'''
+class InvalidDownsampleSpec(TsdbAbstractionLayerError):
+  def __init__(self, err_str):
+    super(InvalidDownsampleSpec, self).__init__(type(self).__name__, err_str)
+
+'''
+  A query failed. Raised where a return code can't be used (e.g. by
+  QueryApi.iter_results()). error_code is the value that
+  QueryApi.populate_ts_data() would have returned for the same failure.
+'''
+class QueryFailed(TsdbAbstractionLayerError):
+  def __init__(self, err_str, error_code):
+    super(QueryFailed, self).__init__(type(self).__name__, err_str)
+    self.error_code = error_code
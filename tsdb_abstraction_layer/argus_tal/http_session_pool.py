@@ -0,0 +1,192 @@
+'''
+  http_session_pool.py
+
+  Defines HttpSessionPool: a pool of persistent (keep-alive) HTTP connections
+  to the TSDB, shared by everyone talking to it.
+
+  Calling requests.get() / requests.post() directly opens (and tears down) a
+  TCP connection per call. A process that queries the TSDB and then writes N
+  results back every period thus pays for N+1 connection setups per period.
+  Going through an HttpSessionPool instead, connections are kept open and
+  reused across calls (and across QueryApi objects).
+
+  Configuration:
+    max_connections_per_host: Number of connections kept open per host. Also
+                              the max number of concurrent requests to a host
+                              if block_when_full is True.
+    max_hosts:                Number of hosts for which connections are kept.
+    connect_timeout,
+    read_timeout:             Default timeouts (in secs) applied to every
+                              request that doesn't supply its own.
+    block_when_full:          If True, a request made while all connections
+                              to its host are busy waits for one to free up.
+                              Otherwise an extra (not kept) connection is
+                              opened.
+    accept_encoding:          Content encodings (compression) accepted in
+                              responses, sent as the Accept-Encoding header of
+                              every request. Responses are decompressed
+                              transparently (and as they stream in). None
+                              leaves it to requests.
+
+  A process wide default pool is returned by get_default_pool(). It is used by
+  QueryApi and by quilt unless they're handed a pool explicitly. To change
+  its configuration:
+    http_session_pool.set_default_pool(
+        http_session_pool.HttpSessionPool(max_connections_per_host=4))
+
+  Sizing the pool:
+    get_stats() reports, for each host, the number of requests made and the
+    number of connections opened. If connections opened keeps growing with
+    the number of requests, the pool is too small for the concurrency needed.
+
+  Bandwidth:
+    Readers of a response may report the bytes it took on the wire (i.e.
+    compressed) and once decoded through record_transfer(), as QueryApi
+    does. get_stats() reports the totals, e.g. to check how much compression
+    saves on a slow link.
+'''
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 10
+DEFAULT_MAX_HOSTS = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0    # secs
+DEFAULT_READ_TIMEOUT = 60.0      # secs
+# JSON query responses compress ~10:1. OpenTSDB only does gzip and deflate, so
+# those are the only ones offered (requests would also offer br/zstd if their
+# modules happen to be installed).
+DEFAULT_ACCEPT_ENCODING = 'gzip, deflate'
+
+class _DefaultTimeoutAdapter(HTTPAdapter):
+  # requests has no notion of a session wide timeout, so it's supplied here
+  # for requests made without one.
+  def __init__(self, timeout, **kwargs):
+    self.__timeout = timeout
+    super(_DefaultTimeoutAdapter, self).__init__(**kwargs)
+
+  def send(self, request, **kwargs):
+    if kwargs.get('timeout') == None:
+      kwargs['timeout'] = self.__timeout
+    return super(_DefaultTimeoutAdapter, self).send(request, **kwargs)
+
+
+class HttpSessionPool(object):
+  def __init__(self, max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+               max_hosts=DEFAULT_MAX_HOSTS,
+               connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+               read_timeout=DEFAULT_READ_TIMEOUT,
+               block_when_full=False,
+               accept_encoding=DEFAULT_ACCEPT_ENCODING):
+    assert max_connections_per_host > 0 and max_hosts > 0
+    self.__max_connections_per_host = max_connections_per_host
+    self.__adapter = _DefaultTimeoutAdapter(
+        (connect_timeout, read_timeout), pool_connections=max_hosts,
+        pool_maxsize=max_connections_per_host, pool_block=block_when_full)
+    self.__session = requests.Session()
+    self.__session.mount('http://', self.__adapter)
+    self.__session.mount('https://', self.__adapter)
+    if accept_encoding != None:
+      self.__session.headers['Accept-Encoding'] = accept_encoding
+
+    self.__stats_lock = threading.Lock()
+    self.__num_requests = 0
+    self.__num_failed_requests = 0   # Requests that raised an exception.
+    self.__wire_bytes = 0            # See record_transfer().
+    self.__decoded_bytes = 0
+
+  def get(self, url, **kwargs):
+    '''Same as requests.get(), but over a pooled connection.'''
+    return self.__do_request(self.__session.get, url, **kwargs)
+
+  def post(self, url, **kwargs):
+    '''Same as requests.post(), but over a pooled connection.'''
+    return self.__do_request(self.__session.post, url, **kwargs)
+
+  def record_transfer(self, wire_bytes, decoded_bytes):
+    '''Accounts for a response body which took wire_bytes on the wire and
+       decoded_bytes once decompressed.'''
+    with self.__stats_lock:
+      self.__wire_bytes += wire_bytes
+      self.__decoded_bytes += decoded_bytes
+
+  def get_stats(self):
+    '''Returns a dictionary of pool statistics:
+         requests:        Number of requests made through this pool.
+         failed_requests: Number of those that raised an exception (e.g.
+                          timeout or connection refused).
+         connections_opened, requests_sent:
+                          Totals of the per host numbers below.
+         wire_bytes, decoded_bytes:
+                          Totals reported through record_transfer().
+         hosts:           host:port -> {'connections_opened': ...,
+                                        'requests_sent': ...}
+       Per host numbers only cover the hosts currently in the pool.'''
+    hosts = {}
+    pool_manager = self.__adapter.poolmanager
+    for pool_key in list(pool_manager.pools.keys()):
+      conn_pool = pool_manager.pools.get(pool_key)
+      if conn_pool == None:
+        continue  # Evicted since we listed the keys.
+      hosts["%s:%s" % (conn_pool.host, conn_pool.port)] = {
+          'connections_opened': conn_pool.num_connections,
+          'requests_sent': conn_pool.num_requests,
+      }
+    with self.__stats_lock:
+      num_requests = self.__num_requests
+      num_failed_requests = self.__num_failed_requests
+      wire_bytes, decoded_bytes = self.__wire_bytes, self.__decoded_bytes
+    return {
+      'requests': num_requests,
+      'failed_requests': num_failed_requests,
+      'wire_bytes': wire_bytes,
+      'decoded_bytes': decoded_bytes,
+      'connections_opened': sum(hh['connections_opened']
+                                for hh in hosts.values()),
+      'requests_sent': sum(hh['requests_sent'] for hh in hosts.values()),
+      'max_connections_per_host': self.__max_connections_per_host,
+      'hosts': hosts,
+    }
+
+  def close(self):
+    '''Closes all the pooled connections. The pool remains usable, new
+       connections get opened as needed.'''
+    self.__session.close()
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __do_request(self, request_func, url, **kwargs):
+    with self.__stats_lock:
+      self.__num_requests += 1
+    try:
+      return request_func(url, **kwargs)
+    except requests.exceptions.RequestException:
+      with self.__stats_lock:
+        self.__num_failed_requests += 1
+      raise
+
+
+#############################################################################
+# Process wide default pool.
+#############################################################################
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def get_default_pool():
+  '''Returns the process wide HttpSessionPool, creating it (with the default
+     configuration) on first use.'''
+  global _default_pool
+  with _default_pool_lock:
+    if _default_pool == None:
+      _default_pool = HttpSessionPool()
+    return _default_pool
+
+def set_default_pool(pool):
+  '''Replaces the process wide HttpSessionPool. Objects already holding the
+     previous pool keep using it.'''
+  global _default_pool
+  with _default_pool_lock:
+    _default_pool = pool
@@ -0,0 +1,199 @@
+'''
+  metric_catalog.py
+
+  Defines MetricCatalog: a client for the TSDB's metadata (which metrics
+  exist, and which timeseries i.e. tag sets each metric has), cached in
+  memory.
+
+  Tools and appliques used to hardcode metric lists and tag sets. With a
+  MetricCatalog they're discovered from the TSDB instead (OpenTSDB's
+  /api/suggest and /api/search/lookup endpoints). Metadata is fetched at most
+  once per ttl: the list of metrics as a whole, the tag sets per metric. All
+  the lookups (metrics by prefix, tag values, resolving a TimeseriesPattern
+  into the TimeseriesIDs it matches) are then answered in memory, so
+  resolving the series of a large fleet doesn't cost a metadata round trip
+  per machine.
+
+  Should a refresh fail (HTTP or network error, bad response), the stale
+  metadata (if any) is used for another ttl. Without any,
+  exceptions.QueryFailed is raised (error_code as for
+  QueryApi.populate_ts_data(), -1 for a network error too).
+
+  Configuration:
+    ttl:          Secs after which metadata is fetched again (on next use).
+    max_metrics:  Upper bound on the number of metric names fetched.
+    max_series:   Upper bound on the number of timeseries fetched per metric.
+
+  Statistics (get_stats()):
+    hits:     Lookups answered from the cache.
+    fetches:  Metadata requests sent.
+    errors:   Metadata requests that failed.
+
+Example usage:
+    catalog = MetricCatalog("10.121.32.1", 4242)
+    catalog.metrics("machine.sensor.")    # All the sensor metrics.
+    catalog.tag_values("machine.sensor.raw_melt_temperature", "machine_name")
+    tsid_list = catalog.resolve(TimeseriesPattern(
+        "machine.sensor.raw_melt_temperature", {"machine_name": "*"}))
+'''
+
+import bisect
+import threading
+import time
+
+import requests
+
+from . import basic_types
+from . import exceptions as excp
+from . import http_session_pool as hspool
+from . import query_urlgen as qurlgen
+from . import timeseries_id as ts_id
+from . import timeseries_pattern as tspat
+
+DEFAULT_TTL = 600     # secs
+DEFAULT_MAX_METRICS = 100000
+DEFAULT_MAX_SERIES = 100000
+
+_METRICS_KEY = ('metrics',)   # Cache key of the metric list.
+
+class _CatalogEntry(object):
+  # Metadata fetched and when it was (last) fetched.
+  def __init__(self, data):
+    self.data = data
+    self.fetch_time = time.monotonic()
+
+
+class MetricCatalog(object):
+  def __init__(self, http_host, http_port, ttl=DEFAULT_TTL,
+               max_metrics=DEFAULT_MAX_METRICS,
+               max_series=DEFAULT_MAX_SERIES,
+               tsdb_platform=basic_types.Tsdb.OPENTSDB,
+               http_session_pool=None):
+    self.__http_host = http_host
+    self.__http_port = http_port
+    self.__ttl = ttl
+    self.__max_metrics = max_metrics
+    self.__max_series = max_series
+    self.__tsdb_platform = tsdb_platform
+    if http_session_pool == None:
+      http_session_pool = hspool.get_default_pool()
+    self.__http_session_pool = http_session_pool
+
+    self.__lock = threading.Lock()
+    # _METRICS_KEY -> sorted metric names, metric -> list of TimeseriesIDs.
+    self.__entries = {}
+    self.__num_hits = 0
+    self.__num_fetches = 0
+    self.__num_errors = 0
+
+  def metrics(self, prefix=''):
+    '''Returns the sorted list of the metrics whose name starts with
+       prefix.'''
+    names = self.__cached(_METRICS_KEY, self.__fetch_metrics)
+    result = []
+    for name in names[bisect.bisect_left(names, prefix):]:
+      if not name.startswith(prefix):
+        break
+      result.append(name)
+    return result
+
+  def series(self, metric_id):
+    '''Returns the list of TimeseriesIDs of all the timeseries of
+       metric_id (i.e. 1 per tag set).'''
+    return list(self.__cached(metric_id,
+                              lambda: self.__fetch_series(metric_id)))
+
+  def tag_values(self, metric_id, tagk, tag_filters=None):
+    '''Returns the sorted list of the values tagk takes in the timeseries of
+       metric_id. With tag_filters (as for a TimeseriesPattern), only in the
+       timeseries they match.'''
+    pattern = tspat.TimeseriesPattern(metric_id, tag_filters or {})
+    return sorted({tsid.filters[tagk] for tsid in self.resolve(pattern)
+                   if tagk in tsid.filters})
+
+  def resolve(self, tsid):
+    '''Returns the TimeseriesIDs of the timeseries a query for tsid (a
+       TimeseriesPattern or a TimeseriesID) would return.'''
+    return [series_tsid for series_tsid in self.series(tsid.metric_id)
+            if tsid.selects(series_tsid)]
+
+  def invalidate(self, metric_id=None):
+    '''Drops the cached tag sets of metric_id, or all the cached metadata if
+       metric_id is None. It's fetched again on next use.'''
+    with self.__lock:
+      if metric_id == None:
+        self.__entries.clear()
+      else:
+        self.__entries.pop(metric_id, None)
+
+  def get_stats(self):
+    '''Returns a dictionary of catalog statistics, see top of file.'''
+    with self.__lock:
+      return {
+        'hits': self.__num_hits,
+        'fetches': self.__num_fetches,
+        'errors': self.__num_errors,
+      }
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __cached(self, key, fetch_func):
+    # Returns the cached data for key, or else (or once stale) fetch_func().
+    with self.__lock:
+      entry = self.__entries.get(key)
+      if entry != None and time.monotonic() - entry.fetch_time < self.__ttl:
+        self.__num_hits += 1
+        return entry.data
+      self.__num_fetches += 1
+
+    try:
+      data = fetch_func()
+    except excp.QueryFailed:
+      with self.__lock:
+        self.__num_errors += 1
+        if entry == None:
+          raise
+        # Keep using the stale data, don't retry before another ttl.
+        entry.fetch_time = time.monotonic()
+        return entry.data
+
+    with self.__lock:
+      self.__entries[key] = _CatalogEntry(data)
+    return data
+
+  def __fetch_json(self, url, flag_404_is_empty=False):
+    try:
+      response = self.__http_session_pool.get(url)
+    except requests.exceptions.RequestException as err:
+      # e.g. connection refused or timed out: as for an HTTP error.
+      raise excp.QueryFailed("Request failed: %s" % err, -1)
+    if response.status_code == 404 and flag_404_is_empty:
+      return None
+    if response.status_code < 200 or response.status_code > 299:
+      raise excp.QueryFailed("HTTP error %d" % response.status_code, -1)
+    try:
+      return response.json()
+    except ValueError as err:
+      raise excp.QueryFailed("Bad JSON response: %s" % err, -2)
+
+  def __fetch_metrics(self):
+    names = self.__fetch_json(qurlgen.suggest_url(self.__tsdb_platform,
+        self.__http_host, self.__http_port, "metrics", "",
+        self.__max_metrics))
+    if not isinstance(names, list):
+      raise excp.QueryFailed("Unexpected suggest response", -2)
+    return sorted(names)
+
+  def __fetch_series(self, metric_id):
+    # OpenTSDB answers 404 for a metric it doesn't know (yet).
+    resp_data = self.__fetch_json(qurlgen.lookup_url(self.__tsdb_platform,
+        self.__http_host, self.__http_port, metric_id, self.__max_series),
+        flag_404_is_empty=True)
+    if resp_data == None:
+      return []
+    try:
+      return [ts_id.TimeseriesID(metric_id, result['tags'])
+              for result in resp_data['results']]
+    except (KeyError, TypeError, AttributeError):
+      raise excp.QueryFailed("Unexpected lookup response", -2)
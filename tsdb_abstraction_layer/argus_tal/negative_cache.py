@@ -0,0 +1,132 @@
+'''
+  negative_cache.py
+
+  Defines NegativeCache: remembers, for a short while, which (timeseries id,
+  time range) combinations are known to hold no data.
+
+  A dead (or not yet deployed) sensor makes every query for it come back
+  without any timeseries, and every cycle of a StateSetProcessor queries it
+  again. A QueryApi handed a NegativeCache leaves the timeseries ids known to
+  be empty over its time range out of the query, and returns -3 (no data)
+  without sending any request if that leaves none. Timeseries ids for which a
+  response holds no timeseries are remembered as empty over the time range.
+
+  Staying correct as new data lands:
+   - Entries expire after ttl secs.
+   - A time range reaching the last ttl secs (or the future) means the
+     timeseries is dead for now: until the entry expires, later time ranges
+     (e.g. the next windows) are known to be empty too. So data landing
+     meanwhile is seen at most ttl secs late.
+   - A response holding data for an id drops the entries of that id which
+     overlap its time range.
+
+  Configuration:
+    ttl:  Secs for which an empty result is trusted. Keep it short.
+
+  Statistics (get_stats()):
+    hits:     Timeseries ids left out of queries, as known to be empty.
+    misses:   Timeseries ids queried.
+    entries:  Timeseries ids with (unexpired) empty time ranges.
+
+Example usage:
+    negative_cache = NegativeCache(ttl=60)
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE,
+                         negative_cache=negative_cache)
+    if q_api_obj.populate_ts_data() == -3:
+      ... no data, maybe known without a request (http_status_code is 0) ...
+'''
+
+import threading
+import time
+
+DEFAULT_TTL = 60   # secs
+
+class NegativeCache(object):
+  def __init__(self, ttl=DEFAULT_TTL):
+    self.__ttl = ttl
+
+    self.__lock = threading.Lock()
+    # (query_key, tsid) -> sorted, disjoint [start, end, expiry] lists. end
+    # is infinite for a dead timeseries (see top of file).
+    self.__entries = {}
+    self.__num_hits = 0
+    self.__num_misses = 0
+
+  def is_empty(self, query_key, tsid, start, end):
+    '''Returns True if the query of tsid over [start, end] is known to
+       return no timeseries. query_key identifies everything else about the
+       query.'''
+    with self.__lock:
+      ranges = self.__unexpired_ranges((query_key, tsid))
+      flag_empty = any(r_start <= start and end <= r_end
+                       for r_start, r_end, _ in ranges)
+      if flag_empty:
+        self.__num_hits += 1
+      else:
+        self.__num_misses += 1
+      return flag_empty
+
+  def put_empty(self, query_key, tsid, start, end, flag_millisecond=False):
+    '''Remembers that the query of tsid over [start, end] returned no
+       timeseries. Timestamps are in msecs if flag_millisecond is set.'''
+    now = time.time()
+    recent = now - self.__ttl
+    if end >= (int(recent * 1000) if flag_millisecond else int(recent)):
+      end = float('inf')
+    expiry = now + self.__ttl
+    with self.__lock:
+      merged = []
+      # Overlapping and adjacent ranges are merged, trusted as long as the
+      # one expiring first.
+      for r_start, r_end, r_expiry in self.__unexpired_ranges((query_key,
+                                                                tsid)):
+        if r_end + 1 < start or r_start > end + 1:
+          merged.append([r_start, r_end, r_expiry])
+        else:
+          start, end = min(start, r_start), max(end, r_end)
+          expiry = min(expiry, r_expiry)
+      merged.append([start, end, expiry])
+      self.__entries[(query_key, tsid)] = sorted(merged)
+
+  def put_data(self, query_key, tsid, start, end):
+    '''Forgets what's known to be empty for tsid over (any part of) [start,
+       end], as the query returned data.'''
+    with self.__lock:
+      ranges = [r_range for r_range in self.__entries.get((query_key, tsid),
+                                                          [])
+                if r_range[1] < start or r_range[0] > end]
+      if len(ranges) > 0:
+        self.__entries[(query_key, tsid)] = ranges
+      else:
+        self.__entries.pop((query_key, tsid), None)
+
+  def get_stats(self):
+    '''Returns a dictionary of cache statistics, see top of file.'''
+    with self.__lock:
+      for entry_key in list(self.__entries.keys()):
+        self.__unexpired_ranges(entry_key)
+      return {
+        'hits': self.__num_hits,
+        'misses': self.__num_misses,
+        'entries': len(self.__entries),
+      }
+
+  def clear(self):
+    '''Forgets everything. Statistics are kept.'''
+    with self.__lock:
+      self.__entries.clear()
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __unexpired_ranges(self, entry_key):
+    # Must be called with the lock held. Drops the expired ranges.
+    now = time.time()
+    ranges = [r_range for r_range in self.__entries.get(entry_key, [])
+              if r_range[2] > now]
+    if len(ranges) > 0:
+      self.__entries[entry_key] = ranges
+    else:
+      self.__entries.pop(entry_key, None)
+    return ranges
@@ -7,15 +7,38 @@
   (Possible statuses: Reviewed | Experimental Use | Accepted)
 '''
 
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-import requests
 import json
+import threading
+import time
 from . import query_urlgen as qurlgen
 from . import basic_types
+from . import exceptions as excp
 from . import timeseries_datadict as tsdd
 from . import timeseries_id as ts_id
+from . import timeseries_pattern as tspat
+from . import http_session_pool as hspool
+from . import query_cache as qcache
+from . import query_coalescer as qcoal
+from . import request_policy as rpol
+from . import streaming_decoder as sdec
+from . import timestamp as ts
+import numpy as np
 import pandas as pd
 
+# Chunked fetch (see flag_chunked_fetch below) defaults.
+DEFAULT_TARGET_DPS_PER_CHUNK = 500000  # Across all the timeseries queried.
+DEFAULT_MAX_CHUNK_WORKERS = 4
+MAX_CHUNK_HOURS = 24  # Upper bound on the chunk size when data is sparse.
+
+# Queries whose GET URL would be longer than this are sent as a POST instead.
+# OpenTSDB (netty) rejects request lines longer than 4096 bytes by default.
+DEFAULT_MAX_GET_URL_LEN = 4000
+
+# Size of the chunks in which a streamed response is read and decoded.
+STREAM_CHUNK_SIZE = 65536
+
 '''
 Example usage:
     # We need at least 1 timeseries id. The QueryAPI object can accept a list
@@ -45,11 +68,121 @@ Example usage:
                          [ts_id1, ts_id2], Aggregator.NONE,
                          flag_millisecond=True)
 
+    # HTTP requests go over the process wide pool of persistent connections
+    # (see http_session_pool.py) unless a pool is supplied explicitly.
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE,
+                         http_session_pool=my_pool)
+
+    # Querying a long time range (e.g. a week of 1 sec data) in hour aligned
+    # chunks, fetched 4 at a time and stitched back together. Not for rates
+    # (flag_compute_rate), which are always fetched in 1 query.
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1, ts_id2], Aggregator.NONE,
+                         flag_chunked_fetch=True, max_chunk_workers=4)
+
+    # Queries are sent as an HTTP GET unless the URL would be longer than
+    # max_get_url_len, in which case the query is sent as a JSON body in an
+    # HTTP POST. Use max_get_url_len=0 to always POST.
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         list_of_100_ts_ids, Aggregator.NONE,
+                         max_get_url_len=2000)
+
+    # Large responses: decode the response as it streams in, straight into
+    # the TimeseriesDataDict arrays. Peak memory is ~1 copy of the data,
+    # instead of ~3 copies (raw response + decoded JSON + arrays).
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1, ts_id2], Aggregator.NONE,
+                         flag_stream_response=True)
+
+    # Processing each timeseries as soon as it has been received, while the
+    # rest of the response is still being transferred and decoded.
+    for tsdd_obj in q_api_obj.iter_results():
+      ... process tsdd_obj ...
+
+    # Responses are sent compressed (see accept_encoding in
+    # http_session_pool.py), and streamed ones are decompressed as they
+    # stream in. The bytes transferred are accounted either way.
+    q_api_obj.populate_ts_data()
+    stats = q_api_obj.transfer_stats
+    ... stats['wire_bytes'], stats['decoded_bytes'] ...
+
+    # Queries sharing a QueryCoalescer (see query_coalescer.py) and identical
+    # to one already in flight wait for its result instead of being sent.
+    # A stream can't be shared, so iter_results() then fetches the whole
+    # response before yielding (as with flag_chunked_fetch).
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE,
+                         query_coalescer=qcoal.get_default_coalescer())
+
+    # Repeated queries over overlapping time ranges: with a QueryResultCache
+    # (see query_cache.py) only the parts of the time range not cached are
+    # fetched. As with a coalescer, iter_results() doesn't stream then.
+    # Rates are not cached (see flag_chunked_fetch).
+    cache = qcache.QueryResultCache(max_bytes=64 * 1024 * 1024)
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE, query_cache=cache)
+
+    # Historical data, across runs: with a SegmentStore (see
+    # segment_store.py) sealed time blocks are kept on disk and only fetched
+    # once. Can be combined with a query_cache (which is checked first).
+    # Rates are not stored (see flag_chunked_fetch).
+    store = segment_store.SegmentStore("/var/cache/argus/segments")
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE, segment_store=store)
+
+    # Coarse questions: let the TSDB reduce the data before sending it. Here
+    # 1 timeseries holding the sum, across all the timeseries matching
+    # ts_id1, of their per minute averages. Buckets without data are NaN.
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.SUM,
+                         downsample=qurlgen.Downsample("1m",
+                             Aggregator.AVG, FillPolicy.NAN))
+
+    # The aggregated timeseries only has the tags common to all the
+    # timeseries aggregated. Aggregated or downsampled results can't be
+    # split in time nor matched back to the timeseries ids, so such queries
+    # ignore flag_chunked_fetch, query_cache, segment_store and
+    # negative_cache.
+
+    # Many timeseries in 1 request: a TimeseriesPattern (see
+    # timeseries_pattern.py) may have wildcarded or literal_or tag values.
+    # The result holds 1 TimeseriesDataDict per timeseries matched.
+    pattern = TimeseriesPattern("metric_foo", {"machine_name": "*"})
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [pattern], Aggregator.NONE)
+    q_api_obj.populate_ts_data()
+    result_map = q_api_obj.get_result_map_for(pattern)   # tsid -> tsdd
+
+    # Dead sensors: with a NegativeCache (see negative_cache.py), timeseries
+    # ids known to have no data over the time range are left out of the
+    # query. If that leaves none, -3 is returned without any request.
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE,
+                         negative_cache=negative_cache.NegativeCache(ttl=60))
+
+    # Tail latency: with a RequestPolicy (see request_policy.py), a query has
+    # a deadline (else -4 is returned), a slow request is hedged (possibly
+    # to another TSD) and failed ones retried.
+    policy = request_policy.RequestPolicy(deadline=10.0, flag_hedge=True,
+        alternate_endpoints=[("10.121.32.2", 4242)])
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE, request_policy=policy)
+    q_api_obj.populate_ts_data()
+    ... q_api_obj.query_telemetry['hedges'], ['retries'], ['request_secs'] ...
+
 '''
 class QueryApi(object):
   def __init__(self, http_host, http_port, start_time, end_time, tsid_list,
                aggregator_type, flag_compute_rate=False,
-               flag_ms_response=False, tsdb_platform=basic_types.Tsdb.OPENTSDB):
+               flag_ms_response=False, tsdb_platform=basic_types.Tsdb.OPENTSDB,
+               http_session_pool=None, flag_chunked_fetch=False,
+               target_dps_per_chunk=DEFAULT_TARGET_DPS_PER_CHUNK,
+               max_chunk_workers=DEFAULT_MAX_CHUNK_WORKERS,
+               max_get_url_len=DEFAULT_MAX_GET_URL_LEN,
+               flag_stream_response=False, query_coalescer=None,
+               query_cache=None, segment_store=None, downsample=None,
+               negative_cache=None, request_policy=None):
     self.__tsdb_platform = tsdb_platform
 
     # This will validate and raise an exception if any of the parameters are
@@ -63,16 +196,64 @@ class QueryApi(object):
     self.__tsid_list = [ts for ts in tsid_list] # clone the list so we
                                                 # are not referencing to a
                                                 # caller supplied list.
+    # Those actually queried i.e. not known to be empty (see negative_cache).
+    self.__queried_tsid_list = self.__tsid_list
     self.__aggregator = aggregator_type
+    if aggregator_type != basic_types.Aggregator.NONE:
+      # Each distinct id is queried once (as by a POST query), so that the
+      # aggregates can be matched to the ids (see __match_aggregates()).
+      self.__tsid_list = list(
+          {tsid.fqid: tsid for tsid in self.__tsid_list}.values())
     self.__flag_compute_rate = flag_compute_rate
     self.__flag_millsecond_response = flag_ms_response
     self.__start_time = start_time
     self.__end_time = end_time
-    self.__url = qurlgen.url(self.__tsdb_platform,
-            self.__http_host, self.__http_port,
-            self.__start_time, self.__end_time, self.__aggregator,
-            self.__tsid_list, flag_compute_rate=self.__flag_compute_rate,
-            flag_ms_response=self.__flag_millsecond_response)
+    if http_session_pool == None:
+      http_session_pool = hspool.get_default_pool()
+    self.__http_session_pool = http_session_pool
+    self.__max_get_url_len = max_get_url_len
+    self.__flag_stream_response = flag_stream_response
+    self.__downsample = downsample             # None: no downsampling.
+    if aggregator_type != basic_types.Aggregator.NONE or downsample != None:
+      # See "Coarse questions" above.
+      flag_chunked_fetch = False
+      query_cache = segment_store = negative_cache = None
+    if flag_compute_rate:
+      # OpenTSDB computes the first rate of a time range from the datapoint
+      # before it, which isn't in the range: each sub range fetched would
+      # lack its first rate. Hence rates are fetched in 1 query.
+      flag_chunked_fetch = False
+      query_cache = segment_store = None
+    self.__query_coalescer = query_coalescer   # None: no coalescing.
+    self.__query_cache = query_cache           # None: no caching.
+    self.__segment_store = segment_store       # None: no on-disk store.
+    self.__negative_cache = negative_cache     # None: no negative caching.
+    self.__request_policy = request_policy     # None: 1 request, no deadline.
+
+    # Chunked fetch:
+    # A single query over a long time range is slow and needs the whole
+    # response in memory at once. Also, OpenTSDB stores data in hourly rows,
+    # so a range that doesn't start/end on an hour boundary scans rows only
+    # partly used. With flag_chunked_fetch, the time range is split into
+    # hour aligned chunks that are fetched concurrently (upto
+    # max_chunk_workers at a time) and stitched back into 1
+    # TimeseriesDataDict per timeseries.
+    #
+    # The chunk size adapts to the data: the first chunk (upto the first hour
+    # boundary) is fetched on its own to measure the datapoint density, and
+    # the remaining chunks are sized to hold ~target_dps_per_chunk datapoints
+    # each (in whole hours, capped at MAX_CHUNK_HOURS).
+    self.__flag_chunked_fetch = flag_chunked_fetch
+    self.__target_dps_per_chunk = target_dps_per_chunk
+    self.__max_chunk_workers = max_chunk_workers
+
+    # Bytes of the response(s) of the last query, on the wire and once
+    # decompressed. Chunks are fetched concurrently, hence the lock.
+    self.__transfer_lock = threading.Lock()
+    self.__wire_bytes = 0
+    self.__decoded_bytes = 0
+    # What it took to get the response(s), see query_telemetry.
+    self.__telemetry = rpol.new_telemetry()
 
     # List of TimeseriesDataDict objects for each timeseries returned.
     self.__tsdd_obj_list = []
@@ -89,25 +270,88 @@ class QueryApi(object):
 
     If the HTTP call succeeds, then the query result object can be accessed via
     the get_result() method.
+
+    Returns 0 on success, else: -1 HTTP error, -2 unexpected response, -3 no
+    timeseries, -4 no response within the request_policy's deadline (or at
+    all after its retries).
   '''
   def populate_ts_data(self):
-    error = 0
-    response = requests.get(self.__url)
-    self.__http_response_code = response.status_code
+    self.__reset_transfer_stats()
+    if not self.__leave_out_known_empty():
+      return -3
+    if self.__flag_chunked_fetch:
+      error = self.__populate_chunked()
+    else:
+      self.__tsdd_obj_list, error, self.__http_response_code = \
+          self.__fetch(self.__start_time, self.__end_time)
+    self.__remember_empty(error)
+    return error
 
-    # FIXME: Add handling of all HTPP error types.
+  '''
+    Generator alternative to populate_ts_data(). Sends the query and yields
+    each TimeseriesDataDict as soon as its part of the (streamed) response has
+    been decoded. Thus processing of a timeseries overlaps with the transfer
+    and decoding of the ones after it.
+
+    Since there's no return code, errors raise exceptions.QueryFailed whose
+    error_code is what populate_ts_data() would have returned. Some
+    timeseries may have been yielded by then.
+
+    Once iteration completes, the results are also available through the
+    get_result_*() methods. With flag_chunked_fetch, all chunks have to be
+    fetched before stitching, so the results are yielded only after that.
+    Likewise with a query_coalescer, a query_cache or a segment_store, as the
+    response is shared (or only part of the results is fetched).
+
+    With a negative_cache, populate_ts_data() returns -3 (and iter_results()
+    raises QueryFailed with error_code -3) without sending any request if
+    all the timeseries ids are known to be empty over the time range.
+  '''
+  def iter_results(self):
+    if self.__flag_chunked_fetch or self.__query_coalescer != None or \
+       self.__query_cache != None or self.__segment_store != None:
+      error = self.populate_ts_data()
+      if error != 0:
+        raise excp.QueryFailed("Query failed (error %d)" % error, error)
+      for tsdd_obj in self.__tsdd_obj_list:
+        yield tsdd_obj
+      return
+
+    self.__reset_transfer_stats()
+    if not self.__leave_out_known_empty():
+      raise excp.QueryFailed("No timeseries (known to be empty)", -3)
+    response = self.__send_query(self.__start_time, self.__end_time,
+                                 flag_stream=True)
+    self.__http_response_code = response.status_code
     if response.status_code < 200 or response.status_code > 299:
-      # log error.
-      self.__http_response_code = response.status_code
-      return -1
+      response.close()
+      raise excp.QueryFailed("HTTP error %d" % response.status_code, -1)
 
+    tsdd_list = []
+    axes_by_signature = {}
+    flag_completed = False
+    body = _ResponseBody(response)
     try:
-      self.__tsdd_obj_list, error = self.__parse_query_response(response.json())
-    except ValueError:
-      # log error
-      return -2  # JSON response could not be decoded
-
-    return error
+      for unique_ts in sdec.iter_series(body):
+        tsdd_obj = self.__tsdd_from_series(unique_ts)
+        if tsdd_obj == None:
+          raise excp.QueryFailed("Unexpected timeseries format", -2)
+        tsdd_obj = tsdd._share_timestamp_axis(tsdd_obj, axes_by_signature)
+        tsdd_list.append(tsdd_obj)
+        yield tsdd_obj
+      flag_completed = True
+    except ValueError as err:
+      raise excp.QueryFailed("Bad JSON response: %s" % err, -2)
+    finally:
+      # Also covers the caller abandoning the iteration midway.
+      if not flag_completed:
+        response.close()
+      self.__record_transfer(body)
+
+    self.__tsdd_obj_list = tsdd_list
+    self.__remember_empty(0 if len(tsdd_list) > 0 else -3)
+    if len(tsdd_list) == 0:
+      raise excp.QueryFailed("No timeseries in the response", -3)
 
   def get_result_set(self):
     return self.__tsdd_obj_list
@@ -123,6 +367,22 @@ class QueryApi(object):
     return { \
         tsdd.get_timeseries_id().fqid: tsdd for tsdd in self.__tsdd_obj_list}
 
+  '''
+     Returns the results selected by tsid (a TimeseriesID or a
+     TimeseriesPattern of the query) as a map, indexed by the TimeseriesID of
+     each timeseries. Fans out the results of a pattern.
+
+     With an aggregator (other than NONE), those are the results of the
+     sub-query for tsid: an aggregate may have lost the tags of tsid.
+  '''
+  def get_result_map_for(self, tsid):
+    if self.__aggregator == basic_types.Aggregator.NONE:
+      return {tsdd.get_timeseries_id(): tsdd for tsdd in self.__tsdd_obj_list
+              if tsid.selects(tsdd.get_timeseries_id())}
+    return {tsdd.get_timeseries_id(): tsdd
+            for queried_tsid, tsdd in self.__match_aggregates()
+            if queried_tsid == tsid}
+
   '''
       This method returns results as pandas Dataframes instead of TSDD objects.
 
@@ -135,14 +395,10 @@ class QueryApi(object):
     # tsid.fqid -> tsdd converted into a dataframe
     result_map = { }
     for tsdd in self.__tsdd_obj_list:
-      # Convert TSDD object into a dataframe using DataFrame.from_dict(). That
-      # requires creating a temporary dictionary of the type shown by tmp_dict
-      # below i.e. keys as column names and values as lists.
-      tmp_dict = {'timestamp': [], 'result': []}
-      for kk,vv in tsdd:
-          tmp_dict['timestamp'].append(kk)
-          tmp_dict['result'].append(vv)
-      df = pd.DataFrame.from_dict(tmp_dict)  # convert to dataframe
+      # TSDD objects are stored as columns (arrays) already, so the dataframe
+      # is built directly from those without walking the datapoints.
+      df = pd.DataFrame({'timestamp': tsdd.get_timestamps(),
+                         'result': tsdd.get_values()})
       result_map[tsdd.get_timeseries_id().fqid] = df   # Save df in result_map
     return result_map
 
@@ -150,6 +406,33 @@ class QueryApi(object):
   def http_status_code(self):
     return self.__http_response_code
 
+  @property
+  def transfer_stats(self):
+    '''
+    Size of the body of the response(s) to the last query, as a dictionary:
+      wire_bytes:    As transferred, i.e. compressed if the TSDB compressed it.
+      decoded_bytes: Once decompressed (the JSON text).
+    Both are 0 if no response was received (e.g. all from the cache).
+    '''
+    with self.__transfer_lock:
+      return {'wire_bytes': self.__wire_bytes,
+              'decoded_bytes': self.__decoded_bytes}
+
+  @property
+  def query_telemetry(self):
+    '''
+    What it took to get the response(s) to the last query, as a dictionary:
+      requests:      HTTP requests sent, including retries and hedges.
+      retries:       Attempts after a failed one.
+      hedges:        Duplicate requests sent as a response was slow to come.
+      hedge_wins:    Hedges whose response came first (and was used).
+      request_secs:  Time spent waiting for responses (summed over chunks).
+    Retries and hedges only happen with a request_policy. Queries answered
+    by a coalescer or a cache send no request.
+    '''
+    with self.__transfer_lock:
+      return dict(self.__telemetry)
+
   #############################################################################
   # Helper methods start here.
   #############################################################################
@@ -162,30 +445,382 @@ class QueryApi(object):
   def hello(self):
     return "Hello from %s" % self.__class__.__name__
 
+  def __build_url(self, http_host, http_port, start_time, end_time):
+    return qurlgen.url(self.__tsdb_platform, http_host, http_port,
+            start_time, end_time, self.__aggregator,
+            self.__queried_tsid_list,
+            flag_compute_rate=self.__flag_compute_rate,
+            flag_ms_response=self.__flag_millsecond_response,
+            downsample=self.__downsample)
+
+  def __send_query(self, start_time, end_time, flag_stream):
+    # Sends the query for the supplied time range, as per the request policy
+    # if any. Returns the response. Raises QueryFailed (-4) if there's none.
+    send_func = lambda http_host, http_port, timeout: self.__send_query_to(
+        http_host, http_port, start_time, end_time, flag_stream, timeout)
+    if self.__request_policy != None:
+      response, telemetry = self.__request_policy.send(
+          send_func, self.__http_host, self.__http_port)
+    else:
+      telemetry = rpol.new_telemetry()
+      telemetry['requests'] = 1
+      start = time.monotonic()
+      response = send_func(self.__http_host, self.__http_port, None)
+      telemetry['request_secs'] = time.monotonic() - start
+    with self.__transfer_lock:
+      rpol.add_telemetry(self.__telemetry, telemetry)
+    return response
+
+  def __send_query_to(self, http_host, http_port, start_time, end_time,
+                      flag_stream, timeout):
+    # Sends the query to 1 endpoint. The extra keyword arguments are only
+    # passed when needed so that plain requests look exactly as they always
+    # have.
+    request_kwargs = {'stream': True} if flag_stream else {}
+    if timeout != None:
+      request_kwargs['timeout'] = timeout
+    url = self.__build_url(http_host, http_port, start_time, end_time)
+    if len(url) <= self.__max_get_url_len:
+      return self.__http_session_pool.get(url, **request_kwargs)
+
+    post_url, body = qurlgen.post_url_and_body(self.__tsdb_platform,
+        http_host, http_port, start_time, end_time, self.__aggregator,
+        self.__queried_tsid_list,
+        flag_compute_rate=self.__flag_compute_rate,
+        flag_ms_response=self.__flag_millsecond_response,
+        downsample=self.__downsample)
+    return self.__http_session_pool.post(post_url,
+        data=json.dumps(body), headers={'content-type': 'application/json'},
+        **request_kwargs)
+
+  def __cache_key(self):
+    # Everything but the time range and timeseries ids that a query response
+    # depends on.
+    return (self.__tsdb_platform, self.__http_host, self.__http_port,
+            self.__aggregator, self.__flag_compute_rate,
+            self.__flag_millsecond_response, self.__downsample)
+
+  def __query_key(self, start_time, end_time):
+    # Normalized query, i.e. identical for queries with identical responses.
+    return self.__cache_key() + (start_time.value, end_time.value,
+        tuple((type(tsid).__name__, tsid.metric_id,
+               tuple(sorted(tsid.filters.items())))
+              for tsid in self.__queried_tsid_list))
+
+  def __key_range(self, start_time, end_time):
+    # The time range in the unit of the timestamps of the response, thus of
+    # the cached (or stored) data: with flag_ms_response, the time range may
+    # well be in secs (OpenTSDB accepts either).
+    return ts.bounds_in_unit(start_time.value, end_time.value,
+                             self.__flag_millsecond_response)
+
+  def __fetch(self, start_time, end_time):
+    # Queries the supplied time range and parses the response. Returns the
+    # tuple (tsdd_list, error, http_status_code) where error is as documented
+    # for populate_ts_data(). Safe to call concurrently.
+    if self.__query_cache == None:
+      return self.__fetch_stored(start_time, end_time)
+
+    # Fetch only what's not cached, then merge it with the cached data. The
+    # HTTP status is 0 if nothing had to be fetched.
+    cache_key = self.__cache_key()
+    tsid_list = self.__queried_tsid_list
+    start, end = self.__key_range(start_time, end_time)
+    missing_ranges, cached_tsdd_list = self.__query_cache.get(
+        cache_key, tsid_list, start, end, self.__flag_millsecond_response)
+    chunk_tsdd_lists = [cached_tsdd_list]
+    http_status_code = 0
+    for m_start, m_end in missing_ranges:
+      tsdd_list, error, http_status_code = self.__fetch_stored(
+          ts.Timestamp(m_start), ts.Timestamp(m_end))
+      if error == -3:
+        continue  # No data in this range, nothing to cache.
+      if error != 0:
+        return [], error, http_status_code
+      self.__query_cache.put(cache_key, tsid_list, m_start, m_end, tsdd_list,
+                             self.__flag_millsecond_response)
+      chunk_tsdd_lists.append(tsdd_list)
+
+    tsdd_list = self.__stitch_chunks(chunk_tsdd_lists)
+    return tsdd_list, 0 if len(tsdd_list) > 0 else -3, http_status_code
+
+  def __fetch_stored(self, start_time, end_time):
+    # Same as __fetch(), with sealed blocks read from (or else fetched and
+    # written to) the segment store.
+    if self.__segment_store == None:
+      return self.__fetch_coalesced(start_time, end_time)
+
+    cache_key = self.__cache_key()
+    tsid_list = self.__queried_tsid_list
+    start, end = self.__key_range(start_time, end_time)
+    stored_tsdd_list, fetch_ranges = self.__segment_store.get(
+        cache_key, tsid_list, start, end, self.__flag_millsecond_response)
+    chunk_tsdd_lists = [stored_tsdd_list]
+    http_status_code = 0
+    for f_start, f_end, flag_store in fetch_ranges:
+      tsdd_list, error, http_status_code = self.__fetch_coalesced(
+          ts.Timestamp(f_start), ts.Timestamp(f_end))
+      if error != 0 and error != -3:
+        return [], error, http_status_code
+      if flag_store:
+        # No data (-3) in a sealed block is stored as well.
+        self.__segment_store.put(cache_key, tsid_list, f_start, f_end,
+                                 tsdd_list, self.__flag_millsecond_response)
+        # Whole blocks were fetched, more than what was asked for.
+        tsdd_list = tsdd.clip(tsdd_list, start, end)
+      chunk_tsdd_lists.append(tsdd_list)
+
+    tsdd_list = self.__stitch_chunks(chunk_tsdd_lists)
+    return tsdd_list, 0 if len(tsdd_list) > 0 else -3, http_status_code
+
+  def __fetch_coalesced(self, start_time, end_time):
+    if self.__query_coalescer == None:
+      return self.__fetch_uncoalesced(start_time, end_time)
+    tsdd_list, error, http_status_code = self.__query_coalescer.run(
+        self.__query_key(start_time, end_time),
+        lambda: self.__fetch_uncoalesced(start_time, end_time))
+    # The TimeseriesDataDict objects are read only, the list isn't.
+    return list(tsdd_list), error, http_status_code
+
+  def __fetch_uncoalesced(self, start_time, end_time):
+    try:
+      response = self.__send_query(start_time, end_time,
+                                   self.__flag_stream_response)
+    except excp.QueryFailed as err:
+      return [], err.error_code, 0   # No response (see request_policy).
+
+    # FIXME: Add handling of all HTPP error types.
+    if response.status_code < 200 or response.status_code > 299:
+      # log error.
+      if self.__flag_stream_response:
+        response.close()
+      return [], -1, response.status_code
+
+    error = -2  # JSON response could not be decoded
+    body = None
+    try:
+      if self.__flag_stream_response:
+        body = _ResponseBody(response)
+        resp_data = sdec.iter_series(body)
+      else:
+        resp_data = response.json()
+      tsdd_list, error = self.__parse_query_response(resp_data)
+    except ValueError:
+      # log error
+      tsdd_list = []
+    finally:
+      # A fully read streamed response has already given its connection back
+      # to the pool. Otherwise the connection is in an unknown state.
+      if self.__flag_stream_response and error != 0:
+        response.close()
+      if body == None:
+        body = _ReadBody(response)
+      self.__record_transfer(body)
+    return tsdd_list, error, response.status_code
+
+  def __leave_out_known_empty(self):
+    # Sets the timeseries ids to query: those not known to be empty. Returns
+    # False (with an empty result) if there are none.
+    self.__queried_tsid_list = self.__tsid_list
+    if self.__negative_cache == None:
+      return True
+    cache_key = self.__cache_key()
+    start, end = self.__key_range(self.__start_time, self.__end_time)
+    self.__queried_tsid_list = [tsid for tsid in self.__tsid_list
+        if not self.__negative_cache.is_empty(cache_key, tsid, start, end)]
+    if len(self.__queried_tsid_list) > 0:
+      return True
+    self.__tsdd_obj_list = []
+    self.__http_response_code = 0
+    return False
+
+  def __remember_empty(self, error):
+    # Records which of the timeseries ids queried have (no) data, given the
+    # outcome of the query.
+    if self.__negative_cache == None or (error != 0 and error != -3):
+      return
+    cache_key = self.__cache_key()
+    start, end = self.__key_range(self.__start_time, self.__end_time)
+    result_tsids = [tsdd_obj.get_timeseries_id()
+                    for tsdd_obj in self.__tsdd_obj_list]
+    for tsid in self.__queried_tsid_list:
+      if any(tsid.selects(result_tsid) for result_tsid in result_tsids):
+        self.__negative_cache.put_data(cache_key, tsid, start, end)
+      else:
+        self.__negative_cache.put_empty(cache_key, tsid, start, end,
+                                        self.__flag_millsecond_response)
+
+  def __reset_transfer_stats(self):
+    with self.__transfer_lock:
+      self.__wire_bytes = 0
+      self.__decoded_bytes = 0
+      self.__telemetry = rpol.new_telemetry()
+
+  def __record_transfer(self, body):
+    # Accounts for the part of a response body read so far.
+    wire_bytes = body.wire_bytes
+    with self.__transfer_lock:
+      self.__wire_bytes += wire_bytes
+      self.__decoded_bytes += body.decoded_bytes
+    self.__http_session_pool.record_transfer(wire_bytes, body.decoded_bytes)
+
+  def __populate_chunked(self):
+    # Chunks are in the unit of the response's timestamps, thus hour aligned
+    # whatever the unit of the time range queried.
+    start, end = self.__key_range(self.__start_time, self.__end_time)
+    hour = 3600000 if end > ts.MAX_SECS_TIMESTAMP else 3600
+
+    # First chunk: upto the first hour boundary. It's fetched on its own so
+    # that we can size the remaining chunks.
+    first_end = min(end, (start // hour + 1) * hour - 1)
+    chunk_results = [self.__fetch(ts.Timestamp(start),
+                                  ts.Timestamp(first_end))]
+    if first_end < end:
+      num_dps = sum(len(tsdd_obj) for tsdd_obj in chunk_results[0][0])
+      if num_dps == 0:
+        chunk_len = MAX_CHUNK_HOURS * hour
+      else:
+        dps_per_hour = num_dps * hour / (first_end - start + 1)
+        chunk_len = hour * min(MAX_CHUNK_HOURS, max(1,
+                        int(self.__target_dps_per_chunk // dps_per_hour)))
+      chunk_ranges = _split_time_range(first_end + 1, end, chunk_len)
+      with ThreadPoolExecutor(max_workers=self.__max_chunk_workers) as pool:
+        chunk_results.extend(pool.map(
+            lambda c_range: self.__fetch(ts.Timestamp(c_range[0]),
+                                         ts.Timestamp(c_range[1])),
+            chunk_ranges))
+
+    # A chunk without any data (-3) is fine, as long as some chunk has data.
+    for _, error, http_status_code in chunk_results:
+      self.__http_response_code = http_status_code
+      if error != 0 and error != -3:
+        return error
+    self.__tsdd_obj_list = self.__stitch_chunks(
+        [tsdd_list for tsdd_list, _, _ in chunk_results])
+    return 0 if len(self.__tsdd_obj_list) > 0 else -3
+
+  def __match_aggregates(self):
+    # Returns the (queried tsid, TimeseriesDataDict) pairs of the results of
+    # an aggregated query. OpenTSDB answers the sub-queries in order: with 1
+    # aggregate each, or 1 per group for a TimeseriesPattern. A sub-query
+    # without data has none: the aggregates after it go to the ids after it
+    # (the first one whose tags they may have).
+    tsid_list = self.__queried_tsid_list
+    matches = []
+    pos = 0
+    for tsdd_obj in self.__tsdd_obj_list:
+      result_tsid = tsdd_obj.get_timeseries_id()
+      while pos < len(tsid_list) and \
+            not tsid_list[pos].selects_aggregate(result_tsid):
+        pos += 1
+      if pos == len(tsid_list):
+        break
+      matches.append((tsid_list[pos], tsdd_obj))
+      if not isinstance(tsid_list[pos], tspat.TimeseriesPattern):
+        pos += 1
+    return matches
+
+  def __stitch_chunks(self, chunk_tsdd_lists):
+    # chunk_tsdd_lists holds 1 list of TimeseriesDataDict objects per chunk,
+    # in time order. Returns 1 TimeseriesDataDict per timeseries.
+    tsdd_lists_by_fqid = {}   # Insertion ordered, so results keep the order
+                              # in which timeseries were first seen.
+    for tsdd_list in chunk_tsdd_lists:
+      for tsdd_obj in tsdd_list:
+        tsdd_lists_by_fqid.setdefault(tsdd_obj.get_timeseries_id().fqid,
+                                      []).append(tsdd_obj)
+    result_list = []
+    for tsdd_list in tsdd_lists_by_fqid.values():
+      if len(tsdd_list) == 1:
+        result_list.append(tsdd_list[0])
+        continue
+      # Chunks don't overlap, but should the TSDB return a boundary
+      # datapoint twice from_arrays() keeps only one of them.
+      result_list.append(tsdd.TimeseriesDataDict.from_arrays(
+          tsdd_list[0].get_timeseries_id(),
+          np.concatenate([tsdd_obj.get_timestamps() for tsdd_obj in tsdd_list]),
+          np.concatenate([tsdd_obj.get_values() for tsdd_obj in tsdd_list])))
+    return tsdd.share_timestamp_axes(result_list)
+
   def __all_tags_found(self, expected_tags, response_data):
     for tag in expected_tags:
       if None == response_data.get(tag, None):
         return False
     return True
 
-  def __parse_query_response(self, resp_data):
-    assert(self.__aggregator == basic_types.Aggregator.NONE)
+  def __tsdd_from_series(self, unique_ts):
+    # Builds the TimeseriesDataDict for 1 timeseries object of the response.
+    # Returns None if the object doesn't have the expected fields.
+    if not self.__all_tags_found(self.__tags_expected_in_response, unique_ts):
+      return None
+
+    # For an aggregated timeseries, 'tags' only holds the tags common to all
+    # the timeseries aggregated (the others are listed in 'aggregateTags').
+    tsid = ts_id.TimeseriesID(unique_ts['metric'], unique_ts['tags'])
+    dps = unique_ts['dps']
+    if isinstance(dps, sdec.DpsColumns):
+      # Already decoded into arrays (streamed response), use them as is.
+      return tsdd.TimeseriesDataDict.from_arrays( \
+          tsid, dps.timestamps, dps.values, copy=False)
+    return tsdd.TimeseriesDataDict.from_dps_payload(tsid, dps)
 
-    # If the aggregator is "none" then we can be guaranteed that each element
-    # in resp_data is a timeseries object. Simplifies parsing !
+  def __parse_query_response(self, resp_data):
+    # Each element in resp_data is a timeseries object: as stored if the
+    # aggregator is "none", else the aggregate of the timeseries matching a
+    # timeseries id. Simplifies parsing !
     tsdd_list = []
     for unique_ts in resp_data:
-      if not self.__all_tags_found(self.__tags_expected_in_response, unique_ts):
+      timeseries_data_dict = self.__tsdd_from_series(unique_ts)
+      if timeseries_data_dict == None:
         return tsdd_list, -2  # FIXME: This should become an exception
-
-      assert(len(unique_ts['aggregateTags']) == 0)
-      timeseries_data_dict = tsdd.TimeseriesDataDict( \
-          ts_id.TimeseriesID(unique_ts['metric'], unique_ts['tags']), \
-          unique_ts['dps'])
       tsdd_list.append(timeseries_data_dict)
 
     # Its not improbable that we got a legit JSON response back BUT containing
     # no timeseries data. That would still be an error !
     if len(tsdd_list) == 0:
       return tsdd_list, -3  # error
-    return tsdd_list, 0  # sucess
+
+    # Timeseries sampled by the same collector typically have identical
+    # timestamps. Let them share one timestamp array.
+    return tsdd.share_timestamp_axes(tsdd_list), 0  # sucess
+
+
+class _ResponseBody(object):
+  # Iterable over the body of a streamed response, in decoded (i.e.
+  # decompressed) chunks, keeping count of the bytes read.
+  def __init__(self, response):
+    self.__response = response
+    self.decoded_bytes = 0
+
+  def __iter__(self):
+    for chunk in self.__response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+      self.decoded_bytes += len(chunk)
+      yield chunk
+
+  @property
+  def wire_bytes(self):
+    # urllib3 counts the bytes read off the connection, before decoding.
+    return self.__response.raw.tell()
+
+
+class _ReadBody(object):
+  # The body of a non-streamed response, read (and decompressed) in one go
+  # by response.json(), as accounted by __record_transfer().
+  def __init__(self, response):
+    self.decoded_bytes = len(response.content)
+    # urllib3 counts the bytes read off the connection, before decoding.
+    self.wire_bytes = response.raw.tell()
+
+
+def _split_time_range(start, end, chunk_len):
+  '''Splits [start, end] into consecutive, non overlapping [c_start, c_end]
+     pairs. chunk_len must be a multiple of the alignment (e.g. 1 hour) and
+     start must already be aligned. Only the last chunk can be shorter.'''
+  assert chunk_len > 0
+  chunks = []
+  c_start = start
+  while c_start <= end:
+    c_end = min(end, c_start + chunk_len - 1)
+    chunks.append((c_start, c_end))
+    c_start = c_end + 1
+  return chunks
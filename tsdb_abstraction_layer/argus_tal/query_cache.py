@@ -0,0 +1,213 @@
+'''
+  query_cache.py
+
+  Defines QueryResultCache: a memory bounded cache of query results, which
+  knows which time ranges of each timeseries it holds.
+
+  Consecutive queries typically overlap: StateSetProcessor pads each window
+  (additional_query_window) and its windows are back to back, backfills
+  re-read the same history. A QueryApi handed a QueryResultCache only fetches
+  the parts of its time range that aren't cached (for any of its timeseries
+  ids) and merges them with the cached data. What it fetches is then cached
+  in turn.
+
+  Configuration:
+    max_bytes:    Upper bound on the size of the cached data (16 bytes per
+                  datapoint). Least recently used timeseries are evicted
+                  first.
+    settle_time:  Data newer than this many seconds is not cached, as more
+                  datapoints may still land there. Queries for recent data
+                  thus always fetch their most recent part.
+
+  Statistics (get_stats()):
+    hits, partial_hits, misses: Queries whose time range was entirely /
+                                partly / not at all in the cache.
+    evictions:                  Timeseries evicted to make room.
+    bytes, entries:             Current size of the cache.
+
+  Results of queries which differ in anything but their time range and
+  timeseries ids (TSDB, rate, ms, aggregator) are cached separately. A query
+  returning no timeseries at all is not cached.
+
+Example usage:
+    cache = QueryResultCache(max_bytes=64 * 1024 * 1024)
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE, query_cache=cache)
+'''
+
+from collections import OrderedDict
+import threading
+import time
+
+import numpy as np
+
+from . import timeseries_datadict as tsdd
+from . import timestamp as ts
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+DEFAULT_SETTLE_TIME = 60   # secs
+
+class _CachedTimeseries(object):
+  # What is cached for 1 queried timeseries id: the time ranges fetched so
+  # far and the data of the timeseries matching the id within those ranges
+  # (for an id with only some of the tags, more than 1 timeseries).
+  def __init__(self):
+    self.ranges = []          # Sorted, disjoint [start, end] pairs.
+    self.tsdd_by_fqid = {}
+    self.nbytes = 0
+
+  def window(self, start, end):
+    return tsdd.clip(self.tsdd_by_fqid.values(), start, end)
+
+  def add(self, start, end, tsdd_list):
+    # tsdd_list holds the data fetched for [start, end].
+    self.ranges = _add_range(self.ranges, start, end)
+    for tsdd_obj in tsdd_list:
+      fqid = tsdd_obj.get_timeseries_id().fqid
+      cached_obj = self.tsdd_by_fqid.get(fqid)
+      if cached_obj != None:
+        tsdd_obj = tsdd.TimeseriesDataDict.from_arrays(
+            tsdd_obj.get_timeseries_id(),
+            np.concatenate([cached_obj.get_timestamps(),
+                            tsdd_obj.get_timestamps()]),
+            np.concatenate([cached_obj.get_values(), tsdd_obj.get_values()]))
+      self.tsdd_by_fqid[fqid] = tsdd_obj
+    self.nbytes = sum(_nbytes(tsdd_obj)
+                      for tsdd_obj in self.tsdd_by_fqid.values())
+
+
+class QueryResultCache(object):
+  def __init__(self, max_bytes=DEFAULT_MAX_BYTES,
+               settle_time=DEFAULT_SETTLE_TIME):
+    self.__max_bytes = max_bytes
+    self.__settle_time = settle_time
+
+    self.__lock = threading.Lock()
+    # (query_key, tsid) -> _CachedTimeseries, least recently used first.
+    self.__entries = OrderedDict()
+    self.__nbytes = 0
+    self.__num_hits = 0
+    self.__num_partial_hits = 0
+    self.__num_misses = 0
+    self.__num_evictions = 0
+
+  def get(self, query_key, tsid_list, start, end, flag_millisecond=False):
+    '''
+    Returns the pair (missing_ranges, tsdd_list) for the query of tsid_list
+    over [start, end]. missing_ranges is the list of [start, end] pairs that
+    need to be fetched, tsdd_list holds the cached data (within [start, end]).
+    query_key identifies everything else about the query. Timestamps are in
+    msecs if flag_millisecond (ms=true) is set, start and end may be in
+    either unit (see timestamp.bounds_in_unit()).
+    '''
+    start, end = ts.bounds_in_unit(start, end, flag_millisecond)
+    missing_ranges = []
+    tsdd_by_fqid = {}
+    with self.__lock:
+      for tsid in tsid_list:
+        entry = self.__entries.get((query_key, tsid))
+        if entry == None:
+          missing_ranges = _add_range(missing_ranges, start, end)
+          continue
+        self.__entries.move_to_end((query_key, tsid))
+        for m_start, m_end in _subtract_ranges(start, end, entry.ranges):
+          missing_ranges = _add_range(missing_ranges, m_start, m_end)
+        for tsdd_obj in entry.window(start, end):
+          tsdd_by_fqid[tsdd_obj.get_timeseries_id().fqid] = tsdd_obj
+
+      if len(missing_ranges) == 0:
+        self.__num_hits += 1
+      elif missing_ranges == [(start, end)]:
+        self.__num_misses += 1
+      else:
+        self.__num_partial_hits += 1
+    return missing_ranges, list(tsdd_by_fqid.values())
+
+  def put(self, query_key, tsid_list, start, end, tsdd_list,
+          flag_millisecond=False):
+    '''
+    Caches tsdd_list: the data returned by the query of tsid_list over
+    [start, end]. Timestamps are in msecs if flag_millisecond is set, as
+    for get(). [start, end] is recorded as cached in that unit.
+    '''
+    start, end = ts.bounds_in_unit(start, end, flag_millisecond)
+    now = time.time() - self.__settle_time
+    end = min(end, int(now * 1000) if flag_millisecond else int(now))
+    if end < start:
+      return
+    # Only keep what's within [start, end], in arrays of its own so that the
+    # (larger) arrays fetched aren't kept alive.
+    tsdd_list = [tsdd.TimeseriesDataDict.from_arrays(
+                     w_obj.get_timeseries_id(), w_obj.get_timestamps(),
+                     w_obj.get_values())
+                 for w_obj in tsdd.clip(tsdd_list, start, end)]
+
+    with self.__lock:
+      for tsid in tsid_list:
+        entry_key = (query_key, tsid)
+        entry = self.__entries.get(entry_key)
+        if entry == None:
+          entry = self.__entries[entry_key] = _CachedTimeseries()
+        self.__entries.move_to_end(entry_key)
+        self.__nbytes -= entry.nbytes
+        entry.add(start, end, [tsdd_obj for tsdd_obj in tsdd_list
+                               if tsid.selects(tsdd_obj.get_timeseries_id())])
+        self.__nbytes += entry.nbytes
+
+      while self.__nbytes > self.__max_bytes:
+        _, entry = self.__entries.popitem(last=False)
+        self.__nbytes -= entry.nbytes
+        self.__num_evictions += 1
+
+  def get_stats(self):
+    '''Returns a dictionary of cache statistics, see top of file.'''
+    with self.__lock:
+      return {
+        'hits': self.__num_hits,
+        'partial_hits': self.__num_partial_hits,
+        'misses': self.__num_misses,
+        'evictions': self.__num_evictions,
+        'bytes': self.__nbytes,
+        'entries': len(self.__entries),
+      }
+
+  def clear(self):
+    '''Drops all the cached data. Statistics are kept.'''
+    with self.__lock:
+      self.__entries.clear()
+      self.__nbytes = 0
+
+
+#############################################################################
+# Pure private helper functions start here.
+#############################################################################
+def _nbytes(tsdd_obj):
+  return tsdd_obj.get_timestamps().nbytes + tsdd_obj.get_values().nbytes
+
+def _add_range(ranges, start, end):
+  '''Returns the sorted list of disjoint [start, end] pairs covering ranges
+     and [start, end]. Adjacent ranges are merged.'''
+  merged = []
+  for r_start, r_end in ranges:
+    if r_end + 1 < start or r_start > end + 1:
+      merged.append((r_start, r_end))
+    else:
+      start, end = min(start, r_start), max(end, r_end)
+  merged.append((start, end))
+  return sorted(merged)
+
+def _subtract_ranges(start, end, ranges):
+  '''Returns the list of [start, end] pairs covering the parts of [start,
+     end] not covered by ranges (sorted and disjoint).'''
+  missing = []
+  for r_start, r_end in ranges:
+    if r_end < start:
+      continue
+    if r_start > end:
+      break
+    if r_start > start:
+      missing.append((start, r_start - 1))
+    start = r_end + 1
+  if start <= end:
+    missing.append((start, end))
+  return missing
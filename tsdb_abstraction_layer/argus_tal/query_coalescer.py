@@ -0,0 +1,107 @@
+'''
+  query_coalescer.py
+
+  Defines QueryCoalescer: merges identical queries that are in flight at the
+  same time into a single HTTP request to the TSDB.
+
+  Several appliques (or TemporalStates) running in 1 process often ask for
+  the same timeseries over the same window at the same moment, each with its
+  own QueryApi. Handed the same QueryCoalescer, only the first of those
+  queries (the leader) is sent. Identical queries made while it's in flight
+  wait for it and get its result (or its exception). Queries are identical if
+  they have the same normalized key (see QueryApi: TSDB, metrics, sorted
+  filters, time window, rate/ms flags and aggregator).
+
+  Only queries that overlap in time are merged, results are not kept around
+  once the leader is done.
+
+  Both threaded callers and asyncio callers (AsyncQueryApi, whose queries run
+  on worker threads) are covered: a waiting query blocks its own thread,
+  never the event loop.
+
+Example usage:
+    coalescer = query_coalescer.get_default_coalescer()
+    q1 = QueryApi("10.121.32.1", 4242, t1, t2, [ts_id1], Aggregator.NONE,
+                  query_coalescer=coalescer)
+    q2 = QueryApi("10.121.32.1", 4242, t1, t2, [ts_id1], Aggregator.NONE,
+                  query_coalescer=coalescer)
+    # q1 and q2 populated concurrently (by 2 threads) -> 1 HTTP request.
+'''
+
+from concurrent.futures import Future
+import threading
+
+class QueryCoalescer(object):
+  def __init__(self):
+    self.__lock = threading.Lock()
+    self.__in_flight = {}       # key -> Future of the leader's result.
+    self.__num_fetches = 0      # Calls that did the fetch (leaders).
+    self.__num_coalesced = 0    # Calls that waited for a leader instead.
+
+  def run(self, key, fetch_func):
+    '''Returns fetch_func(), unless a call with the same (hashable) key is
+       already in flight in which case its result is returned instead. An
+       exception raised by fetch_func() is raised to all the callers.'''
+    with self.__lock:
+      future = self.__in_flight.get(key)
+      flag_leader = future == None
+      if flag_leader:
+        future = Future()
+        self.__in_flight[key] = future
+        self.__num_fetches += 1
+      else:
+        self.__num_coalesced += 1
+    if not flag_leader:
+      return future.result()
+
+    try:
+      result = fetch_func()
+    except BaseException as err:
+      self.__done(key)
+      future.set_exception(err)
+      raise
+    self.__done(key)
+    future.set_result(result)
+    return result
+
+  def get_stats(self):
+    '''Returns a dictionary of coalescer statistics:
+         fetches:   Number of calls that did the fetch.
+         coalesced: Number of calls served by another call's fetch.
+         in_flight: Number of fetches currently in flight.'''
+    with self.__lock:
+      return {
+        'fetches': self.__num_fetches,
+        'coalesced': self.__num_coalesced,
+        'in_flight': len(self.__in_flight),
+      }
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __done(self, key):
+    # Later calls with the same key start a fetch of their own.
+    with self.__lock:
+      del self.__in_flight[key]
+
+
+#############################################################################
+# Process wide default coalescer.
+#############################################################################
+_default_coalescer = None
+_default_coalescer_lock = threading.Lock()
+
+def get_default_coalescer():
+  '''Returns the process wide QueryCoalescer, creating it on first use.'''
+  global _default_coalescer
+  with _default_coalescer_lock:
+    if _default_coalescer == None:
+      _default_coalescer = QueryCoalescer()
+    return _default_coalescer
+
+def set_default_coalescer(coalescer):
+  '''Replaces the process wide QueryCoalescer. Objects already holding the
+     previous one keep using it.'''
+  global _default_coalescer
+  with _default_coalescer_lock:
+    _default_coalescer = coalescer
@@ -10,7 +10,12 @@
   sample output.
 '''
 
+import re
+from urllib import parse
+
 from . import basic_types as bt
+from . import exceptions as excp
+from . import timeseries_pattern as tspat
 
 # collection of URL templates for constructing TSDB specific URLs.
 tsdb_queryurl_templates = {
@@ -18,10 +23,68 @@ tsdb_queryurl_templates = {
     'base_url': "http://%s:%d/api/query?start=%s&end=%s",
     'base_url_with_ms': "http://%s:%d/api/query?start=%s&end=%s&ms=true",
     'metric_suburl': "&m=%s:%s{%s}",
-    'metric_suburl_with_rate': "&m=%s:rate:%s{%s}"
+    'metric_suburl_with_rate': "&m=%s:rate:%s{%s}",
+    # Aggregated queries: the filters don't group by (see url()).
+    'metric_suburl_aggregated': "&m=%s:%s{}{%s}",
+    'metric_suburl_aggregated_with_rate': "&m=%s:rate:%s{}{%s}",
+    'post_url': "http://%s:%d/api/query",
+    # Metadata (see MetricCatalog).
+    'suggest_url': "http://%s:%d/api/suggest?%s",
+    'lookup_url': "http://%s:%d/api/search/lookup?%s",
   }
 }
 
+# e.g. 30s, 1m, 6h, 1d or 0all (1 bucket for the whole time range).
+_DOWNSAMPLE_INTERVAL_RE = re.compile(r'^([1-9][0-9]*(ms|s|m|h|d|w|n|y)|0all)$')
+
+'''
+  Downsample spec: the TSDB reduces each timeseries to 1 datapoint per
+  interval, computed by aggregator over the datapoints in the interval.
+  Buckets without any datapoint are filled as per fill_policy.
+
+Example usage:
+    ds = Downsample("1m", bt.Aggregator.AVG)     # str(ds) == "1m-avg"
+    ds = Downsample("1h", bt.Aggregator.MAX, bt.FillPolicy.ZERO)
+'''
+class Downsample(object):
+  def __init__(self, interval, aggregator, fill_policy=bt.FillPolicy.NONE):
+    if not isinstance(interval, str) or \
+       _DOWNSAMPLE_INTERVAL_RE.match(interval) == None:
+      raise excp.InvalidDownsampleSpec("Bad interval: %s" % (interval,))
+    if aggregator == bt.Aggregator.NONE:
+      raise excp.InvalidDownsampleSpec("Downsampling needs an aggregator")
+    self.__interval = interval
+    self.__aggregator = aggregator
+    self.__fill_policy = fill_policy
+
+  @property
+  def interval(self):
+    return self.__interval
+
+  @property
+  def aggregator(self):
+    return self.__aggregator
+
+  @property
+  def fill_policy(self):
+    return self.__fill_policy
+
+  def __str__(self):
+    # OpenTSDB syntax: <interval>-<aggregator>[-<fill policy>]
+    ds_str = "%s-%s" % (self.__interval, self.__aggregator.name.lower())
+    if self.__fill_policy != bt.FillPolicy.NONE:
+      ds_str += "-%s" % self.__fill_policy.name.lower()
+    return ds_str
+
+  def __repr__(self):
+    return "Downsample(%s)" % str(self)
+
+  def __eq__(self, other):
+    return isinstance(other, Downsample) and str(self) == str(other)
+
+  def __hash__(self):
+    return hash(str(self))
+
 def filters_to_str(q_filters):
   # We generate a list of key=value pairs in sorted key order. Sorting is not
   # needed by the query, but its just a nice to have to the unit test doesn't
@@ -38,9 +101,15 @@ def filters_to_str(q_filters):
    - Construct base URL.
    - Construct metric suburl pieces from the timeseries IDs.
    - Combine base URL and metric suburls into a single fully qualified URL.
+
+  With an aggregator other than NONE, all timeseries matching a timeseries ID
+  are aggregated into 1 (the filters don't group by, same as in the POST
+  body). The tags of a TimeseriesPattern do group by. downsample, a
+  Downsample object, is applied to each timeseries before aggregating.
 '''
 def url(tsdb_type, host, tcpport, start_time, end_time, query_aggregator,
-        tsid_list, flag_compute_rate=False, flag_ms_response=False):
+        tsid_list, flag_compute_rate=False, flag_ms_response=False,
+        downsample=None):
 
   # point to TSDB specific templates.
   templates = tsdb_queryurl_templates[tsdb_type]
@@ -60,21 +129,103 @@ def url(tsdb_type, host, tcpport, start_time, end_time, query_aggregator,
 
   # Based on whether 'rate' is being requested select the right metric surl
   # template to use.
-  metric_surl_template = None
-  if flag_compute_rate == True:
-    metric_surl_template = templates['metric_suburl_with_rate']
-  else:
-    metric_surl_template = templates['metric_suburl']
+  # Aggregated timeseries IDs use a template of their own, whose filters
+  # don't group by.
+  rate_suffix = '_with_rate' if flag_compute_rate == True else ''
+  metric_surl_template = templates['metric_suburl' + rate_suffix]
+  tsid_surl_template = metric_surl_template
+  if query_aggregator != bt.Aggregator.NONE:
+    tsid_surl_template = templates['metric_suburl_aggregated' + rate_suffix]
+
+  # The downsample spec goes right after the aggregator e.g. "sum:1m-avg".
+  aggregator_str = query_aggregator.name.lower()
+  if downsample != None:
+    aggregator_str += ":%s" % downsample
 
   # Each timeseries ID expands into 1 metric_surl_piece. So we walk through
   # all the tsid's and collect all the metric surl pieces in a list.
   metric_surl_pieces = []
   for tsid in tsid_list:
-    surl = metric_surl_template % (query_aggregator.name.lower(), \
-                                   tsid.metric_id, filters_to_str(tsid.filters))
+    # The classic {tag=value} syntax groups by, and takes '*' as a wildcard
+    # and '|' as a literal_or.
+    if isinstance(tsid, tspat.TimeseriesPattern):
+      surl_template = metric_surl_template
+    else:
+      surl_template = tsid_surl_template
+    surl = surl_template % (aggregator_str, \
+                            tsid.metric_id, filters_to_str(tsid.filters))
     metric_surl_pieces.append(surl)
     
   # Combine the base URL and metric surl pieces into one full qualified URL.
   fq_url = "%s%s" % (base_url, "".join(metric_surl_pieces))
                               
   return fq_url  # FIXME: Log the URL before returning.
+
+
+'''
+  POST flavour of url(): returns the pair (url, body) for sending the same
+  query as a JSON body in an HTTP POST. The URL stays short regardless of the
+  number of timeseries and tags, so this is the way to go for large queries.
+
+  The body holds 1 sub-query per distinct timeseries ID (or
+  TimeseriesPattern, whose filters group by); duplicates in
+  tsid_list are dropped since they'd only fetch the same data twice. Each
+  sub-query carries its own filter list: the JSON body has no way of
+  referring to another sub-query's filters.
+
+  Like url(), this is a garbage in/garbage out style API.
+'''
+def post_url_and_body(tsdb_type, host, tcpport, start_time, end_time,
+                      query_aggregator, tsid_list, flag_compute_rate=False,
+                      flag_ms_response=False, downsample=None):
+  templates = tsdb_queryurl_templates[tsdb_type]
+
+  sub_queries = []
+  seen_fqids = set()
+  for tsid in tsid_list:
+    if tsid.fqid in seen_fqids:
+      continue
+    seen_fqids.add(tsid.fqid)
+
+    flag_pattern = isinstance(tsid, tspat.TimeseriesPattern)
+    sub_query = {
+      "aggregator": query_aggregator.name.lower(),
+      "metric": tsid.metric_id,
+      "rate": flag_compute_rate,
+      "filters": [
+          {"type": tsid.filter_type(kk) if flag_pattern else "literal_or",
+           "tagk": kk, "filter": tsid.filters[kk], "groupBy": flag_pattern}
+          for kk in sorted(tsid.filters.keys())],
+    }
+    if downsample != None:
+      sub_query["downsample"] = str(downsample)
+    sub_queries.append(sub_query)
+
+  body = {
+    "start": start_time.value,
+    "end": end_time.value,
+    "queries": sub_queries,
+  }
+  if flag_ms_response:
+    body["msResolution"] = True
+  return templates['post_url'] % (host, tcpport), body
+
+
+'''
+  URL of a metadata query for the names (of kind "metrics", "tagk" or
+  "tagv") starting with prefix. At most max_results names are returned.
+'''
+def suggest_url(tsdb_type, host, tcpport, kind, prefix, max_results):
+  templates = tsdb_queryurl_templates[tsdb_type]
+  params = parse.urlencode({"type": kind, "q": prefix, "max": max_results})
+  return templates['suggest_url'] % (host, tcpport, params)
+
+
+'''
+  URL of a metadata query for the tag sets of (upto max_results of) the
+  timeseries of metric_id.
+'''
+def lookup_url(tsdb_type, host, tcpport, metric_id, max_results):
+  templates = tsdb_queryurl_templates[tsdb_type]
+  params = parse.urlencode({"m": metric_id, "limit": max_results})
+  return templates['lookup_url'] % (host, tcpport, params)
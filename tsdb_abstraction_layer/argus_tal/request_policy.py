@@ -0,0 +1,262 @@
+'''
+  request_policy.py
+
+  Defines RequestPolicy: how hard a query tries to get a response in time,
+  i.e. a deadline, hedged requests and retries.
+
+  Without a policy, a query waits for its single request for as long as the
+  HttpSessionPool timeouts allow. A QueryApi handed a RequestPolicy instead:
+   - Gives up once the deadline has passed, with error -4.
+   - Hedges: if no response has arrived within the observed p95 latency (of
+     this policy's requests), sends a duplicate request, to the next endpoint
+     if alternate endpoints are configured. The first response is used, the
+     other one is closed.
+   - Retries failed requests (connection errors, timeouts and 5xx
+     responses), upto max_retries times, after a jittered exponential
+     backoff. Retries also go to the next endpoint.
+
+  Queries only read, so sending one twice is harmless. Writes (e.g.
+  /api/put) must not go through a RequestPolicy.
+
+  Configuration:
+    deadline:             Secs from sending the query to receiving its
+                          response (the headers, for a streamed response),
+                          across all the attempts. None: no deadline.
+    max_retries:          Retries after the first attempt. 0: no retries.
+    backoff_base,
+    backoff_max:          Retry n waits a random time between 0 and
+                          min(backoff_max, backoff_base * 2 ** n) secs.
+    flag_hedge:           Enables hedged requests.
+    hedge_delay:          Secs after which a hedge is sent. None: the
+                          hedge_percentile of the observed latencies, once
+                          min_latency_samples have been observed (no hedging
+                          until then).
+    alternate_endpoints:  (host, port) pairs serving the same data (e.g. the
+                          other TSDs of an OpenTSDB cluster), in addition to
+                          the query's own.
+
+  Telemetry:
+    QueryApi.query_telemetry reports what it took to answer the last query:
+    requests sent, retries, hedges, hedge_wins (hedges answering first) and
+    request_secs (time spent waiting for responses). get_stats() reports the
+    same totals across the queries of the policy, plus queries, failures
+    (queries without any response) and the latency_p50 / latency_p95 of the
+    requests.
+
+Example usage:
+    policy = RequestPolicy(deadline=10.0, max_retries=2, flag_hedge=True,
+                           alternate_endpoints=[("10.121.32.2", 4242)])
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE, request_policy=policy)
+'''
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import random
+import threading
+import time
+
+import numpy as np
+import requests
+
+from . import exceptions as excp
+
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_BASE = 0.1        # secs
+DEFAULT_BACKOFF_MAX = 2.0         # secs
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 1000             # Latencies kept (most recent ones).
+MAX_HEDGE_WORKERS = 32            # Requests in flight at once, with hedging.
+
+# Responses worth retrying: the TSD (or a proxy in front of it) is unwell.
+RETRY_STATUS_CODES = frozenset([500, 502, 503, 504])
+
+class RequestPolicy(object):
+  def __init__(self, deadline=None, max_retries=DEFAULT_MAX_RETRIES,
+               backoff_base=DEFAULT_BACKOFF_BASE,
+               backoff_max=DEFAULT_BACKOFF_MAX, flag_hedge=False,
+               hedge_delay=None, hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+               min_latency_samples=DEFAULT_MIN_LATENCY_SAMPLES,
+               alternate_endpoints=None):
+    assert max_retries >= 0
+    self.__deadline = deadline
+    self.__max_retries = max_retries
+    self.__backoff_base = backoff_base
+    self.__backoff_max = backoff_max
+    self.__flag_hedge = flag_hedge
+    self.__hedge_delay = hedge_delay
+    self.__hedge_percentile = hedge_percentile
+    self.__min_latency_samples = min_latency_samples
+    self.__alternate_endpoints = list(alternate_endpoints or [])
+
+    self.__lock = threading.Lock()
+    self.__latencies = deque(maxlen=LATENCY_WINDOW)
+    self.__totals = new_telemetry()
+    self.__num_queries = 0
+    self.__num_failures = 0
+    # Only needed to wait for a request with a timeout i.e. to hedge.
+    self.__executor = ThreadPoolExecutor(max_workers=MAX_HEDGE_WORKERS) \
+        if flag_hedge else None
+
+  def send(self, send_func, host, port):
+    '''
+    Sends a request as per the policy. send_func(host, port, timeout) sends
+    it to 1 endpoint and returns the response; timeout (secs, or None for the
+    pool's defaults) must be passed on to requests.
+
+    Returns the pair (response, telemetry). The response may be a failed one
+    (e.g. 503) once retries are exhausted. Raises exceptions.QueryFailed
+    (error_code -4) if no response arrived in time.
+    '''
+    telemetry = new_telemetry()
+    start = time.monotonic()
+    deadline_at = None if self.__deadline == None else start + self.__deadline
+    endpoints = [(host, port)] + self.__alternate_endpoints
+    response = error = None
+    for attempt in range(self.__max_retries + 1):
+      if attempt > 0:
+        backoff = random.uniform(0, min(self.__backoff_max,
+                                        self.__backoff_base * 2 ** attempt))
+        if deadline_at != None and time.monotonic() + backoff >= deadline_at:
+          break
+        if response != None:
+          response.close()
+        time.sleep(backoff)
+        telemetry['retries'] += 1
+      try:
+        response, error = self.__attempt(send_func, endpoints, attempt,
+                                         deadline_at, telemetry), None
+      except requests.exceptions.RequestException as err:
+        response, error = None, err
+      if _is_final(response):
+        break
+    telemetry['request_secs'] = time.monotonic() - start
+
+    with self.__lock:
+      self.__num_queries += 1
+      self.__num_failures += 1 if response == None else 0
+      add_telemetry(self.__totals, telemetry)
+    if response == None:
+      raise excp.QueryFailed("No response: %s" % error, -4)
+    return response, telemetry
+
+  def get_stats(self):
+    '''Returns a dictionary of policy statistics, see top of file.'''
+    with self.__lock:
+      stats = dict(self.__totals)
+      stats['queries'] = self.__num_queries
+      stats['failures'] = self.__num_failures
+      latencies = list(self.__latencies)
+    stats['latency_p50'], stats['latency_p95'] = \
+        [float(pp) for pp in np.percentile(latencies, [50, 95])] \
+        if len(latencies) > 0 else (None, None)
+    return stats
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __current_hedge_delay(self):
+    # Returns None if no hedge is to be sent.
+    if not self.__flag_hedge:
+      return None
+    if self.__hedge_delay != None:
+      return self.__hedge_delay
+    with self.__lock:
+      if len(self.__latencies) < self.__min_latency_samples:
+        return None
+      latencies = list(self.__latencies)
+    return float(np.percentile(latencies, self.__hedge_percentile))
+
+  def __timed_send(self, send_func, endpoint, deadline_at):
+    timeout = None
+    if deadline_at != None:
+      timeout = deadline_at - time.monotonic()
+      if timeout <= 0:
+        raise requests.exceptions.Timeout("Deadline exceeded")
+    start = time.monotonic()
+    response = send_func(endpoint[0], endpoint[1], timeout)
+    with self.__lock:
+      self.__latencies.append(time.monotonic() - start)
+    return response
+
+  def __attempt(self, send_func, endpoints, attempt, deadline_at, telemetry):
+    # 1 attempt, hedged if need be. Returns the first response.
+    endpoint = endpoints[attempt % len(endpoints)]
+    telemetry['requests'] += 1
+    hedge_delay = self.__current_hedge_delay()
+    if hedge_delay == None:
+      return self.__timed_send(send_func, endpoint, deadline_at)
+
+    futures = [self.__executor.submit(self.__timed_send, send_func, endpoint,
+                                      deadline_at)]
+    done, _ = wait(futures, timeout=_min_timeout(hedge_delay, deadline_at))
+    if len(done) == 0 and _min_timeout(None, deadline_at) != 0:
+      hedge_endpoint = endpoints[(attempt + 1) % len(endpoints)]
+      futures.append(self.__executor.submit(self.__timed_send, send_func,
+                                            hedge_endpoint, deadline_at))
+      telemetry['requests'] += 1
+      telemetry['hedges'] += 1
+
+    # The first response that isn't worth a retry wins. Else the last one.
+    response = error = None
+    pending = set(futures)
+    while len(pending) > 0 and not _is_final(response):
+      done, pending = wait(pending, timeout=_min_timeout(None, deadline_at),
+                           return_when=FIRST_COMPLETED)
+      if len(done) == 0:
+        break   # Deadline.
+      for future in done:
+        try:
+          f_response = future.result()
+        except requests.exceptions.RequestException as err:
+          error = err
+          continue
+        if _is_final(response):
+          f_response.close()   # Both arrived at once, the other one won.
+          continue
+        if response != None:
+          response.close()
+        response = f_response
+        if _is_final(response) and future is not futures[0]:
+          telemetry['hedge_wins'] += 1
+
+    for future in pending:
+      # Losers (or too late): their responses aren't used.
+      future.add_done_callback(_close_response)
+    if response != None:
+      return response
+    if error != None:
+      raise error
+    raise requests.exceptions.Timeout("Deadline exceeded")
+
+
+def new_telemetry():
+  '''Returns the telemetry of a query that sent no request (yet).'''
+  return {'requests': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0,
+          'request_secs': 0.0}
+
+def add_telemetry(totals, telemetry):
+  '''Adds telemetry to totals (both as returned by new_telemetry()).'''
+  for key, value in telemetry.items():
+    totals[key] += value
+
+
+#############################################################################
+# Pure private helper functions start here.
+#############################################################################
+def _min_timeout(timeout, deadline_at):
+  # The smaller of timeout and the time left until deadline_at (None for
+  # none), never negative.
+  if deadline_at != None:
+    time_left = max(0, deadline_at - time.monotonic())
+    timeout = time_left if timeout == None else min(timeout, time_left)
+  return timeout
+
+def _is_final(response):
+  # True for a response that isn't worth a retry.
+  return response != None and response.status_code not in RETRY_STATUS_CODES
+
+def _close_response(future):
+  if not future.cancelled() and future.exception() == None:
+    future.result().close()
@@ -0,0 +1,226 @@
+'''
+  ring_buffer_timeseries.py
+
+  Defines the RingBufferTimeseries class: a mutable, append-only, fixed
+  capacity timeseries meant for live (continuous) processing.
+
+  A TimeseriesDataDict is immutable, so a live processor that re-queries the
+  TSDB every period ends up rebuilding every object from scratch. Instead,
+  a RingBufferTimeseries is extended in place with the new datapoints while
+  the oldest datapoints get evicted:
+    - by count: never more than 'capacity' datapoints are held.
+    - by time (optional): datapoints older than 'max_age' (relative to the
+      newest datapoint) are dropped.
+    - explicitly, via evict_before().
+
+  Storage layout:
+    Datapoints live in a pair of numpy arrays (timestamps, values) sized for
+    2 x capacity datapoints. The live datapoints are always the contiguous
+    region [head, tail) of these arrays. Appends write past tail and evictions
+    advance head. When an append doesn't fit, the live datapoints are copied
+    to the start of a freshly allocated pair of arrays. That copy happens at
+    most once every 'capacity' appends, so appends are amortized O(1).
+
+    A region of the arrays, once written, is never written again (compaction
+    allocates new arrays rather than reusing the old ones). Thus a read-only
+    view of the live region is a true frozen snapshot: snapshot() returns a
+    TimeseriesDataDict around such views in O(1), without copying any data.
+
+  API summary:
+    append(timestamp, value) / extend(timestamps, values)
+      Add datapoints at the tail. Datapoints that aren't newer than the
+      current newest datapoint are dropped, which makes it safe to extend
+      with the result of a query whose window overlaps the previous one.
+
+    evict_before(timestamp)
+      Drops all datapoints older than timestamp.
+
+    snapshot()
+      Returns a TimeseriesDataDict holding the current datapoints. Later
+      appends and evictions don't affect it.
+
+    The lookup and iteration API of TimeseriesDataDict is supported as well:
+    get_timeseries_id(), get_iter_slice(), window(), get_datapoint(),
+    get_datapoints(), cursor(), get_min_key(), get_max_key(),
+    get_timestamps(), get_values(), is_empty(), iteration and len(). Each of
+    these operates on (a snapshot of) the datapoints held at the time of the
+    call.
+
+  Usage:
+    rb_ts = RingBufferTimeseries(ts_id_obj, capacity=3600, max_age=3600)
+    while True:
+      tsdd = ... query the last few minutes ...
+      rb_ts.extend(tsdd.get_timestamps(), tsdd.get_values())
+      ... process rb_ts (or rb_ts.snapshot()) ...
+'''
+
+import numpy as np
+
+from .timeseries_datadict import TimeseriesDataDict
+
+class RingBufferTimeseries(object):
+  '''
+    ts_id_obj: TimeseriesID identifying the timeseries.
+
+    capacity: Maximum number of datapoints held.
+
+    max_age: If not None, datapoints older than (newest timestamp - max_age)
+             are evicted on every append.
+  '''
+  def __init__(self, ts_id_obj, capacity, max_age=None):
+    assert capacity > 0
+    assert max_age == None or max_age >= 0
+    self.__ts_id_obj = ts_id_obj
+    self.__capacity = int(capacity)
+    self.__max_age = max_age
+
+    self.__ts_keys_arr = np.empty(2 * self.__capacity, dtype=np.int64)
+    self.__ts_values_arr = np.empty(2 * self.__capacity, dtype=np.float64)
+    self.__head = 0   # Index of the oldest datapoint.
+    self.__tail = 0   # Index past the newest datapoint.
+
+    # Built on first use after every change, see snapshot().
+    self.__snapshot = None
+
+  def get_capacity(self):
+    return self.__capacity
+
+  def append(self, timestamp, value):
+    '''Adds a datapoint at the tail. Returns False (and drops the datapoint)
+       if it isn't newer than the current newest datapoint, True otherwise.'''
+    return self.extend([timestamp], [value]) == 1
+
+  def extend(self, timestamps, values):
+    '''Adds a time ordered sequence of datapoints at the tail. Datapoints not
+       newer than the current newest datapoint are dropped. Returns the number
+       of datapoints added.'''
+    keys_arr = np.asarray(timestamps, dtype=np.int64)
+    values_arr = np.asarray(values, dtype=np.float64)
+    assert keys_arr.shape == values_arr.shape and keys_arr.ndim == 1
+    assert np.all(keys_arr[1:] > keys_arr[:-1]), "Timestamps must be in order"
+
+    if self.__tail > self.__head:
+      first_new_idx = int(np.searchsorted(
+          keys_arr, self.__ts_keys_arr[self.__tail - 1], side='right'))
+      keys_arr = keys_arr[first_new_idx:]
+      values_arr = values_arr[first_new_idx:]
+    num_added = len(keys_arr)
+    if num_added == 0:
+      return 0
+
+    # Anything beyond capacity would be evicted right away, so don't copy it.
+    if num_added > self.__capacity:
+      keys_arr = keys_arr[-self.__capacity:]
+      values_arr = values_arr[-self.__capacity:]
+    num_new = len(keys_arr)
+
+    # Evict by count. Only the newest (capacity - num_new) datapoints held
+    # can stay.
+    self.__head = max(self.__head,
+                      self.__tail - (self.__capacity - num_new))
+    if self.__tail + num_new > len(self.__ts_keys_arr):
+      self.__compact()
+
+    self.__ts_keys_arr[self.__tail:self.__tail + num_new] = keys_arr
+    self.__ts_values_arr[self.__tail:self.__tail + num_new] = values_arr
+    self.__tail += num_new
+
+    # Evict by time.
+    if self.__max_age != None:
+      self.__evict_before(int(keys_arr[-1]) - self.__max_age)
+
+    self.__snapshot = None
+    return num_added
+
+  def evict_before(self, timestamp):
+    '''Drops all datapoints older than timestamp. Returns the number of
+       datapoints dropped.'''
+    num_evicted = self.__evict_before(timestamp)
+    if num_evicted > 0:
+      self.__snapshot = None
+    return num_evicted
+
+  def snapshot(self):
+    '''Returns a TimeseriesDataDict holding the datapoints held right now.
+       This is O(1) and copies no data. The returned object is unaffected by
+       later appends and evictions.'''
+    if self.__snapshot == None:
+      keys_view = self.__ts_keys_arr[self.__head:self.__tail]
+      values_view = self.__ts_values_arr[self.__head:self.__tail]
+      keys_view.flags.writeable = False
+      values_view.flags.writeable = False
+      self.__snapshot = TimeseriesDataDict._from_frozen_columns(
+          self.__ts_id_obj, keys_view, values_view)
+    return self.__snapshot
+
+  #############################################################################
+  # TimeseriesDataDict lookup and iteration API. Each call works on a
+  # snapshot, so it is unaffected by appends made while it's in use (e.g.
+  # appending from within a for loop over this object).
+  #############################################################################
+  def get_timeseries_id(self):
+    return self.__ts_id_obj
+
+  def get_iter_slice(self, timestamp1, lookup_qualifier1,
+                           timestamp2, lookup_qualifier2):
+    return self.snapshot().get_iter_slice(timestamp1, lookup_qualifier1,
+                                          timestamp2, lookup_qualifier2)
+
+  def window(self, timestamp1, lookup_qualifier1,
+                   timestamp2, lookup_qualifier2):
+    return self.snapshot().window(timestamp1, lookup_qualifier1,
+                                  timestamp2, lookup_qualifier2)
+
+  def get_datapoint(self, timestamp, lookup_qualifier):
+    return self.snapshot().get_datapoint(timestamp, lookup_qualifier)
+
+  def get_datapoints(self, timestamps, lookup_qualifier):
+    return self.snapshot().get_datapoints(timestamps, lookup_qualifier)
+
+  def cursor(self, reverse=False):
+    return self.snapshot().cursor(reverse)
+
+  # Both raise IndexError if empty, as for a TimeseriesDataDict.
+  def get_min_key(self):
+    return int(self.__ts_keys_arr[self.__head:self.__tail][0])
+
+  def get_max_key(self):
+    return int(self.__ts_keys_arr[self.__head:self.__tail][-1])
+
+  def get_timestamps(self):
+    return self.snapshot().get_timestamps()
+
+  def get_values(self):
+    return self.snapshot().get_values()
+
+  def is_empty(self):
+    return self.__tail == self.__head
+
+  def __iter__(self):
+    return self.cursor()
+
+  def __len__(self):
+    return self.__tail - self.__head
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __evict_before(self, timestamp):
+    new_head = self.__head + int(np.searchsorted(
+        self.__ts_keys_arr[self.__head:self.__tail], timestamp, side='left'))
+    num_evicted = new_head - self.__head
+    self.__head = new_head
+    return num_evicted
+
+  def __compact(self):
+    # Moves the live datapoints to the start of new arrays. The old arrays are
+    # left untouched as snapshots may still be referencing them.
+    num_live = self.__tail - self.__head
+    keys_arr = np.empty(2 * self.__capacity, dtype=np.int64)
+    values_arr = np.empty(2 * self.__capacity, dtype=np.float64)
+    keys_arr[:num_live] = self.__ts_keys_arr[self.__head:self.__tail]
+    values_arr[:num_live] = self.__ts_values_arr[self.__head:self.__tail]
+    self.__ts_keys_arr = keys_arr
+    self.__ts_values_arr = values_arr
+    self.__head = 0
+    self.__tail = num_live
@@ -0,0 +1,290 @@
+'''
+  segment_store.py
+
+  Defines SegmentStore: an on-disk store of historical query results, kept
+  across runs.
+
+  Sensor data older than the ingestion delay never changes, yet re-runs of
+  backfills (e.g. past_x_days_applique.py) download all of it again. A
+  QueryApi handed a SegmentStore splits its time range into fixed, time
+  aligned blocks. Sealed blocks (those ending more than ingestion_delay ago)
+  are read from the store if they're there, or else fetched whole and
+  written to the store. Only the recent, unsealed, part of the time range
+  always goes to the TSDB.
+
+  Layout: 1 directory per (query settings, timeseries id, block) holding an
+  index.json (the timeseries in the block) and 1 file per timeseries with its
+  int64 timestamps followed by its float64 values. Files are memory-mapped
+  when read, so only the parts actually used are read from disk. With
+  flag_compress, files are zlib compressed instead (smaller, but read whole).
+  A block without any data is stored too, so it isn't fetched again.
+
+  Configuration:
+    directory:        Where the store lives. Created if needed. Stores may be
+                      shared by processes, blocks are written atomically.
+    max_bytes:        Upper bound on the size of the store. Least recently
+                      used blocks are deleted first.
+    block_secs:       Length of a block (in secs, for msec queries as well).
+                      Blocks are aligned on multiples of it.
+    ingestion_delay:  How long (in secs) after the fact datapoints may still
+                      land. Blocks more recent than that aren't stored.
+    flag_compress:    See above.
+
+Example usage:
+    store = SegmentStore("/var/cache/argus/segments",
+                         max_bytes=10 * 1024 ** 3)
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [ts_id1], Aggregator.NONE, segment_store=store)
+'''
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from . import timeseries_datadict as tsdd
+from . import timeseries_id as ts_id
+from . import timestamp as ts
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+DEFAULT_BLOCK_SECS = 3600          # OpenTSDB stores data in hourly rows.
+DEFAULT_INGESTION_DELAY = 600      # secs
+
+_INDEX_FILE = 'index.json'
+
+class SegmentStore(object):
+  def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES,
+               block_secs=DEFAULT_BLOCK_SECS,
+               ingestion_delay=DEFAULT_INGESTION_DELAY, flag_compress=False):
+    assert block_secs > 0
+    self.__directory = directory
+    self.__max_bytes = max_bytes
+    self.__block_secs = block_secs
+    self.__ingestion_delay = ingestion_delay
+    self.__flag_compress = flag_compress
+
+    self.__lock = threading.Lock()
+    # Block directory -> size in bytes, least recently used first.
+    self.__blocks = OrderedDict()
+    self.__nbytes = 0
+    self.__num_block_hits = 0
+    self.__num_block_misses = 0
+    self.__num_evictions = 0
+    os.makedirs(directory, exist_ok=True)
+    self.__load_blocks()
+
+  def get(self, query_key, tsid_list, start, end, flag_millisecond=False):
+    '''
+    Returns the pair (tsdd_list, fetch_ranges) for the query of tsid_list
+    over [start, end]:
+      tsdd_list:    The stored data within [start, end], 1 object per
+                  timeseries and block.
+      fetch_ranges: List of (f_start, f_end, flag_store) for the parts that
+                    need fetching. If flag_store is set, the result of the
+                    fetch is to be handed to put().
+    query_key identifies everything else about the query. Timestamps are in
+    msecs if flag_millisecond (ms=true) is set, start and end may be in
+    either unit (see timestamp.bounds_in_unit()).
+    '''
+    start, end = ts.bounds_in_unit(start, end, flag_millisecond)
+    block_len = self.__block_len(flag_millisecond)
+    sealed_end = self.__sealed_end(flag_millisecond)
+    tsdd_list = []
+    fetch_ranges = []
+    num_hits = num_misses = 0
+    b_start = start - start % block_len
+    while b_start <= end and b_start + block_len - 1 <= sealed_end:
+      b_end = b_start + block_len - 1
+      b_tsdd_list = self.__read_blocks(
+          [self.__block_dir(query_key, tsid, b_start) for tsid in tsid_list])
+      if b_tsdd_list != None:
+        num_hits += 1
+        # A timeseries selected by more than 1 of the ids is in more than 1
+        # of the blocks.
+        tsdd_by_fqid = {tsdd_obj.get_timeseries_id().fqid: tsdd_obj
+                        for tsdd_obj in tsdd.clip(b_tsdd_list, start, end)}
+        tsdd_list.extend(tsdd_by_fqid.values())
+      else:
+        num_misses += 1
+        # Consecutive missing blocks are fetched together.
+        if len(fetch_ranges) > 0 and fetch_ranges[-1][1] == b_start - 1:
+          fetch_ranges[-1] = (fetch_ranges[-1][0], b_end, True)
+        else:
+          fetch_ranges.append((b_start, b_end, True))
+      b_start += block_len
+    if b_start <= end:
+      fetch_ranges.append((max(start, b_start), end, False))
+    with self.__lock:
+      self.__num_block_hits += num_hits
+      self.__num_block_misses += num_misses
+    return tsdd_list, fetch_ranges
+
+  def put(self, query_key, tsid_list, start, end, tsdd_list,
+          flag_millisecond=False):
+    '''
+    Stores tsdd_list: the data returned by the query of tsid_list over
+    [start, end], a fetch range returned by get() with flag_store set.
+    '''
+    start, end = ts.bounds_in_unit(start, end, flag_millisecond)
+    block_len = self.__block_len(flag_millisecond)
+    assert start % block_len == 0 and (end + 1) % block_len == 0
+    for b_start in range(start, end + 1, block_len):
+      b_tsdd_list = tsdd.clip(tsdd_list, b_start, b_start + block_len - 1)
+      for tsid in tsid_list:
+        self.__write_block(
+            self.__block_dir(query_key, tsid, b_start), tsid,
+            [tsdd_obj for tsdd_obj in b_tsdd_list
+             if tsid.selects(tsdd_obj.get_timeseries_id())])
+
+  def get_stats(self):
+    '''Returns a dictionary of store statistics:
+         block_hits, block_misses: Sealed blocks read from the store / not
+                                   found in the store (thus fetched).
+         evictions:                Blocks deleted to make room.
+         bytes, blocks:            Current size of the store.'''
+    with self.__lock:
+      return {
+        'block_hits': self.__num_block_hits,
+        'block_misses': self.__num_block_misses,
+        'evictions': self.__num_evictions,
+        'bytes': self.__nbytes,
+        'blocks': len(self.__blocks),
+      }
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __block_len(self, flag_millisecond):
+    return self.__block_secs * 1000 if flag_millisecond else self.__block_secs
+
+  def __sealed_end(self, flag_millisecond):
+    sealed_end = time.time() - self.__ingestion_delay
+    return int(sealed_end * 1000) if flag_millisecond else int(sealed_end)
+
+  def __block_dir(self, query_key, tsid, b_start):
+    # Names must be the same across processes (unlike hash()).
+    key_str = json.dumps([str(query_key), tsid.metric_id,
+                          sorted(tsid.filters.items())])
+    key_hash = hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+    return os.path.join(self.__directory, key_hash[:2], key_hash[2:32],
+                        str(b_start))
+
+  def __touch_block(self, b_dir):
+    # Returns True if the block is in the store, marking it as used.
+    with self.__lock:
+      if b_dir in self.__blocks:
+        self.__blocks.move_to_end(b_dir)
+      elif os.path.exists(os.path.join(b_dir, _INDEX_FILE)):
+        # Written by another process.
+        self.__add_block(b_dir, _dir_size(b_dir))
+      else:
+        return False
+    try:
+      # The index file's mtime orders blocks by use across runs.
+      os.utime(os.path.join(b_dir, _INDEX_FILE))
+    except OSError:
+      pass
+    return True
+
+  def __read_blocks(self, block_dirs):
+    # Returns the timeseries of all the blocks, None if any is missing.
+    if not all(self.__touch_block(b_dir) for b_dir in block_dirs):
+      return None
+    try:
+      return [tsdd_obj for b_dir in block_dirs
+                       for tsdd_obj in self.__read_block(b_dir)]
+    except (OSError, ValueError):
+      # Evicted meanwhile (e.g. by another process) or damaged.
+      return None
+
+  def __read_block(self, b_dir):
+    with open(os.path.join(b_dir, _INDEX_FILE)) as index_file:
+      index = json.load(index_file)
+    tsdd_list = []
+    for series in index['series']:
+      num_dps = series['num_dps']
+      path = os.path.join(b_dir, series['file'])
+      if series['file'].endswith('.z'):
+        with open(path, 'rb') as data_file:
+          data = zlib.decompress(data_file.read())
+        keys_arr = np.frombuffer(data, dtype=np.int64, count=num_dps)
+        values_arr = np.frombuffer(data, dtype=np.float64, count=num_dps,
+                                   offset=8 * num_dps)
+      else:
+        keys_arr = np.memmap(path, dtype=np.int64, mode='r', shape=(num_dps,))
+        values_arr = np.memmap(path, dtype=np.float64, mode='r',
+                               offset=8 * num_dps, shape=(num_dps,))
+      tsdd_list.append(tsdd.TimeseriesDataDict._from_frozen_columns(
+          ts_id.TimeseriesID(series['metric'], series['tags']),
+          keys_arr, values_arr))
+    return tsdd_list
+
+  def __write_block(self, b_dir, tsid, tsdd_list):
+    # Written to a temporary directory which is then renamed into place, so
+    # that readers (in any process) only ever see complete blocks.
+    tmp_dir = "%s.tmp-%d-%d" % (b_dir, os.getpid(), threading.get_ident())
+    os.makedirs(tmp_dir)
+    index = {'metric': tsid.metric_id, 'filters': tsid.filters, 'series': []}
+    for num, tsdd_obj in enumerate(tsdd_list):
+      data = tsdd_obj.get_timestamps().tobytes() + \
+             tsdd_obj.get_values().tobytes()
+      file_name = "%d.dat" % num
+      if self.__flag_compress:
+        data = zlib.compress(data, 1)
+        file_name += '.z'
+      with open(os.path.join(tmp_dir, file_name), 'wb') as data_file:
+        data_file.write(data)
+      series_tsid = tsdd_obj.get_timeseries_id()
+      index['series'].append({'metric': series_tsid.metric_id,
+                              'tags': series_tsid.filters,
+                              'file': file_name, 'num_dps': len(tsdd_obj)})
+    with open(os.path.join(tmp_dir, _INDEX_FILE), 'w') as index_file:
+      json.dump(index, index_file)
+
+    try:
+      os.rename(tmp_dir, b_dir)
+    except OSError:
+      # Written meanwhile by someone else.
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+      return
+    with self.__lock:
+      self.__add_block(b_dir, _dir_size(b_dir))
+
+  def __add_block(self, b_dir, nbytes):
+    # Must be called with the lock held.
+    self.__nbytes += nbytes - self.__blocks.get(b_dir, 0)
+    self.__blocks[b_dir] = nbytes
+    self.__blocks.move_to_end(b_dir)
+    while self.__nbytes > self.__max_bytes and len(self.__blocks) > 0:
+      evicted_dir, evicted_nbytes = self.__blocks.popitem(last=False)
+      self.__nbytes -= evicted_nbytes
+      self.__num_evictions += 1
+      shutil.rmtree(evicted_dir, ignore_errors=True)
+
+  def __load_blocks(self):
+    # Picks up the blocks of previous runs, least recently used first.
+    blocks = []
+    for dir_path, dir_names, file_names in os.walk(self.__directory):
+      if '.tmp-' in dir_path:
+        # Left by a crash, unless it's still being written.
+        if os.path.getmtime(dir_path) < time.time() - 3600:
+          shutil.rmtree(dir_path, ignore_errors=True)
+        dir_names[:] = []
+      elif _INDEX_FILE in file_names:
+        mtime = os.path.getmtime(os.path.join(dir_path, _INDEX_FILE))
+        blocks.append((mtime, dir_path))
+        dir_names[:] = []
+    with self.__lock:
+      for _, b_dir in sorted(blocks):
+        self.__add_block(b_dir, _dir_size(b_dir))
+
+
+def _dir_size(dir_path):
+  return sum(os.path.getsize(os.path.join(dir_path, file_name))
+             for file_name in os.listdir(dir_path))
@@ -0,0 +1,218 @@
+'''
+  stats_pyramid.py
+
+  Defines the StatsPyramid class: a multi-resolution summary of a timeseries
+  used by TimeseriesDataDict.downsample() and TimeseriesDataDict.range_stats().
+
+  Time is split into buckets whose width is a power of two (in the units of
+  the timestamps i.e. seconds or milliseconds). Level k of the pyramid holds,
+  for every non-empty bucket of width 2^k:
+     count, min, max, sum (for mean), first value and last value.
+  Buckets are aligned to multiples of their width, so every bucket of level
+  k+1 is made of exactly 2 buckets of level k.
+
+  Levels are built lazily, the first time they're needed, and kept for later
+  use. The finest level built (the base level) is chosen such that a bucket
+  holds about BASE_BUCKET_DPS datapoints on average. Each coarser level is
+  built from the one below it, never from the raw datapoints.
+
+  range_stats(t1, t2) covers [t1, t2] with at most 2 buckets per level plus
+  the raw datapoints in the partial base buckets at either edge. Thus coarse
+  questions (e.g. "could this window cross a threshold ?") are answered
+  without walking the window.
+
+  NaN values propagate into min, max and mean.
+'''
+
+import numpy as np
+
+# Average number of datapoints per bucket at the base (finest) level.
+BASE_BUCKET_DPS = 64
+
+# Names of the statistics reported for each bucket / range.
+STAT_NAMES = ['count', 'min', 'max', 'mean', 'first', 'last']
+
+
+class _Level(object):
+  '''Statistics of all non-empty buckets of one level, as parallel arrays.'''
+  def __init__(self, bucket_ids, counts, mins, maxs, sums, firsts, lasts):
+    self.bucket_ids = bucket_ids
+    self.counts = counts
+    self.mins = mins
+    self.maxs = maxs
+    self.sums = sums
+    self.firsts = firsts
+    self.lasts = lasts
+
+
+def _group_starts(bucket_ids):
+  # bucket_ids is sorted. Returns the index where each run of equal ids starts.
+  return np.concatenate(([0], np.flatnonzero(np.diff(bucket_ids)) + 1))
+
+def _level_from_raw(keys_arr, values_arr, level_num):
+  bucket_ids = keys_arr >> level_num
+  starts = _group_starts(bucket_ids)
+  ends = np.append(starts[1:], len(bucket_ids))
+  return _Level(bucket_ids[starts], ends - starts,
+                np.minimum.reduceat(values_arr, starts),
+                np.maximum.reduceat(values_arr, starts),
+                np.add.reduceat(values_arr, starts),
+                values_arr[starts], values_arr[ends - 1])
+
+def _level_from_finer(finer):
+  # Merges pairs of buckets of the level below into buckets of this level.
+  bucket_ids = finer.bucket_ids >> 1
+  starts = _group_starts(bucket_ids)
+  ends = np.append(starts[1:], len(bucket_ids))
+  return _Level(bucket_ids[starts], np.add.reduceat(finer.counts, starts),
+                np.minimum.reduceat(finer.mins, starts),
+                np.maximum.reduceat(finer.maxs, starts),
+                np.add.reduceat(finer.sums, starts),
+                finer.firsts[starts], finer.lasts[ends - 1])
+
+def _level_to_columns(level, level_num):
+  return {
+    'timestamp': level.bucket_ids << level_num,
+    'count': level.counts,
+    'min': level.mins,
+    'max': level.maxs,
+    'mean': level.sums / level.counts,
+    'first': level.firsts,
+    'last': level.lasts,
+  }
+
+
+class StatsPyramid(object):
+  '''
+    keys_arr, values_arr: The sorted timestamps and their values (as stored by
+                          TimeseriesDataDict). Must not be empty.
+  '''
+  def __init__(self, keys_arr, values_arr):
+    assert len(keys_arr) > 0
+    self.__ts_keys_arr = keys_arr
+    self.__ts_values_arr = values_arr
+
+    # Pick the base level such that a base bucket holds ~BASE_BUCKET_DPS
+    # datapoints on average.
+    span = int(keys_arr[-1]) - int(keys_arr[0]) + 1
+    target_width = max(1, (span * BASE_BUCKET_DPS) // len(keys_arr))
+    self.__base_level_num = (target_width - 1).bit_length()
+
+    self.__levels = {}  # level number -> _Level
+
+  def downsample(self, bucket_width):
+    '''Returns a dictionary of column name -> numpy array, with 1 entry per
+       non-empty bucket. Columns are 'timestamp' (bucket start) and each of
+       STAT_NAMES.'''
+    bucket_width = int(bucket_width)
+    assert bucket_width > 0
+    level_num = bucket_width.bit_length() - 1
+    if bucket_width == (1 << level_num) and \
+       level_num >= self.__base_level_num:
+      return _level_to_columns(self.__get_level(level_num), level_num)
+
+    # Not a bucket width that the pyramid holds (or finer than its base level),
+    # so compute it from the raw datapoints. This is not cached.
+    bucket_ids = self.__ts_keys_arr // bucket_width
+    starts = _group_starts(bucket_ids)
+    ends = np.append(starts[1:], len(bucket_ids))
+    counts = ends - starts
+    return {
+      'timestamp': bucket_ids[starts] * bucket_width,
+      'count': counts,
+      'min': np.minimum.reduceat(self.__ts_values_arr, starts),
+      'max': np.maximum.reduceat(self.__ts_values_arr, starts),
+      'mean': np.add.reduceat(self.__ts_values_arr, starts) / counts,
+      'first': self.__ts_values_arr[starts],
+      'last': self.__ts_values_arr[ends - 1],
+    }
+
+  def range_stats(self, timestamp1, timestamp2):
+    '''Returns a dictionary of stat name (see STAT_NAMES) -> value for all the
+       datapoints from timestamp1 through timestamp2 (both included), or None
+       if there are no datapoints in that range.'''
+    first_idx = int(np.searchsorted(self.__ts_keys_arr, timestamp1,
+                                    side='left'))
+    end_idx = int(np.searchsorted(self.__ts_keys_arr, timestamp2,
+                                  side='right'))
+    if first_idx >= end_idx:
+      return None
+
+    # Ids of the first and last base buckets fully covered by the range.
+    base_width = 1 << self.__base_level_num
+    first_key = int(self.__ts_keys_arr[first_idx])
+    last_key = int(self.__ts_keys_arr[end_idx - 1])
+    lo_id = -((-first_key) // base_width)
+    hi_id = (last_key + 1) // base_width - 1
+    if lo_id > hi_id:  # No full bucket, the range is small enough to scan.
+      return self.__stats_from_parts([self.__raw_part(first_idx, end_idx)])
+
+    # Partial buckets at either edge come from the raw datapoints ...
+    lo_raw_end = int(np.searchsorted(self.__ts_keys_arr, lo_id * base_width,
+                                     side='left'))
+    hi_raw_start = int(np.searchsorted(self.__ts_keys_arr,
+                                       (hi_id + 1) * base_width, side='left'))
+    parts = [self.__raw_part(first_idx, lo_raw_end),
+             self.__raw_part(hi_raw_start, end_idx)]
+
+    # ... and the full buckets in between from the pyramid. Walk up the levels
+    # taking the unpaired bucket at either end of [lo_id, hi_id] until the
+    # ends meet (as in a segment tree).
+    level_num = self.__base_level_num
+    while lo_id <= hi_id:
+      if lo_id % 2 == 1:
+        parts.append(self.__bucket_part(level_num, lo_id))
+        lo_id += 1
+      if hi_id % 2 == 0:
+        parts.append(self.__bucket_part(level_num, hi_id))
+        hi_id -= 1
+      lo_id //= 2
+      hi_id //= 2
+      level_num += 1
+    return self.__stats_from_parts(parts)
+
+  #############################################################################
+  # Pure private helper methods start here.
+  #############################################################################
+  def __get_level(self, level_num):
+    if level_num not in self.__levels:
+      if level_num == self.__base_level_num:
+        self.__levels[level_num] = _level_from_raw(
+            self.__ts_keys_arr, self.__ts_values_arr, level_num)
+      else:
+        self.__levels[level_num] = _level_from_finer(
+            self.__get_level(level_num - 1))
+    return self.__levels[level_num]
+
+  # A 'part' is a tuple (start timestamp, count, min, max, sum, first, last)
+  # summarizing a contiguous chunk of the range, or None if it's empty.
+  def __raw_part(self, start_idx, end_idx):
+    if start_idx >= end_idx:
+      return None
+    values = self.__ts_values_arr[start_idx:end_idx]
+    return (int(self.__ts_keys_arr[start_idx]), end_idx - start_idx,
+            float(values.min()), float(values.max()), float(values.sum()),
+            float(values[0]), float(values[-1]))
+
+  def __bucket_part(self, level_num, bucket_id):
+    level = self.__get_level(level_num)
+    idx = int(np.searchsorted(level.bucket_ids, bucket_id))
+    if idx == len(level.bucket_ids) or level.bucket_ids[idx] != bucket_id:
+      return None  # Empty bucket.
+    return (bucket_id << level_num, int(level.counts[idx]),
+            float(level.mins[idx]), float(level.maxs[idx]),
+            float(level.sums[idx]), float(level.firsts[idx]),
+            float(level.lasts[idx]))
+
+  def __stats_from_parts(self, parts):
+    parts = sorted(part for part in parts if part != None)
+    count = sum(part[1] for part in parts)
+    return {
+      'count': count,
+      # np.min()/np.max() (unlike the builtins) reliably propagate NaN.
+      'min': float(np.min([part[2] for part in parts])),
+      'max': float(np.max([part[3] for part in parts])),
+      'mean': sum(part[4] for part in parts) / count,
+      'first': parts[0][5],
+      'last': parts[-1][6],
+    }
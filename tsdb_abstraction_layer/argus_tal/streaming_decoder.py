@@ -0,0 +1,181 @@
+'''
+  streaming_decoder.py
+
+  Incremental decoder for OpenTSDB query responses.
+
+  response.json() needs the whole raw response body in memory, builds a full
+  tree of Python objects from it (a dictionary entry, an int and a float
+  object per datapoint) and only then can the TimeseriesDataDict arrays be
+  built. On large responses that's 3 copies of the data alive at once.
+
+  iter_series() instead consumes the body a chunk at a time and, for each
+  timeseries in the response, decodes its 'dps' object straight into compact
+  int64/float64 buffers. Only 1 chunk of the raw body and 1 chunk worth of
+  decoded Python objects are alive at any point, so peak memory is roughly 1
+  copy of the final data. Each timeseries is handed out as soon as it's
+  decoded, before the rest of the response has been read.
+
+  Usage:
+    response = requests.get(url, stream=True)
+    for series in iter_series(response.iter_content(chunk_size=65536)):
+      ... series['metric'], series['tags'], series['dps'] ...
+
+  Each series is a dictionary of the fields of the JSON response object, as
+  json would decode them, except for a 'dps' object which is decoded into a
+  DpsColumns pair of numpy arrays (in the order received, which is not
+  necessarily sorted). Malformed or truncated JSON raises a ValueError, as
+  response.json() would.
+'''
+
+from array import array
+from collections import namedtuple
+import codecs
+import json
+import math
+import re
+
+import numpy as np
+
+# Parallel arrays (int64 timestamps, float64 values) of a decoded 'dps'.
+DpsColumns = namedtuple('DpsColumns', ['timestamps', 'values'])
+
+_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+_JSON_DECODER = json.JSONDecoder()
+
+class _StreamReader(object):
+  # Holds a window (buf) of the decoded text of the response and the current
+  # position in it. Text before the current position is dropped whenever more
+  # text is read in.
+  def __init__(self, byte_chunks):
+    self.__byte_chunks = iter(byte_chunks)
+    self.__utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+    self.buf = ''
+    self.pos = 0
+    self.eof = False
+
+  def fill(self):
+    '''Reads in more text. Returns False if there's no more to read.'''
+    if self.eof:
+      return False
+    self.buf = self.buf[self.pos:]
+    self.pos = 0
+    for chunk in self.__byte_chunks:
+      text = self.__utf8_decoder.decode(chunk)
+      if text:
+        self.buf += text
+        return True
+    self.buf += self.__utf8_decoder.decode(b'', final=True)
+    self.eof = True
+    return False
+
+  def peek(self):
+    '''Skips whitespace and returns the next character, '' at the end.'''
+    while True:
+      self.pos = _WHITESPACE_RE.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self.fill():
+        return ''
+
+  def expect(self, expected_char):
+    char = self.peek()
+    if char != expected_char:
+      raise ValueError("Expected '%s' but found '%s'" % (expected_char, char))
+    self.pos += 1
+
+  def read_value(self):
+    '''Decodes the next JSON value (of any type).'''
+    self.peek()
+    while True:
+      try:
+        value, end_pos = _JSON_DECODER.raw_decode(self.buf, self.pos)
+        # A value ending right at the end of buf may be cut short (e.g. the
+        # number 12 out of 1234), so it's only final if more text follows.
+        if end_pos < len(self.buf) or self.eof:
+          self.pos = end_pos
+          return value
+      except json.JSONDecodeError:
+        if self.eof:
+          raise
+      self.fill()
+
+  def read_dps_columns(self):
+    '''Decodes a 'dps' object i.e. {"<timestamp>": <value>, ...}.'''
+    self.expect('{')
+    timestamps = array('q')
+    values = array('d')
+    while True:
+      # A dps object has no nested objects, so the first '}' closes it.
+      # Until that's been read in, decode upto the last complete datapoint.
+      close_pos = self.buf.find('}', self.pos)
+      end_pos = close_pos if close_pos >= 0 else self.buf.rfind(',', self.pos)
+      if end_pos < 0:
+        if not self.fill():
+          raise ValueError("Truncated dps object")
+        continue
+
+      # Decoding a run of datapoints with json is much faster than decoding
+      # them one at a time, and the run is only as large as a chunk.
+      dps_run = self.buf[self.pos:end_pos]
+      if dps_run.strip():
+        dps_run = json.loads('{%s}' % dps_run)
+        timestamps.extend(map(int, dps_run.keys()))
+        num_values = len(values)
+        try:
+          values.extend(dps_run.values())
+        except TypeError:
+          # null values (downsampled with FillPolicy.NULL) become NaN.
+          del values[num_values:]
+          values.extend(math.nan if vv == None else vv
+                        for vv in dps_run.values())
+      self.pos = end_pos + 1
+      if close_pos >= 0:
+        return DpsColumns(np.frombuffer(timestamps, dtype=np.int64),
+                          np.frombuffer(values, dtype=np.float64))
+
+  def read_series(self):
+    self.expect('{')
+    series = {}
+    if self.peek() == '}':
+      self.pos += 1
+      return series
+    while True:
+      key = self.read_value()
+      if not isinstance(key, str):
+        raise ValueError("Expected a string key, found %s" % key)
+      self.expect(':')
+      if key == 'dps' and self.peek() == '{':
+        series[key] = self.read_dps_columns()
+      else:
+        series[key] = self.read_value()
+      if self.read_separator('}'):
+        return series
+
+  def read_separator(self, closing_char):
+    '''Reads either a ',' (returns False) or closing_char (returns True).'''
+    char = self.peek()
+    self.pos += 1
+    if char == closing_char:
+      return True
+    if char != ',':
+      raise ValueError("Expected ',' or '%s' but found '%s'" % \
+                       (closing_char, char))
+    return False
+
+
+def iter_series(byte_chunks):
+  '''
+  Generator yielding the timeseries (see top of file) of the OpenTSDB query
+  response whose body is supplied as an iterable of byte chunks.
+  '''
+  reader = _StreamReader(byte_chunks)
+  reader.expect('[')
+  if reader.peek() == ']':
+    reader.pos += 1
+  else:
+    while True:
+      yield reader.read_series()
+      if reader.read_separator(']'):
+        break
+  if reader.peek() != '':
+    raise ValueError("Unexpected data after the end of the response")
@@ -6,7 +6,9 @@
 '''
 
 from enum import Enum
-import array
+import numpy as np
+
+from . import stats_pyramid
 
 '''
   Qualifies the timestamp parameter (key) being supplied. The API knows
@@ -56,6 +58,91 @@ class LookupQualifier(Enum):
   NEAREST_SMALLER_WEAK = 4
   NEAREST_LARGER_WEAK = 5
 
+#############################################################################
+# Lookup helpers shared by all the timeseries classes in this module. Each
+# takes a sorted numpy array of timestamps (keys_arr) and returns indices into
+# it.
+#############################################################################
+def _search_timestamp_index(keys_arr, timestamp, lookup_qualifier):
+  '''
+  Returns the index into keys_arr selected by lookup_qualifier for the
+  supplied timestamp, or None if no such index exists.
+
+  np.searchsorted() gives us 2 insertion points for timestamp:
+    left:  index of the first key >= timestamp
+    right: index of the first key >  timestamp
+  Thus (left - 1) is the nearest key strictly smaller than timestamp and
+  right is the nearest key strictly larger than timestamp. When the
+  insertion point falls off either end of the array, the *_WEAK qualifiers
+  clamp to the boundary element while the others return None.
+  '''
+  num_keys = len(keys_arr)
+  if num_keys == 0:
+    return None
+
+  if lookup_qualifier == LookupQualifier.EXACT_MATCH:
+    idx = int(np.searchsorted(keys_arr, timestamp, side='left'))
+    if idx < num_keys and keys_arr[idx] == timestamp:
+      return idx
+    return None
+
+  if lookup_qualifier == LookupQualifier.NEAREST_SMALLER or \
+     lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK:
+    idx = int(np.searchsorted(keys_arr, timestamp, side='left')) - 1
+    if idx >= 0:
+      return idx
+    if lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK:
+      return 0
+    return None
+
+  if lookup_qualifier == LookupQualifier.NEAREST_LARGER or \
+     lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK:
+    idx = int(np.searchsorted(keys_arr, timestamp, side='right'))
+    if idx < num_keys:
+      return idx
+    if lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK:
+      return num_keys - 1
+    return None
+
+  assert(False)  # We should never reach here.
+
+def _search_timestamp_indices(keys_arr, timestamps, lookup_qualifier):
+  '''
+  Vectorized _search_timestamp_index(). Requires a non-empty keys_arr.
+
+  Returns a pair of arrays (idx_arr, miss_mask). Where miss_mask is True the
+  corresponding idx_arr entry is clamped to a valid index but is otherwise
+  meaningless.
+  '''
+  num_keys = len(keys_arr)
+  assert num_keys > 0
+
+  if lookup_qualifier == LookupQualifier.EXACT_MATCH:
+    idx_arr = np.searchsorted(keys_arr, timestamps, side='left')
+    idx_arr = np.minimum(idx_arr, num_keys - 1)
+    miss_mask = keys_arr[idx_arr] != timestamps
+    return idx_arr, miss_mask
+
+  if lookup_qualifier == LookupQualifier.NEAREST_SMALLER or \
+     lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK:
+    idx_arr = np.searchsorted(keys_arr, timestamps, side='left') - 1
+    miss_mask = idx_arr < 0
+    idx_arr = np.maximum(idx_arr, 0)
+    if lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK:
+      miss_mask = np.zeros(idx_arr.shape, dtype=bool)
+    return idx_arr, miss_mask
+
+  if lookup_qualifier == LookupQualifier.NEAREST_LARGER or \
+     lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK:
+    idx_arr = np.searchsorted(keys_arr, timestamps, side='right')
+    miss_mask = idx_arr >= num_keys
+    idx_arr = np.minimum(idx_arr, num_keys - 1)
+    if lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK:
+      miss_mask = np.zeros(idx_arr.shape, dtype=bool)
+    return idx_arr, miss_mask
+
+  assert(False)  # We should never reach here.
+
 '''
   Stores timeseries data returned from a query.
 
@@ -64,6 +151,10 @@ class LookupQualifier(Enum):
    "Usage Idioms" below on API usage. 
 
   API summary:
+    from_arrays(ts_id_obj, timestamps, values) / from_dps_payload(ts_id_obj, dps)
+      Alternate (faster) constructors from parallel timestamp/value sequences
+      or from the 'dps' section of a TSDB query response respectively.
+
     get_timeseries_id():
       Returns the timeseries id object idenfities the timeseries i.e the object
       that encapsulates the following pair: (metric_id, tag_value_pair_dict)
@@ -79,15 +170,45 @@ class LookupQualifier(Enum):
          with a better answer and/or document it clearly to avoid API user
          frustration.
 
+    window(timestamp1, lookup_qualifier1, timestamp2, lookup_qualifier2)
+      Returns a TimeseriesDataDict view of the datapoints between the 2
+      timestamps (both included). The view shares storage with the original
+      object and supports the full API (iteration, len(), lookups, window()).
+
     get_datapoint(timestamp, lookup_qualifier)
       Returns pair (timestamp, data_point) corresponding to the supplied
       timestamp depending upon lookup_qualifier. See documentation above
       LookupQualifier for details.
 
+    get_datapoints(timestamps, lookup_qualifier)
+      Vectorized get_datapoint(). Takes an array of timestamps and returns
+      parallel arrays (resolved_timestamps, values, miss_mask). Use this
+      instead of calling get_datapoint() in a loop.
+
+    downsample(bucket_width) / range_stats(timestamp1, timestamp2)
+      Return count/min/max/mean/first/last per time bucket and over a time
+      range respectively. Both are served from a lazily built multi-resolution
+      pyramid of bucket summaries (see stats_pyramid.py), so coarse questions
+      don't need to touch the datapoints.
+
+    cursor(reverse=False)
+      Returns an independent TimeseriesCursor for forward (or reverse)
+      iteration. Cursors support seeking to a timestamp and iterating in
+      chunks of numpy arrays. See TimeseriesCursor below.
+
+    shares_timestamp_axis(other)
+      Returns True if both objects are backed by the same timestamp array.
+      See share_timestamp_axes() and align() at the bottom of this file.
+
     get_min_key() / get_max_key():
       Returns the smallest / largest key value that can be used with
       get_datapoint().
 
+    get_timestamps() / get_values():
+      Returns the underlying (read-only) numpy arrays of timestamps (int64) and
+      values (float64). Both are in time order and of equal length. Use these
+      when operating on the whole timeseries with vectorized numpy/pandas code.
+
     is_empty()
       Returns True if timeseries is empty, False otherwise.
 
@@ -100,6 +221,15 @@ class LookupQualifier(Enum):
          ... process timestamp and value ..
 
        This works because TimeseriesDataDict supports the iterator protocol.
+       Every for loop gets its own cursor, so nested loops (or multiple
+       threads) can iterate over the same object at the same time.
+
+       1b) In reverse order, or in chunks of numpy arrays:
+       for timestamp, value in ts_obj.cursor(reverse=True):
+         ... process timestamp and value ..
+
+       for timestamps_arr, values_arr in ts_obj.cursor().iter_chunks(4096):
+         ... process a block of upto 4096 datapoints ..
 
     2. Searching and retrieving a datapoint for an arbitrary timestamp:
        ---------------------------------------------------------------
@@ -142,6 +272,14 @@ class LookupQualifier(Enum):
         walks through keys from 0 to idx1, thus slightly reducing efficiency.
         Thus it becomes a function of O(idx2) instead of O(idx2 - idx1).
 
+        Preferred alternative, which is O(idx2 - idx1) and needs no index
+        arithmetic:
+
+        win_obj = ts_obj.window(timestamp1, NEAREST_SMALLER_WEAK,
+                                timestamp2, NEAREST_LARGER_WEAK)
+        for timestamp, value in win_obj:
+          ...process timestamp and value ...
+
 '''
 class TimeseriesDataDict(object):
   '''
@@ -153,22 +291,134 @@ class TimeseriesDataDict(object):
   '''
   def __init__(self, ts_id_obj, datapoints_dict):
     self.__ts_id_obj = ts_id_obj   # TimeseriesID
-    self.__ts_dps_dict = {}        # Dictionary of data points time->value
-
-    # The key/value from datapoints_dict get stored in self.__ts_dps_dict.
-    # In addition we also store the timestamps (i.e the dictionary keys)
-    # into __ts_keys_arr in sorted order. This duplication of keys is ok,
-    # a TimeseriesDataDict object is immutable.
-    # Benefit of this scheme is:
-    #   - when key is known to exist O(1) lookup from dict
-    #   - when key is not known O(logN) lookup from sorted array and then
-    #     O(1) lookup from dict.
-    # We use LookupQualifier to hint us for lookups.
-    for ts, dp in datapoints_dict.items():
-      self.__ts_dps_dict[int(ts)] = dp
-    self.__ts_keys_arr = array.array('Q', sorted(self.__ts_dps_dict.keys()))
-
-    self.__iter_idx = 0  # To support the iterator protocol.
+
+    # Data points are stored in columnar form i.e. as 2 parallel numpy arrays:
+    #   __ts_keys_arr:  int64 timestamps, in sorted order.
+    #   __ts_values_arr: float64 values, __ts_values_arr[i] is the value at
+    #                    timestamp __ts_keys_arr[i].
+    # This costs 16 bytes per data point, compared to the 100+ bytes per data
+    # point needed to keep a dictionary of Python objects around. Since a
+    # TimeseriesDataDict object is immutable, both arrays are marked read-only.
+    #
+    # Lookups are O(logN) binary searches (np.searchsorted) over the sorted
+    # timestamp array. We use LookupQualifier to hint us for lookups.
+    num_dps = len(datapoints_dict)
+    keys_arr = np.fromiter(map(int, datapoints_dict.keys()),
+                           dtype=np.int64, count=num_dps)
+    values_arr = np.fromiter(datapoints_dict.values(),
+                             dtype=np.float64, count=num_dps)
+    self.__init_columns(*TimeseriesDataDict.__sort_columns(keys_arr,
+                                                           values_arr))
+
+  @classmethod
+  def from_arrays(cls, ts_id_obj, timestamps, values, copy=True):
+    '''Builds a TimeseriesDataDict from a pair of parallel sequences (lists,
+       numpy arrays etc.) of timestamps and values. This avoids building an
+       intermediate dictionary. Sorting is skipped if timestamps are already
+       in time order.
+
+       With copy=False, numpy arrays that already are int64 (timestamps) and
+       float64 (values) are taken over as is instead of being copied. The
+       caller must not use them afterwards.'''
+    if copy:
+      keys_arr = np.array(timestamps, dtype=np.int64)
+      values_arr = np.array(values, dtype=np.float64)
+    else:
+      keys_arr = np.asarray(timestamps, dtype=np.int64)
+      values_arr = np.asarray(values, dtype=np.float64)
+    assert keys_arr.shape == values_arr.shape and keys_arr.ndim == 1
+    return cls.__from_sorted_columns(
+        ts_id_obj, *TimeseriesDataDict.__sort_columns(keys_arr, values_arr))
+
+  @classmethod
+  def from_dps_payload(cls, ts_id_obj, dps):
+    '''Builds a TimeseriesDataDict from the 'dps' section of an OpenTSDB
+       query response. Both response formats are accepted:
+         - the default dictionary: {"1234510": 10, "1234520": 20, ...}
+         - the list of pairs returned with arrays=true:
+           [[1234510, 10], [1234520, 20], ...]
+       OpenTSDB returns data points in time order, so the common case is a
+       single vectorized pass over the payload without any sorting. null
+       values become NaN.'''
+    num_dps = len(dps)
+    if isinstance(dps, dict):
+      keys_iter, values_iter = map(int, dps.keys()), dps.values()
+    else:
+      keys_iter = (int(dp[0]) for dp in dps)
+      values_iter = (dp[1] for dp in dps)
+    keys_arr = np.fromiter(keys_iter, dtype=np.int64, count=num_dps)
+    try:
+      values_arr = np.fromiter(values_iter, dtype=np.float64, count=num_dps)
+    except TypeError:
+      # null values (downsampled with FillPolicy.NULL). np.array() turns them
+      # into NaN, np.fromiter() doesn't.
+      if isinstance(dps, dict):
+        values_arr = np.array(list(dps.values()), dtype=np.float64)
+      else:
+        values_arr = np.array([dp[1] for dp in dps], dtype=np.float64)
+    return cls.__from_sorted_columns(
+        ts_id_obj, *TimeseriesDataDict.__sort_columns(keys_arr, values_arr))
+
+  def _with_timestamp_axis(self, keys_arr):
+    # Returns an equivalent object that uses keys_arr as its timestamp array.
+    # keys_arr must hold exactly the same timestamps. Meant for use by
+    # share_timestamp_axes() only.
+    if keys_arr is self.__ts_keys_arr:
+      return self
+    assert np.array_equal(keys_arr, self.__ts_keys_arr)
+    return TimeseriesDataDict.__from_sorted_columns(
+        self.__ts_id_obj, keys_arr, self.__ts_values_arr)
+
+  @classmethod
+  def _from_frozen_columns(cls, ts_id_obj, keys_arr, values_arr):
+    # Builds an object around the supplied arrays without copying them. The
+    # arrays must be sorted, free of duplicates, read-only and must never be
+    # modified through any other reference. Meant for use by
+    # RingBufferTimeseries.snapshot() and the SegmentStore only.
+    assert not keys_arr.flags.writeable and not values_arr.flags.writeable
+    return cls.__from_sorted_columns(ts_id_obj, keys_arr, values_arr)
+
+  @staticmethod
+  def __sort_columns(keys_arr, values_arr):
+    # Returns the pair of arrays sorted by time (and free of duplicate
+    # timestamps), marked read-only. The supplied arrays must not be shared
+    # with anyone else as they may get reused.
+    #
+    # Most callers (e.g. a TSDB query response) already supply data points in
+    # time order, so we only pay for sorting when we have to.
+    if len(keys_arr) > 1 and np.any(keys_arr[1:] <= keys_arr[:-1]):
+      order = np.argsort(keys_arr, kind='stable')
+      keys_arr = keys_arr[order]
+      values_arr = values_arr[order]
+
+      # Keys such as "12345" and 12345 collapse into the same timestamp. As
+      # with a dictionary, the last one supplied wins.
+      is_last_of_run = np.append(keys_arr[1:] != keys_arr[:-1], True)
+      keys_arr = keys_arr[is_last_of_run]
+      values_arr = values_arr[is_last_of_run]
+
+    keys_arr.flags.writeable = False
+    values_arr.flags.writeable = False
+    return keys_arr, values_arr
+
+  def __init_columns(self, keys_arr, values_arr):
+    # Every TimeseriesDataDict object, whether built by __init__() or around
+    # existing arrays (see __from_sorted_columns()), ends up here.
+    self.__ts_keys_arr = keys_arr
+    self.__ts_values_arr = values_arr
+
+    # Built on first use of downsample() / range_stats().
+    self.__stats_pyramid = None
+
+  @classmethod
+  def __from_sorted_columns(cls, ts_id_obj, keys_arr, values_arr):
+    # Builds an object directly around already sorted, read-only arrays. No
+    # data is copied, so the new object shares storage with whoever else
+    # references those arrays.
+    tsdd_obj = cls.__new__(cls)
+    tsdd_obj.__ts_id_obj = ts_id_obj
+    tsdd_obj.__init_columns(keys_arr, values_arr)
+    return tsdd_obj
 
   def get_timeseries_id(self):
     '''Returns the timeseries id object idenfities the timeseries i.e the
@@ -183,162 +433,298 @@ class TimeseriesDataDict(object):
     key2 = self.__search_timestamp_index(timestamp2, lookup_qualifier2)
     return (key1, key2)
 
+  def window(self, timestamp1, lookup_qualifier1,
+                   timestamp2, lookup_qualifier2):
+    '''Returns a TimeseriesDataDict that is a view of the datapoints from
+       timestamp1 through timestamp2 (both included), each resolved as per its
+       lookup qualifier. See usage example #3 at the top of the class.
+
+       The view shares storage with this object, so creating it costs O(logN)
+       irrespective of the window size. Views of views work the same way.
+       If either timestamp does not resolve, the view is empty.'''
+    idx1, idx2 = self.get_iter_slice(timestamp1, lookup_qualifier1,
+                                     timestamp2, lookup_qualifier2)
+    if idx1 == None or idx2 == None or idx1 > idx2:
+      idx1, idx2 = 0, -1   # yields an empty slice
+    return TimeseriesDataDict.__from_sorted_columns(
+        self.__ts_id_obj,
+        self.__ts_keys_arr[idx1:idx2 + 1],
+        self.__ts_values_arr[idx1:idx2 + 1])
+
   def get_datapoint(self, timestamp, lookup_qualifier):
     ''' Returns pair (timestamp, data_point) corresponding to the supplied
         timestamp depending upon lookup_qualifier. See documentation above
         LookupQualifier for details.'''
-    # If qualifer is requesting EXACT_MATCH, we go directly to the dictionary.
-    # If the timestamp is found there, we're done !
+    # For EXACT_MATCH the supplied timestamp is returned as is, so there's
+    # nothing to fetch besides the value.
     value = None
     if lookup_qualifier == LookupQualifier.EXACT_MATCH:
-      value = self.__ts_dps_dict.get(int(timestamp), None)
+      ts_idx = self.__search_timestamp_index(int(timestamp), lookup_qualifier)
+      if ts_idx != None:
+        value = float(self.__ts_values_arr[ts_idx])
       return timestamp, value
 
     ts_idx = self.__search_timestamp_index(timestamp, lookup_qualifier)
     if ts_idx != None:
-      timestamp = self.__ts_keys_arr[ts_idx]
-      value = self.__ts_dps_dict[timestamp]
+      timestamp = int(self.__ts_keys_arr[ts_idx])
+      value = float(self.__ts_values_arr[ts_idx])
     return timestamp, value
 
+  def get_datapoints(self, timestamps, lookup_qualifier):
+    ''' Vectorized form of get_datapoint(). Resolves an array of timestamps
+        in one pass over the timeseries.
+
+        Returns a tuple of 3 parallel numpy arrays:
+          (resolved_timestamps, values, miss_mask)
+        where miss_mask[i] is True if nothing was found for timestamps[i]. For
+        a miss, resolved_timestamps[i] is timestamps[i] (as with
+        get_datapoint()) and values[i] is NaN.'''
+    timestamps = np.asarray(timestamps)
+    if len(self.__ts_keys_arr) == 0:
+      return timestamps.copy(), \
+             np.full(timestamps.shape, np.nan), \
+             np.ones(timestamps.shape, dtype=bool)
+
+    idx_arr, miss_mask = self.__search_timestamp_indices(timestamps,
+                                                          lookup_qualifier)
+    resolved_timestamps = np.where(miss_mask, timestamps,
+                                   self.__ts_keys_arr[idx_arr])
+    values = np.where(miss_mask, np.nan, self.__ts_values_arr[idx_arr])
+    return resolved_timestamps, values, miss_mask
+
+  def downsample(self, bucket_width):
+    '''Summarizes the timeseries into time buckets of bucket_width (in the
+       units of the timestamps). Returns a dictionary of column name -> numpy
+       array with 1 entry per non-empty bucket. Columns are 'timestamp'
+       (bucket start), 'count', 'min', 'max', 'mean', 'first' and 'last'.
+       Power of two bucket widths are served from a lazily built pyramid.'''
+    if self.is_empty():
+      return {name: np.empty(0) for name in
+              ['timestamp'] + stats_pyramid.STAT_NAMES}
+    return self.__get_stats_pyramid().downsample(bucket_width)
+
+  def range_stats(self, timestamp1, timestamp2):
+    '''Returns a dictionary with the 'count', 'min', 'max', 'mean', 'first'
+       and 'last' of the datapoints from timestamp1 through timestamp2 (both
+       included), or None if there are none. Answered mostly from a lazily
+       built pyramid of bucket summaries, without walking the datapoints.'''
+    if self.is_empty():
+      return None
+    return self.__get_stats_pyramid().range_stats(timestamp1, timestamp2)
+
+  def cursor(self, reverse=False):
+    '''Returns a new TimeseriesCursor positioned at the first (or, if
+       reverse is True, the last) datapoint. Cursors are independent of each
+       other and of this object. See TimeseriesCursor for details.'''
+    return TimeseriesCursor(self.__ts_keys_arr, self.__ts_values_arr, reverse)
+
   def get_min_key(self):
-    return self.__ts_keys_arr[0]
+    return int(self.__ts_keys_arr[0])
 
   def get_max_key(self):
-    return self.__ts_keys_arr[len(self.__ts_keys_arr) - 1]
+    return int(self.__ts_keys_arr[len(self.__ts_keys_arr) - 1])
+
+  def get_timestamps(self):
+    '''Returns the (read-only) int64 numpy array of timestamps in sorted
+       order. Useful for vectorized processing of the timeseries.'''
+    return self.__ts_keys_arr
+
+  def get_values(self):
+    '''Returns the (read-only) float64 numpy array of values. The i-th value
+       corresponds to the i-th timestamp returned by get_timestamps().'''
+    return self.__ts_values_arr
+
+  def shares_timestamp_axis(self, other):
+    '''Returns True if this object and other are backed by the very same
+       timestamp array (see share_timestamp_axes() below). This is an O(1)
+       check, and when True the values of both objects are aligned
+       index-by-index.'''
+    other_keys_arr = other.get_timestamps()
+    return len(self.__ts_keys_arr) == len(other_keys_arr) and \
+           (self.__ts_keys_arr is other_keys_arr or \
+            (self.__ts_keys_arr.ctypes.data == other_keys_arr.ctypes.data and \
+             self.__ts_keys_arr.strides == other_keys_arr.strides))
 
   def is_empty(self):
-    return len(self.__ts_dps_dict) == 0
+    return len(self.__ts_keys_arr) == 0
 
   #############################################################################
   # Non-public methods BUT supporting a public interface start here e.g.
   # iteration, len() etc. start here.
   #############################################################################
   def __iter__(self):
-    self.__iter_idx = 0;
-    return self
-
-  def __next__(self):
-    prev_idx = self.__iter_idx  # save previous index.
-    self.__iter_idx = self.__iter_idx + 1
-    if self.__iter_idx > len(self.__ts_keys_arr):
-      raise StopIteration
-    key = self.__ts_keys_arr[prev_idx]
-    value = self.__ts_dps_dict[key]
-    return key, value
+    # Each iteration gets its own cursor, so nested loops (or threads) over the
+    # same object don't trip over each other.
+    return self.cursor()
 
   def __len__(self):
-    assert len(self.__ts_keys_arr) == len(self.__ts_dps_dict)
+    assert len(self.__ts_keys_arr) == len(self.__ts_values_arr)
     return len(self.__ts_keys_arr)
 
   #############################################################################
   # Pure private helper methods start here.
   #############################################################################
+  def __get_stats_pyramid(self):
+    if self.__stats_pyramid == None:
+      self.__stats_pyramid = stats_pyramid.StatsPyramid(self.__ts_keys_arr,
+                                                        self.__ts_values_arr)
+    return self.__stats_pyramid
+
   def __search_timestamp_index(self, timestamp, lookup_qualifier):
-    # Initialize housekeeping vars for doing binary search in self.__ts_keys_arr
-    low = 0
-    high = len(self.__ts_keys_arr) - 1
-    mid = 0
-    key_match_found = False
-
-    # Now we do a binary search.
-    while low <= high:
-      mid = int((high + low)/2)
-      if timestamp > self.__ts_keys_arr[mid]:    # If timestamp is larger than
-        low = mid + 1                            # middle value, ignore left
-      elif timestamp < self.__ts_keys_arr[mid]:  # half. Othewise ignore right
-        high = mid - 1                           # half.
-      else:
-        key_match_found = True
-        break # we've found an exact match for supplied timestamp.
-
-    # Lets handle the cases when match was found.
-    if key_match_found:
-      if lookup_qualifier == LookupQualifier.EXACT_MATCH:
-        return mid
-
-      # Lets now delicately handle the 2 cases where mid is a boundary elem
-      # AND the qualifier is going to push the 'result to be returned' outside
-      # the bounds.
-      if mid == 0:  # mid at lower boundary
-        if lookup_qualifier == LookupQualifier.NEAREST_SMALLER:
-          return None
-        if lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK:
-          return mid
-      if mid == len(self.__ts_keys_arr) - 1:  # mid at upper boundary
-        if lookup_qualifier == LookupQualifier.NEAREST_LARGER:
-          return None
-        if lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK:
-          return mid
-
-      # Now that boundary condition for mid is handled lets trivially handle
-      # the remaining non-boundary mid and qualifier cases.
-      if lookup_qualifier == LookupQualifier.NEAREST_SMALLER or \
-         lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK:
-        return mid - 1
-      if lookup_qualifier == LookupQualifier.NEAREST_LARGER or \
-         lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK:
-        return mid + 1
+    return _search_timestamp_index(self.__ts_keys_arr, timestamp,
+                                   lookup_qualifier)
+
+  def __search_timestamp_indices(self, timestamps, lookup_qualifier):
+    return _search_timestamp_indices(self.__ts_keys_arr, timestamps,
+                                     lookup_qualifier)
+
+
+
+#############################################################################
+# Multi-timeseries helpers.
+#############################################################################
+def share_timestamp_axes(tsdd_list):
+  '''
+  Timeseries collected by the same collector (e.g. sensors on one machine)
+  usually have identical timestamps. This returns a list equivalent to
+  tsdd_list in which all objects with identical timestamps are backed by one
+  shared (read-only) timestamp array. That saves memory and makes
+  shares_timestamp_axis() / align() trivial for such objects.
+  '''
+  axes_by_signature = {}
+  return [_share_timestamp_axis(tsdd_obj, axes_by_signature) \
+          for tsdd_obj in tsdd_list]
+
+def clip(tsdd_list, start, end):
+  '''
+  Returns the list of the windows [start, end] (both included) of the
+  objects in tsdd_list, leaving out empty ones. As with window(), the
+  returned objects share storage with those in tsdd_list.
+  '''
+  # NEAREST_LARGER/SMALLER are strict, hence the +/- 1.
+  w_list = [tsdd_obj.window(start - 1, LookupQualifier.NEAREST_LARGER,
+                            end + 1, LookupQualifier.NEAREST_SMALLER)
+            for tsdd_obj in tsdd_list]
+  return [w_obj for w_obj in w_list if len(w_obj) > 0]
+
+def _share_timestamp_axis(tsdd_obj, axes_by_signature):
+  # Returns tsdd_obj backed by the matching timestamp array of those seen so
+  # far (or as is, if no match). axes_by_signature maps (len, first key,
+  # last key) -> list of distinct timestamp arrays with that signature. The
+  # signature weeds out most mismatches without comparing whole arrays.
+  keys_arr = tsdd_obj.get_timestamps()
+  if len(keys_arr) == 0:
+    return tsdd_obj
+  signature = (len(keys_arr), int(keys_arr[0]), int(keys_arr[-1]))
+  known_axes = axes_by_signature.setdefault(signature, [])
+  for axis_arr in known_axes:
+    if axis_arr is keys_arr or np.array_equal(axis_arr, keys_arr):
+      return tsdd_obj._with_timestamp_axis(axis_arr)
+  known_axes.append(keys_arr)
+  return tsdd_obj
+
+def align(tsdd_list):
+  '''
+  Aligns multiple timeseries on a common set of timestamps. Returns a pair
+  (timestamps_arr, values_matrix) where values_matrix[i][j] is the value of
+  tsdd_list[i] at timestamps_arr[j], or NaN if that timeseries has no
+  datapoint at that timestamp.
+
+  If all the timeseries share one timestamp axis (see share_timestamp_axes())
+  there's nothing to align and the values are simply stacked.
+  '''
+  if len(tsdd_list) == 0:
+    return np.empty(0, dtype=np.int64), np.empty((0, 0))
+
+  first_tsdd = tsdd_list[0]
+  if all(first_tsdd.shares_timestamp_axis(tsdd_obj) \
+         for tsdd_obj in tsdd_list[1:]):
+    return first_tsdd.get_timestamps(), \
+           np.vstack([tsdd_obj.get_values() for tsdd_obj in tsdd_list])
+
+  timestamps_arr = first_tsdd.get_timestamps()
+  for tsdd_obj in tsdd_list[1:]:
+    timestamps_arr = np.union1d(timestamps_arr, tsdd_obj.get_timestamps())
+  values_matrix = np.full((len(tsdd_list), len(timestamps_arr)), np.nan)
+  for row, tsdd_obj in enumerate(tsdd_list):
+    col_idx_arr = np.searchsorted(timestamps_arr, tsdd_obj.get_timestamps())
+    values_matrix[row, col_idx_arr] = tsdd_obj.get_values()
+  return timestamps_arr, values_matrix
+
+'''
+  An iterator over the datapoints of a timeseries.
+
+  A cursor holds its own position, so any number of cursors can walk the same
+  timeseries independently. The underlying arrays are shared (and read-only),
+  so creating a cursor copies no data.
+
+  A forward cursor moves from older to newer datapoints and a reverse cursor
+  the other way round. Iterating a cursor yields (timestamp, value) pairs and
+  consumes it.
+
+  API summary:
+    seek(timestamp, lookup_qualifier)
+      Moves the cursor such that the next datapoint returned is the one that
+      get_datapoint(timestamp, lookup_qualifier) would return. Returns False
+      (and exhausts the cursor) if no such datapoint exists, True otherwise.
+
+    iter_chunks(chunk_size)
+      Generator yielding pairs (timestamps_arr, values_arr) of upto chunk_size
+      datapoints each, starting at the current position. The arrays are
+      read-only views, not copies. For a reverse cursor they are in reverse
+      time order.
+
+    is_exhausted()
+      Returns True if there are no more datapoints to be returned.
+'''
+class TimeseriesCursor(object):
+  def __init__(self, keys_arr, values_arr, reverse=False):
+    self.__ts_keys_arr = keys_arr
+    self.__ts_values_arr = values_arr
+    self.__reverse = reverse
+
+    # Index of the datapoint to be returned next. A forward cursor is
+    # exhausted at len(keys_arr), a reverse cursor at -1.
+    if reverse:
+      self.__idx = len(keys_arr) - 1
     else:
-      # If match was not found, the only lookup qualifier we need to tackle here
-      # is EXACT_MATCH. Other cases are handled by the fallthrough code below.
-      if lookup_qualifier == LookupQualifier.EXACT_MATCH:
-        return None
-
-    assert lookup_qualifier != LookupQualifier.EXACT_MATCH
-    # We've completely handled EXACT_MATCH above this point. Below this point
-    # we're going to *onl* handle other lookup qualifiers.
-
-    '''
-    Post binary search we have 3 cases based on value of low & high w.r.t
-    array bounds.
-
-    case 1:
-    Supplied timestamp is smaller than the smallest value in __ts_keys_arr.
-    It causes index high to fall off the bottom of the array lower bound.
-                          0     1  ...                                max
-                        -------------------------------------------------
-     (timestamp)       | TSi | TSj | ....                          | TSm |
-                        -------------------------------------------------
-                  high   low
-                (= -1)   mid
-    case 2:
-    Supplied timestamp is higher than the highest value in __ts_keys_arr.
-    It causes index low to fall off the array upper bound cliff.
-           0     1  ...                                max
-          -------------------------------------------------
-         | TSi | TSj | ....                          | TSm |    (timestamp)
-          -------------------------------------------------
-                                                      high   low
-                                                      mid   (= len)
-    case 3:
-    __ts_keys_arr[0] <= supplied timestamp <= __ts_keys_arr[len - 1]
-    This keeps low and high within array bounds and low >= high.
-    '''
-    if high < 0:  # Case 1
-      assert(timestamp < self.__ts_keys_arr[0])
-      if lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK or \
-         lookup_qualifier == LookupQualifier.NEAREST_LARGER or \
-         lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK:
-        return low   # since low > high
-      elif lookup_qualifier == LookupQualifier.NEAREST_SMALLER:
-        return None
-
-    if low == len(self.__ts_keys_arr):  # Case 2
-      assert(timestamp > self.__ts_keys_arr[low - 1])
-      if lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK or \
-         lookup_qualifier == LookupQualifier.NEAREST_SMALLER or \
-         lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK:
-        return high   # since high < low
-      elif lookup_qualifier == LookupQualifier.NEAREST_LARGER :
-        return None
-
-    # Case 3: both high and low are within bounds
-    if lookup_qualifier == LookupQualifier.NEAREST_LARGER_WEAK or \
-       lookup_qualifier == LookupQualifier.NEAREST_LARGER:
-      return low
-    if lookup_qualifier == LookupQualifier.NEAREST_SMALLER_WEAK or \
-       lookup_qualifier == LookupQualifier.NEAREST_SMALLER:
-      return high
-
-    assert(False)  # We should never reach here.
+      self.__idx = 0
+
+  def seek(self, timestamp, lookup_qualifier):
+    idx = _search_timestamp_index(self.__ts_keys_arr, timestamp,
+                                  lookup_qualifier)
+    if idx == None:
+      self.__idx = -1 if self.__reverse else len(self.__ts_keys_arr)
+      return False
+    self.__idx = idx
+    return True
+
+  def iter_chunks(self, chunk_size):
+    assert chunk_size > 0
+    while not self.is_exhausted():
+      if self.__reverse:
+        start_idx = max(self.__idx - chunk_size + 1, 0)
+        end_idx = self.__idx + 1
+        self.__idx = start_idx - 1
+        yield self.__ts_keys_arr[start_idx:end_idx][::-1], \
+              self.__ts_values_arr[start_idx:end_idx][::-1]
+      else:
+        start_idx = self.__idx
+        end_idx = min(self.__idx + chunk_size, len(self.__ts_keys_arr))
+        self.__idx = end_idx
+        yield self.__ts_keys_arr[start_idx:end_idx], \
+              self.__ts_values_arr[start_idx:end_idx]
+
+  def is_exhausted(self):
+    return self.__idx < 0 or self.__idx >= len(self.__ts_keys_arr)
 
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self.is_exhausted():
+      raise StopIteration
+    cur_idx = self.__idx
+    self.__idx = cur_idx - 1 if self.__reverse else cur_idx + 1
+    return int(self.__ts_keys_arr[cur_idx]), \
+           float(self.__ts_values_arr[cur_idx])
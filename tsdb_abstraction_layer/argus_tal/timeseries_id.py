@@ -52,3 +52,26 @@ class TimeseriesID(object):
   def fqid(self):
     '''Returns a SHA256 hash of the string-ified version of this object.'''
     return hash(self)
+
+  def selects(self, other):
+    '''Returns True if the timeseries other (e.g. from a query response) is
+       one of those a query for this id returns i.e. same metric and other
+       has all of our tags. A filter value may be a "v1|v2|..." list.'''
+    if self.__metric_id != other.metric_id:
+      return False
+    for tag, value in self.__tag_value_pairs.items():
+      if other.filters.get(tag) not in value.split('|'):
+        return False
+    return True
+
+  def selects_aggregate(self, other):
+    '''Returns True if the timeseries other may be what a query for this id
+       returns with an aggregator (other than NONE) i.e. same metric and
+       none of our tags with another value. The aggregate only keeps the
+       tags common to the timeseries aggregated.'''
+    if self.__metric_id != other.metric_id:
+      return False
+    for tag, value in self.__tag_value_pairs.items():
+      if tag in other.filters and other.filters[tag] not in value.split('|'):
+        return False
+    return True
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+'''
+  timeseries_pattern.py
+
+  A python module that defines the TimeseriesPattern class: the query side
+  counterpart of TimeseriesID. Where a TimeseriesID refers to 1 timeseries, a
+  pattern may select many, as its tag values can be:
+    "*"             Any value (i.e. all the timeseries that have the tag).
+    "extruder_*"    Values matching a wildcard ('*' matches any characters).
+    "m1|m2|m3"      Any of the listed values (literal_or).
+    "m1"            That value only, as in a TimeseriesID.
+
+  QueryApi accepts patterns wherever it accepts TimeseriesIDs. A pattern is
+  queried in 1 request and the response is fanned out into 1
+  TimeseriesDataDict per concrete tag combination, each with its own (proper)
+  TimeseriesID. So querying a metric across 40 machines costs 1 request
+  instead of 40. With an aggregator other than NONE, the pattern's tags group
+  by i.e. there's 1 aggregated timeseries per combination of their values.
+
+  Mutability: This class is immutable.
+
+Example usage:
+    pattern = TimeseriesPattern("machine.sensor.melt_temperature",
+                                {"machine_name": "extruder_*"})
+    q_api_obj = QueryApi("10.121.32.1", 4242, start_ts_obj, end_ts_obj,
+                         [pattern], Aggregator.NONE)
+    q_api_obj.populate_ts_data()
+    for tsid, tsdd_obj in q_api_obj.get_result_map_for(pattern).items():
+      ... tsid.filters["machine_name"] is e.g. "extruder_12" ...
+'''
+
+from . import exceptions as excp
+import re
+
+class TimeseriesPattern(object):
+  def __init__(self, metric_id, tag_filters):
+    value_regexes = {}
+    for tag, value in tag_filters.items():
+      alternatives = value.split('|')
+      # OpenTSDB takes a value as either a wildcard or a literal_or list.
+      if '' in alternatives or (len(alternatives) > 1 and '*' in value):
+        raise excp.InvalidTimeseriesPattern( \
+            "metric: %s, tag: %s, value: %s" % (metric_id, tag, value))
+      value_regexes[tag] = re.compile('|'.join(
+          re.escape(alt).replace(r'\*', '.*') for alt in alternatives))
+
+    self.__metric_id = metric_id
+    self.__tag_filters = dict(tag_filters)
+    self.__value_regexes = value_regexes
+
+  def __eq__(self, other):
+    if isinstance(other, TimeseriesPattern):
+        return self.fqid == other.fqid
+    return False
+
+  def __str__(self):
+    return "%s%s" % (self.metric_id, self.filters)
+
+  def __hash__(self):
+    # Differs from the hash of a TimeseriesID with the same tags.
+    return hash((type(self).__name__, self.__metric_id,
+                 frozenset(self.__tag_filters.items())))
+
+  @property
+  def metric_id(self):
+    return self.__metric_id
+
+  @property
+  def filters(self):
+    return self.__tag_filters
+
+  @property
+  def fqid(self):
+    return hash(self)
+
+  def filter_type(self, tag):
+    '''Returns the OpenTSDB filter type of the value of tag.'''
+    return "wildcard" if '*' in self.__tag_filters[tag] else "literal_or"
+
+  def selects(self, other):
+    '''Returns True if the timeseries other (e.g. from a query response) is
+       one of those a query for this pattern returns i.e. same metric and
+       other has all of our tags, with matching values.'''
+    if self.__metric_id != other.metric_id:
+      return False
+    for tag, value_regex in self.__value_regexes.items():
+      value = other.filters.get(tag)
+      if value == None or value_regex.fullmatch(value) == None:
+        return False
+    return True
+
+  def selects_aggregate(self, other):
+    '''Same as selects(), for a query with an aggregator (other than NONE):
+       the tags of a pattern group by, so each aggregate keeps them.'''
+    return self.selects(other)
@@ -40,3 +40,23 @@ class Timestamp(object):
   @property
   def value(self):
     return self.__timestamp
+
+# OpenTSDB takes a timestamp with more than 10 digits to be in msecs, and one
+# with at most 10 digits to be in secs. ms=true only sets the unit of the
+# timestamps of the response.
+MAX_SECS_TIMESTAMP = 9999999999
+
+def bounds_in_unit(start, end, flag_millisecond):
+  '''
+  Returns the time range [start, end] (ints, each in secs or msecs, see
+  above) in the unit of the timestamps of the response to its query: msecs
+  if flag_millisecond (ms=true) is set, else secs. An msec bound converted to
+  secs is rounded inwards.
+  '''
+  def in_unit(value, flag_round_up):
+    if flag_millisecond == (value > MAX_SECS_TIMESTAMP):
+      return value
+    if flag_millisecond:
+      return value * 1000
+    return -(-value // 1000) if flag_round_up else value // 1000
+  return in_unit(start, True), in_unit(end, False)
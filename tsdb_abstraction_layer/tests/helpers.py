@@ -6,7 +6,21 @@ from .context import argus_tal
 from argus_tal import query_api as qq
 from argus_tal import timestamp as ts
 from argus_tal import basic_types as bt
+from argus_tal import timeseries_id as ts_id
+import json
 import random
+import re
+from unittest import mock
+from urllib import parse
+
+def mock_response(json_data, status_code=200):
+  '''Returns a mocked requests.Response whose (uncompressed) body is
+     json_data, as JSON.'''
+  response = mock.Mock(status_code=status_code)
+  response.json.return_value = json_data
+  response.content = json.dumps(json_data).encode()
+  response.raw.tell.return_value = len(response.content)
+  return response
 
 def get_dummy_query_params():
   return "172.1.1.1", 4242, "some_metric", {"filter1":"value1"}, \
@@ -45,6 +59,12 @@ def get_url_for_query_params_with_maxsize_64bits():
          "start=9223372036854775800&end=9223372036854775807&ms=true" \
          "&m=none:some_metric{filter1=value1}" \
 
+def get_url_for_multi_metric_query_params():
+  return "http://172.1.1.1:4242/api/query?start=1234510&end=1234570" \
+      "&m=none:some_metric{filter1=value1}" \
+      "&m=none:other_metric{filter1=value1}" \
+      "&m=none:sparse_metric{filter1=value1}" \
+
 def get_truncated_json_response():
   # Problems:
   #  1) Typo with aggregateTags
@@ -83,6 +103,14 @@ def get_good_json_response():
             } \
         }]
 
+def get_multi_metric_json_response():
+  # some_metric and other_metric share timestamps, sparse_metric does not.
+  response = get_good_json_response()
+  response.append(dict(response[0], metric="other_metric"))
+  response.append(dict(response[0], metric="sparse_metric", \
+                       dps={"1234510": 1, "1234570": 7}))
+  return response
+
 def get_good_json_response_for_rate():
   # The rate math below is just slope of 2 points (ts1, val1) and (ts2, val2).
   # Rate = (val2 - val1) / (ts2 - ts1)
@@ -245,3 +273,90 @@ def get_arbit_key_and_value():
   return (key_list[arb_k_idx-1], sorted_test_data[key_list[arb_k_idx-1]]), \
          (key_list[arb_k_idx], sorted_test_data[key_list[arb_k_idx]]), \
          (key_list[arb_k_idx+1], sorted_test_data[key_list[arb_k_idx+1]])
+
+def get_fake_tsdb_json_response(url, step):
+  # Emulates the TSDB for any query URL: each metric queried has a datapoint
+  # every 'step' secs (see get_fake_tsdb_keys()) with value equal to its
+  # timestamp. Metrics named "empty_*" have no data at all.
+  query = parse.parse_qs(parse.urlparse(url).query)
+  keys = get_fake_tsdb_keys(int(query['start'][0]), int(query['end'][0]), \
+                            step, query.get('ms') == ['true'])
+  response = []
+  for m_param in query['m']:
+    metric, tags = re.match(r"none:(?:rate:)?([^{]+)\{(.*)\}", \
+                            m_param).groups()
+    if metric.startswith("empty_"):
+      continue
+    response.append({ \
+      "aggregateTags": [], \
+      "dps": {str(tt): tt for tt in keys}, \
+      "metric": metric, \
+      "tags": dict(pair.split("=") for pair in tags.split(",")), \
+    })
+  return response
+
+def get_fake_tsdb_keys(start, end, step, flag_ms=False):
+  # Timestamps of the datapoints of get_fake_tsdb_json_response() within
+  # [start, end]: at multiples of step secs, or with flag_ms (ms=true) half a
+  # sec past those, in msecs. As with OpenTSDB, start and end are in msecs if
+  # they have more than 10 digits, else in secs (whatever flag_ms).
+  if not flag_ms:
+    return range(-(-start // step) * step, end + 1, step)
+  start, end = [tt if tt > ts.MAX_SECS_TIMESTAMP else tt * 1000 \
+                for tt in (start, end)]
+  step *= 1000
+  return range(-(-(start - 500) // step) * step + 500, end + 1, step)
+
+class FakeTsdb(object):
+  '''
+    Runs QueryApi queries (of the dummy query params) against the TSDB of
+    get_fake_tsdb_json_response(), recording the requests of the last one.
+  '''
+  def __init__(self, step=10):
+    self.step = step
+    self.flag_no_data = False          # Respond without any timeseries.
+    self.fail_url_containing = None    # Respond with a 500 to such URLs.
+    self.requested_urls = []
+    self.requested_ranges = []         # (start, end) as in the URL.
+    self.queried_metrics = []
+
+  def get(self, url, **kwargs):
+    '''Stands in for requests.Session.get.'''
+    query = parse.parse_qs(parse.urlparse(url).query)
+    self.requested_urls.append(url)
+    self.requested_ranges.append((int(query['start'][0]), \
+                                  int(query['end'][0])))
+    self.queried_metrics.append( \
+        [m_param.split(":")[-1].split("{")[0] for m_param in query['m']])
+    if self.fail_url_containing != None and self.fail_url_containing in url:
+      return mock.Mock(status_code=500)
+    return mock_response([] if self.flag_no_data else \
+                         get_fake_tsdb_json_response(url, self.step))
+
+  def api(self, start, end, metrics, **kwargs):
+    host, port, IGNORED, query_filters, aggregator, IGNORED, IGNORED = \
+        get_dummy_query_params()
+    tsids = [ts_id.TimeseriesID(mm, query_filters) for mm in metrics]
+    return qq.QueryApi(host, port, ts.Timestamp(start), ts.Timestamp(end), \
+                       tsids, aggregator, **kwargs)
+
+  def query(self, start, end, metrics, **kwargs):
+    '''Returns the pair (api, retval of populate_ts_data()).'''
+    self.requested_urls = []
+    self.requested_ranges = []
+    self.queried_metrics = []
+    api = self.api(start, end, metrics, **kwargs)
+    with mock.patch('requests.Session.get', side_effect=self.get):
+      retval = api.populate_ts_data()
+    return api, retval
+
+  def verify_result(self, test_case, api, start, end, metrics, \
+                    flag_ms=False):
+    '''Checks that api holds the data of metrics over [start, end].'''
+    keys = get_fake_tsdb_keys(start, end, self.step, flag_ms)
+    query_filters = get_dummy_query_params()[3]
+    result_map = api.get_result_map()
+    test_case.assertEqual(len(result_map), len(metrics))
+    for metric in metrics:
+      fqid = ts_id.TimeseriesID(metric, query_filters).fqid
+      test_case.assertEqual(dict(result_map[fqid]), {tt: tt for tt in keys})
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import aggregate_index as agg
+from argus_tal import timeseries_datadict as tsd
+from argus_tal import timeseries_id as tid
+from . import helpers as hh
+import numpy as np
+import unittest
+
+
+class AggregateIndex_Tests(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+      super(AggregateIndex_Tests, self).__init__(*args, **kwargs)
+      self.__host, self.__port, self.__metric, self.__ts_filters, \
+      self.__qualifier, self.__start, self.__end = hh.get_dummy_query_params()
+      self.__tsid = tid.TimeseriesID(self.__metric, self.__ts_filters)
+
+      # Test data (see helpers): timestamps 1234510..1234570 every 10s and
+      # the value at each timestamp is 'timestamp - 1234500' i.e. a straight
+      # line from (1234510, 10) to (1234570, 70).
+      self.__tsdd = tsd.TimeseriesDataDict(self.__tsid, \
+                                           hh.get_sorted_datapoints())
+      self.__k_0, self.__v_0 = hh.get_smallest_key_and_its_value()
+      self.__k_Max, self.__v_Max = hh.get_largest_key_and_its_value()
+
+    def __brute_force_integral(self, keys, values, t1, t2):
+      # Samples the linearly interpolated curve at every second.
+      # Since all timestamps are whole seconds, the trapezoidal rule over
+      # 1 sec steps is exact for a piecewise linear curve.
+      yy = np.interp(np.arange(t1, t2 + 1), keys, values)
+      return np.sum(yy[1:] + yy[:-1]) / 2.0
+
+    def test_straight_line(self):
+      agg_idx = agg.AggregateIndex(self.__tsdd)
+      sub_testcase_data = [
+         # sub-test label, t1, t2, integral, mean, min, max
+         ("full span", self.__k_0, self.__k_Max, 2400, 40, 10, 70), \
+         ("between datapoints", 1234515, 1234535, 500, 25, 15, 35), \
+         ("within 2 datapoints", 1234512, 1234518, 90, 15, 12, 18), \
+         ("clipped on both ends", 0, self.__k_Max * 2, 2400, 40, 10, 70), \
+         ("single instant", 1234525, 1234525, 0, 25, 25, 25), \
+      ]
+      for label, t1, t2, integral, mean, min_v, max_v in sub_testcase_data:
+        with self.subTest(msg=label):
+          self.assertAlmostEqual(agg_idx.integral(t1, t2), integral)
+          self.assertAlmostEqual(agg_idx.mean(t1, t2), mean)
+          self.assertAlmostEqual(agg_idx.min(t1, t2), min_v)
+          self.assertAlmostEqual(agg_idx.max(t1, t2), max_v)
+
+    def test_no_overlap(self):
+      agg_idx = agg.AggregateIndex(self.__tsdd)
+      for t1, t2 in [(0, self.__k_0 - 1), (self.__k_Max + 1, self.__k_Max * 2)]:
+        self.assertEqual((agg_idx.integral(t1, t2), agg_idx.mean(t1, t2), \
+                          agg_idx.min(t1, t2), agg_idx.max(t1, t2)), \
+                         (None, None, None, None))
+      empty_idx = agg.AggregateIndex(tsd.TimeseriesDataDict(self.__tsid, {}))
+      self.assertEqual(empty_idx.max(self.__k_0, self.__k_Max), None)
+
+    def test_random_windows_against_brute_force(self):
+      rng = np.random.default_rng(1234)
+      keys = np.cumsum(rng.integers(1, 20, size=500)) + 1234500
+      values = rng.normal(100.0, 25.0, size=500)
+      agg_idx = agg.AggregateIndex( \
+          tsd.TimeseriesDataDict.from_arrays(self.__tsid, keys, values))
+      for _ in range(50):
+        t1, t2 = sorted(rng.integers(keys[0], keys[-1], size=2))
+        with self.subTest(msg="window [%d, %d]" % (t1, t2)):
+          window_values = np.interp(np.arange(t1, t2 + 1), keys, values)
+          self.assertAlmostEqual(agg_idx.integral(t1, t2), \
+              self.__brute_force_integral(keys, values, t1, t2), places=6)
+          self.assertAlmostEqual(agg_idx.min(t1, t2), window_values.min())
+          self.assertAlmostEqual(agg_idx.max(t1, t2), window_values.max())
+
+    def test_nan_only_affects_windows_covering_it(self):
+      datapoints = hh.get_sorted_datapoints()
+      datapoints[1234520] = float('nan')
+      agg_idx = agg.AggregateIndex(tsd.TimeseriesDataDict(self.__tsid, \
+                                                          datapoints))
+      sub_testcase_data = [
+         # sub-test label, t1, t2, integral, mean, min, max
+         ("after the NaN", 1234530, self.__k_Max, 2000, 50, 30, 70), \
+         ("between datapoints", 1234535, 1234565, 1500, 50, 35, 65), \
+      ]
+      for label, t1, t2, integral, mean, min_v, max_v in sub_testcase_data:
+        with self.subTest(msg=label):
+          self.assertAlmostEqual(agg_idx.integral(t1, t2), integral)
+          self.assertAlmostEqual(agg_idx.mean(t1, t2), mean)
+          self.assertAlmostEqual(agg_idx.min(t1, t2), min_v)
+          self.assertAlmostEqual(agg_idx.max(t1, t2), max_v)
+
+      for label, t1, t2 in [("full span", self.__k_0, self.__k_Max), \
+                            ("interpolated from it", 1234522, 1234528), \
+                            ("ending on it", self.__k_0, 1234520)]:
+        with self.subTest(msg=label):
+          for result in [agg_idx.integral(t1, t2), agg_idx.mean(t1, t2), \
+                         agg_idx.min(t1, t2), agg_idx.max(t1, t2)]:
+            self.assertTrue(np.isnan(result))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import async_query_api as aqa
+from argus_tal import query_api
+from argus_tal import timeseries_id as ts_id
+from . import helpers as hh
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import unittest
+from unittest import mock
+
+
+class _MockTsdb(object):
+    '''Stands in for requests.Session.get. Answers the dummy query after a
+       short delay and records the max number of requests in flight.'''
+    def __init__(self):
+      self.__lock = threading.Lock()
+      self.__in_flight = 0
+      self.max_in_flight = 0
+      self.num_requests = 0
+      self.release = threading.Event()   # Unset: requests hang until set.
+      self.release.set()
+
+    def get(self, url, **kwargs):
+      with self.__lock:
+        self.__in_flight += 1
+        self.num_requests += 1
+        self.max_in_flight = max(self.max_in_flight, self.__in_flight)
+      time.sleep(0.05)
+      self.release.wait()
+      with self.__lock:
+        self.__in_flight -= 1
+      if url == hh.get_url_for_dummy_query_params():
+        return hh.mock_response(hh.get_good_json_response())
+      return mock.Mock(status_code=404)
+
+
+class AsyncQueryApi_Tests(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+      super(AsyncQueryApi_Tests, self).__init__(*args, **kwargs)
+      self.__host, self.__port, self.__metric, self.__ts_filters, \
+      self.__aggregator, self.__start, self.__end = hh.get_dummy_query_params()
+      self.__tsid = ts_id.TimeseriesID(self.__metric, self.__ts_filters)
+
+    def __make_query(self, metric=None):
+      tsid = self.__tsid if metric == None else \
+             ts_id.TimeseriesID(metric, self.__ts_filters)
+      return aqa.AsyncQueryApi(self.__host, self.__port, self.__start, \
+                               self.__end, [tsid], self.__aggregator)
+
+    def test_same_result_as_query_api(self):
+      mock_tsdb = _MockTsdb()
+      with mock.patch('requests.Session.get', side_effect=mock_tsdb.get):
+        sync_api = query_api.QueryApi(self.__host, self.__port, \
+                                      self.__start, self.__end, \
+                                      [self.__tsid], self.__aggregator)
+        self.assertEqual(sync_api.populate_ts_data(), 0)
+
+        async_api = self.__make_query()
+        self.assertEqual(asyncio.run(async_api.populate_ts_data()), 0)
+
+      self.assertEqual(async_api.http_status_code, 200)
+      async_result = async_api.get_result_map()
+      sync_result = sync_api.get_result_map()
+      self.assertEqual(async_result.keys(), sync_result.keys())
+      for fqid, tsdd in async_result.items():
+        self.assertEqual(list(tsdd), list(sync_result[fqid]))
+      self.assertEqual(list(async_api.get_result_as_dataframes().keys()), \
+                       list(sync_result.keys()))
+      self.assertEqual(async_api.get_result_map_for(self.__tsid).keys(), \
+                       sync_api.get_result_map_for(self.__tsid).keys())
+      self.assertEqual(async_api.transfer_stats, sync_api.transfer_stats)
+      self.assertEqual(async_api.query_telemetry['requests'], 1)
+
+    def test_gather_queries(self):
+      mock_tsdb = _MockTsdb()
+      with mock.patch('requests.Session.get', side_effect=mock_tsdb.get):
+        query_list = [self.__make_query() for _ in range(8)]
+        # A failed query doesn't affect the others.
+        query_list[3] = self.__make_query("unknown_metric")
+        rv_list = asyncio.run(aqa.gather_queries(query_list, \
+                                                 max_concurrency=3))
+
+      self.assertEqual(rv_list, [0, 0, 0, -1, 0, 0, 0, 0])
+      self.assertEqual(query_list[3].http_status_code, 404)
+      for q_obj in query_list[:3] + query_list[4:]:
+        self.assertEqual(dict(q_obj.get_result_set()[0]), \
+                         hh.get_sorted_datapoints())
+      self.assertGreater(mock_tsdb.max_in_flight, 1)
+      self.assertLessEqual(mock_tsdb.max_in_flight, 3)
+
+    def test_cancelled_gather_does_not_block(self):
+      mock_tsdb = _MockTsdb()
+      mock_tsdb.release.clear()
+      timer = threading.Timer(2, mock_tsdb.release.set)
+      timer.start()
+      self.addCleanup(timer.cancel)
+      self.addCleanup(mock_tsdb.release.set)
+      query_list = [self.__make_query() for _ in range(4)]
+      start = time.monotonic()
+      with mock.patch('requests.Session.get', side_effect=mock_tsdb.get):
+        with self.assertRaises(asyncio.TimeoutError):
+          asyncio.run(asyncio.wait_for(aqa.gather_queries(query_list, \
+                                                          max_concurrency=2), \
+                                       timeout=0.2))
+        # Returned while the requests in flight were still hanging.
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertFalse(mock_tsdb.release.is_set())
+        mock_tsdb.release.set()
+        # The queries not started yet were dropped.
+        time.sleep(0.3)
+      self.assertEqual(mock_tsdb.num_requests, 2)
+
+    def test_gather_with_python_3_8_executor(self):
+      # ThreadPoolExecutor.shutdown() only takes cancel_futures from python
+      # 3.9 on.
+      shutdown = ThreadPoolExecutor.shutdown
+      def shutdown_3_8(executor, wait=True):
+        shutdown(executor, wait)
+      mock_tsdb = _MockTsdb()
+      with mock.patch.object(ThreadPoolExecutor, 'shutdown', shutdown_3_8), \
+           mock.patch('requests.Session.get', side_effect=mock_tsdb.get):
+        query_list = [self.__make_query() for _ in range(4)]
+        rv_list = asyncio.run(aqa.gather_queries(query_list, \
+                                                 max_concurrency=2))
+      self.assertEqual(rv_list, [0, 0, 0, 0])
+
+    def test_gather_no_queries(self):
+      self.assertEqual(asyncio.run(aqa.gather_queries([])), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import compressed_timeseries_datadict as ctsd
+from argus_tal import timeseries_datadict as tsd
+from argus_tal import timeseries_id as tid
+from . import helpers as hh
+import numpy as np
+import unittest
+
+
+class CompressedTsDataDict_Tests(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+      super(CompressedTsDataDict_Tests, self).__init__(*args, **kwargs)
+      self.__host, self.__port, self.__metric, self.__ts_filters, \
+      self.__qualifier, self.__start, self.__end = hh.get_dummy_query_params()
+      self.__tsid = tid.TimeseriesID(self.__metric, self.__ts_filters)
+
+      # Irregular timestamps and values, including special float values, to
+      # exercise every encoding bucket. A block size of 4 ensures lookups
+      # cross block boundaries.
+      self.__timestamps = [1234510, 1234520, 1234530, 1234531, 1234600, \
+                           1234900, 1236900, 1236901, 9234567890, 9234567900]
+      self.__values = [10.0, 10.0, 10.5, -3.25, float('nan'), float('inf'), \
+                       -0.0, 1e300, 42.0, 42.000001]
+      self.__tsdd = tsd.TimeseriesDataDict.from_arrays( \
+          self.__tsid, self.__timestamps, self.__values)
+      self.__block_size = 4
+
+    def __compress(self, tsdd_obj):
+      return ctsd.CompressedTimeseriesDataDict.from_timeseries_datadict( \
+          tsdd_obj, block_size=self.__block_size)
+
+    def test_round_trip_is_lossless(self):
+      c_dd = self.__compress(self.__tsdd)
+      rt_dd = c_dd.to_timeseries_datadict()
+      self.assertEqual(rt_dd.get_timeseries_id(), self.__tsid)
+      self.assertEqual(list(rt_dd.get_timestamps()), self.__timestamps)
+      # Compare bit patterns so that NaN and -0.0 are verified as well.
+      self.assertEqual(list(rt_dd.get_values().view(np.uint64)), \
+                       list(self.__tsdd.get_values().view(np.uint64)))
+
+    def test_iteration_and_len(self):
+      c_dd = self.__compress(self.__tsdd)
+      self.assertEqual(len(c_dd), len(self.__timestamps))
+      self.assertFalse(c_dd.is_empty())
+      self.assertEqual([kk for kk, vv in c_dd], self.__timestamps)
+      self.assertEqual((c_dd.get_min_key(), c_dd.get_max_key()), \
+                       (self.__timestamps[0], self.__timestamps[-1]))
+
+    def test_construct_from_dict(self):
+      c_dd = ctsd.CompressedTimeseriesDataDict(self.__tsid, \
+                                               hh.get_UNsorted_datapoints())
+      self.assertEqual({kk: vv for kk, vv in c_dd}, \
+                       hh.get_sorted_datapoints())
+
+    def test_lookups_match_uncompressed(self):
+      c_dd = self.__compress(self.__tsdd)
+      probe_keys = [0, 99999999999] + self.__timestamps + \
+                   [kk + 1 for kk in self.__timestamps] + \
+                   [kk - 1 for kk in self.__timestamps]
+      for qualifier in tsd.LookupQualifier:
+        with self.subTest(msg=qualifier.name):
+          for key in probe_keys:
+            expected_key, expected_value = \
+                self.__tsdd.get_datapoint(key, qualifier)
+            kk, vv = c_dd.get_datapoint(key, qualifier)
+            self.assertEqual(kk, expected_key, key)
+            if expected_value is None or not np.isnan(expected_value):
+              self.assertEqual(vv, expected_value, key)
+            else:
+              self.assertTrue(np.isnan(vv), key)
+            self.assertEqual( \
+                c_dd.get_iter_slice(key, qualifier, key, qualifier), \
+                self.__tsdd.get_iter_slice(key, qualifier, key, qualifier))
+
+    def test_empty(self):
+      c_dd = self.__compress(tsd.TimeseriesDataDict(self.__tsid, {}))
+      self.assertTrue(c_dd.is_empty())
+      self.assertEqual(len(c_dd), 0)
+      self.assertEqual(list(c_dd), [])
+      self.assertEqual(c_dd.get_datapoint( \
+          1234510, tsd.LookupQualifier.NEAREST_LARGER_WEAK), (1234510, None))
+      self.assertTrue(c_dd.to_timeseries_datadict().is_empty())
+
+    def test_regularly_sampled_series_compresses_well(self):
+      num_dps = 3600
+      tsdd_obj = tsd.TimeseriesDataDict.from_arrays(self.__tsid, \
+          np.arange(1234510, 1234510 + num_dps), \
+          np.round(200.0 + np.sin(np.arange(num_dps) / 600.0), 1))
+      c_dd = ctsd.CompressedTimeseriesDataDict.from_timeseries_datadict( \
+          tsdd_obj)
+      uncompressed_size = tsdd_obj.get_timestamps().nbytes + \
+                          tsdd_obj.get_values().nbytes
+      self.assertGreater(uncompressed_size / c_dd.get_compressed_size(), 10)
+
+if __name__ == '__main__':
+    unittest.main()
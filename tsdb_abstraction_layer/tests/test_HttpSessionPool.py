@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import http_session_pool as hspool
+from argus_tal import query_api
+from argus_tal import timeseries_id as ts_id
+from . import helpers as hh
+
+import gzip
+import http.server
+import json
+import threading
+import unittest
+
+
+class _TsdbStubHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 so that connections are kept alive between requests.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+      body = json.dumps(hh.get_good_json_response(), indent=2).encode()
+      if 'gzip' in self.headers.get('Accept-Encoding', ''):
+        self.__reply(gzip.compress(body), content_encoding='gzip')
+      else:
+        self.__reply(body)
+
+    def do_POST(self):
+      self.rfile.read(int(self.headers['Content-Length']))
+      self.__reply(b'')
+
+    def log_message(self, *args):
+      pass  # Keep test output clean.
+
+    def __reply(self, body, content_encoding=None):
+      self.send_response(200)
+      self.send_header('Content-Length', str(len(body)))
+      if content_encoding != None:
+        self.send_header('Content-Encoding', content_encoding)
+      self.end_headers()
+      self.wfile.write(body)
+
+
+class HttpSessionPool_Tests(unittest.TestCase):
+    def setUp(self):
+      self.__server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), \
+                                                      _TsdbStubHandler)
+      threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+      self.__url = 'http://127.0.0.1:%d/api/query' % self.__server.server_port
+
+    def tearDown(self):
+      self.__server.shutdown()
+      self.__server.server_close()
+
+    def test_connections_are_reused(self):
+      pool = hspool.HttpSessionPool()
+      for _ in range(5):
+        self.assertEqual(pool.get(self.__url).status_code, 200)
+        self.assertEqual(pool.post(self.__url, data='{}').status_code, 200)
+      stats = pool.get_stats()
+      self.assertEqual(stats['requests'], 10)
+      self.assertEqual(stats['failed_requests'], 0)
+      self.assertEqual(stats['requests_sent'], 10)
+      self.assertEqual(stats['connections_opened'], 1)
+      self.assertEqual(list(stats['hosts'].values()), \
+                       [{'connections_opened': 1, 'requests_sent': 10}])
+      pool.close()
+
+    def test_failed_requests_are_counted(self):
+      pool = hspool.HttpSessionPool(connect_timeout=1)
+      # Nothing listens on port 1.
+      with self.assertRaises(hspool.requests.exceptions.ConnectionError):
+        pool.get('http://127.0.0.1:1/api/query')
+      self.assertEqual(pool.get_stats()['failed_requests'], 1)
+
+    def test_query_api_uses_supplied_pool(self):
+      host, port, metric, query_filters, aggregator, start, end = \
+        hh.get_dummy_query_params()
+      pool = hspool.HttpSessionPool()
+      for _ in range(3):
+        api = query_api.QueryApi('127.0.0.1', self.__server.server_port, \
+                                 start, end, \
+                                 [ts_id.TimeseriesID(metric, query_filters)], \
+                                 aggregator, http_session_pool=pool)
+        self.assertEqual(api.populate_ts_data(), 0)
+        self.assertEqual(len(api.get_result_set()), 1)
+      # 3 QueryApi objects, 1 connection.
+      self.assertEqual(pool.get_stats()['requests_sent'], 3)
+      self.assertEqual(pool.get_stats()['connections_opened'], 1)
+
+    def test_compressed_responses_are_accounted(self):
+      host, port, metric, query_filters, aggregator, start, end = \
+        hh.get_dummy_query_params()
+      body = json.dumps(hh.get_good_json_response(), indent=2).encode()
+      decoded_size = len(body)
+      pool = hspool.HttpSessionPool()
+      # Streamed, then not streamed (the default).
+      for flag_stream in [True, False]:
+        api = query_api.QueryApi('127.0.0.1', self.__server.server_port, \
+                                 start, end, \
+                                 [ts_id.TimeseriesID(metric, query_filters)], \
+                                 aggregator, http_session_pool=pool, \
+                                 flag_stream_response=flag_stream)
+        self.assertEqual(api.populate_ts_data(), 0)
+        self.assertEqual(dict(api.get_result_set()[0]), \
+                         hh.get_sorted_datapoints())
+        transfer_stats = api.transfer_stats
+        self.assertEqual(transfer_stats, \
+                         {'wire_bytes': len(gzip.compress(body)), \
+                          'decoded_bytes': decoded_size})
+        self.assertLess(transfer_stats['wire_bytes'], decoded_size)
+      stats = pool.get_stats()
+      self.assertEqual(stats['decoded_bytes'], 2 * decoded_size)
+      self.assertEqual(stats['wire_bytes'], 2 * transfer_stats['wire_bytes'])
+      # Fully read responses give their connection back.
+      self.assertEqual(stats['connections_opened'], 1)
+
+      # Without compression, both counts are the same.
+      pool = hspool.HttpSessionPool(accept_encoding='identity')
+      api = query_api.QueryApi('127.0.0.1', self.__server.server_port, \
+                               start, end, \
+                               [ts_id.TimeseriesID(metric, query_filters)], \
+                               aggregator, http_session_pool=pool)
+      self.assertEqual(len(list(api.iter_results())), 1)
+      self.assertEqual(api.transfer_stats, \
+                       {'wire_bytes': decoded_size, \
+                        'decoded_bytes': decoded_size})
+
+    def test_default_pool(self):
+      default_pool = hspool.get_default_pool()
+      self.assertIs(hspool.get_default_pool(), default_pool)
+      new_pool = hspool.HttpSessionPool()
+      hspool.set_default_pool(new_pool)
+      try:
+        self.assertIs(hspool.get_default_pool(), new_pool)
+      finally:
+        hspool.set_default_pool(default_pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
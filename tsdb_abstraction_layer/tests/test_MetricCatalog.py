@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import exceptions as excp
+from argus_tal import metric_catalog as mcat
+from argus_tal.timeseries_id import TimeseriesID
+from argus_tal.timeseries_pattern import TimeseriesPattern
+from . import helpers as hh
+
+import requests
+import unittest
+from unittest import mock
+
+
+class MetricCatalog_Tests(unittest.TestCase):
+    def setUp(self):
+      self.__metrics = ["machine.sensor.raw_screw_speed", "other.metric", \
+                        "machine.sensor.raw_melt_temperature", "machine.x"]
+      self.__tagsets = [{"machine_name": "extruder_%d" % ii, "site": "s1"} \
+                        for ii in range(40)] + [{"machine_name": "winder_1"}]
+      self.__status_code = 200
+      self.__requested_paths = []
+
+    def __mocked_requests_get(self, url, **kwargs):
+      parsed_url = hh.parse.urlparse(url)
+      query = hh.parse.parse_qs(parsed_url.query)
+      self.__requested_paths.append(parsed_url.path)
+      if self.__status_code == None:
+        raise requests.exceptions.ConnectionError("Connection refused")
+      response = mock.Mock(status_code=self.__status_code)
+      if parsed_url.path == "/api/suggest":
+        self.assertEqual(query["type"], ["metrics"])
+        response.json.return_value = self.__metrics
+      elif query["m"][0] == "machine.sensor.raw_melt_temperature":
+        response.json.return_value = {"type": "LOOKUP", "results": [ \
+            {"metric": query["m"][0], "tags": tags, "tsuid": "%06d" % ii} \
+            for ii, tags in enumerate(self.__tagsets)]}
+      else:
+        response.status_code = 404
+      return response
+
+    def __catalog(self, **kwargs):
+      catalog = mcat.MetricCatalog("localhost", 4242, **kwargs)
+      patcher = mock.patch('requests.Session.get', \
+                           side_effect=self.__mocked_requests_get)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+      return catalog
+
+    def test_metrics_by_prefix(self):
+      catalog = self.__catalog()
+      self.assertEqual(catalog.metrics("machine.sensor."), \
+                       ["machine.sensor.raw_melt_temperature", \
+                        "machine.sensor.raw_screw_speed"])
+      self.assertEqual(catalog.metrics("machine."), \
+                       ["machine.sensor.raw_melt_temperature", \
+                        "machine.sensor.raw_screw_speed", "machine.x"])
+      self.assertEqual(catalog.metrics("nope"), [])
+      self.assertEqual(len(catalog.metrics()), 4)
+      self.assertEqual(self.__requested_paths, ["/api/suggest"])
+      self.assertEqual(catalog.get_stats(), \
+                       {'hits': 3, 'fetches': 1, 'errors': 0})
+
+    def test_series_lookups(self):
+      catalog = self.__catalog()
+      metric = "machine.sensor.raw_melt_temperature"
+      self.assertEqual(len(catalog.series(metric)), 41)
+      self.assertEqual(catalog.tag_values(metric, "machine_name", \
+                                          {"machine_name": "extruder_1*"}), \
+                       ["extruder_1"] + ["extruder_1%d" % ii \
+                                         for ii in range(10)])
+      self.assertEqual(catalog.tag_values(metric, "site"), ["s1"])
+      self.assertEqual(catalog.resolve(TimeseriesPattern(metric, \
+                           {"machine_name": "extruder_3|winder_1"})), \
+                       [TimeseriesID(metric, self.__tagsets[3]), \
+                        TimeseriesID(metric, self.__tagsets[40])])
+      # Unknown metric.
+      self.assertEqual(catalog.series("machine.x"), [])
+      self.assertEqual(self.__requested_paths, ["/api/search/lookup"] * 2)
+
+    def test_ttl_and_errors(self):
+      catalog = self.__catalog(ttl=60)
+      metric = "machine.sensor.raw_melt_temperature"
+      now = 1000.0
+      with mock.patch('time.monotonic', side_effect=lambda: now):
+        self.assertEqual(len(catalog.series(metric)), 41)
+        self.__tagsets.append({"machine_name": "extruder_new"})
+        now += 30
+        self.assertEqual(len(catalog.series(metric)), 41)
+        now += 31
+        self.assertEqual(len(catalog.series(metric)), 42)
+
+        # Stale data is used while the TSDB is failing.
+        self.__tagsets.pop()
+        self.__status_code = 500
+        now += 61
+        self.assertEqual(len(catalog.series(metric)), 42)
+        with self.assertRaises(excp.QueryFailed) as context:
+          catalog.metrics()
+        self.assertEqual(context.exception.error_code, -1)
+        self.assertEqual(catalog.get_stats(), \
+                         {'hits': 1, 'fetches': 4, 'errors': 2})
+
+        # Network errors too.
+        self.__status_code = None
+        now += 61
+        self.assertEqual(len(catalog.series(metric)), 42)
+        catalog.invalidate()
+        with self.assertRaises(excp.QueryFailed) as context:
+          catalog.metrics()
+        self.assertEqual(context.exception.error_code, -1)
+        self.assertEqual(catalog.get_stats()['errors'], 4)
+
+        self.__status_code = 200
+        catalog.invalidate(metric)
+        self.assertEqual(len(catalog.series(metric)), 41)
+
+
+if __name__ == '__main__':
+    unittest.main()
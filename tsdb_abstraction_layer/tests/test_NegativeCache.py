@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import exceptions as excp
+from argus_tal import negative_cache as ncache
+from argus_tal import timeseries_id as ts_id
+from . import helpers as hh
+
+import time
+import unittest
+from unittest import mock
+
+
+class NegativeCache_Tests(unittest.TestCase):
+    def setUp(self):
+      self.__tsdb = hh.FakeTsdb()
+
+    def __api(self, cache, start, end, metrics, **kwargs):
+      return self.__tsdb.api(start, end, metrics, negative_cache=cache, \
+                             **kwargs)
+
+    def __query(self, cache, start, end, metrics, **kwargs):
+      return self.__tsdb.query(start, end, metrics, negative_cache=cache, \
+                               **kwargs)
+
+    def test_dead_series_is_not_queried_again(self):
+      cache = ncache.NegativeCache(ttl=60)
+      now = int(time.time())
+      metrics = ["empty_metric", "some_metric"]
+      api, retval = self.__query(cache, now - 300, now, metrics)
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.queried_metrics, [metrics])
+
+      # Next window: the dead series is left out.
+      api, retval = self.__query(cache, now - 240, now + 60, metrics)
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.queried_metrics, [["some_metric"]])
+      self.assertEqual(len(api.get_result_set()), 1)
+
+      # No request at all.
+      api, retval = self.__query(cache, now - 200, now + 100, ["empty_metric"])
+      self.assertEqual(retval, -3)
+      self.assertEqual(self.__tsdb.queried_metrics, [])
+      self.assertEqual(api.http_status_code, 0)
+      self.assertEqual(api.get_result_set(), [])
+      api = self.__api(cache, now - 200, now + 100, ["empty_metric"])
+      with mock.patch('requests.Session.get') as mock_get:
+        with self.assertRaises(excp.QueryFailed) as context:
+          list(api.iter_results())
+      self.assertEqual(context.exception.error_code, -3)
+      mock_get.assert_not_called()
+
+      # Until the TTL expires.
+      with mock.patch('time.time', return_value=now + 61):
+        api, retval = self.__query(cache, now - 200, now + 100, \
+                                   ["empty_metric"])
+      self.assertEqual(retval, -3)
+      self.assertEqual(self.__tsdb.queried_metrics, [["empty_metric"]])
+      self.assertEqual(cache.get_stats(), \
+                       {'hits': 3, 'misses': 4, 'entries': 1})
+
+    def test_msec_response(self):
+      # Timestamps in msecs, whatever the unit of the time range queried.
+      cache = ncache.NegativeCache(ttl=60)
+      now = int(time.time())
+      metrics = ["empty_metric", "some_metric"]
+      api, retval = self.__query(cache, now - 300, now, metrics, \
+                                 flag_ms_response=True)
+      self.assertEqual(retval, 0)
+      # Dead, in the next windows whatever their unit.
+      for q_start, q_end in [(now - 240, now + 60), \
+                             ((now - 180) * 1000, (now + 120) * 1000)]:
+        api, retval = self.__query(cache, q_start, q_end, metrics, \
+                                   flag_ms_response=True)
+        self.assertEqual(retval, 0)
+        self.assertEqual(self.__tsdb.queried_metrics, [["some_metric"]])
+      self.assertEqual(len(api.get_result_set()), 1)
+      self.__tsdb.verify_result(self, api, q_start, q_end, ["some_metric"], \
+                                flag_ms=True)
+
+    def test_historical_windows(self):
+      cache = ncache.NegativeCache()
+      start = 1600000000
+      self.__query(cache, start, start + 3600, ["empty_metric"])
+      api, retval = self.__query(cache, start + 100, start + 200, \
+                                 ["empty_metric"])
+      self.assertEqual(retval, -3)
+      self.assertEqual(self.__tsdb.queried_metrics, [])
+      # Not known to be empty outside of the time range queried.
+      api, retval = self.__query(cache, start + 3000, start + 4000, \
+                                 ["empty_metric"])
+      self.assertEqual(self.__tsdb.queried_metrics, [["empty_metric"]])
+      # Adjacent ranges are merged.
+      api, retval = self.__query(cache, start + 100, start + 3900, \
+                                 ["empty_metric"])
+      self.assertEqual(self.__tsdb.queried_metrics, [])
+
+    def test_data_landing_drops_entries(self):
+      cache = ncache.NegativeCache()
+      tsid = ts_id.TimeseriesID("some_metric", hh.get_dummy_query_params()[3])
+      cache.put_empty("key", tsid, 100, 200)
+      cache.put_empty("key", tsid, 300, 400)
+      self.assertTrue(cache.is_empty("key", tsid, 120, 180))
+      self.assertFalse(cache.is_empty("other_key", tsid, 120, 180))
+      cache.put_data("key", tsid, 150, 250)
+      self.assertFalse(cache.is_empty("key", tsid, 120, 180))
+      self.assertTrue(cache.is_empty("key", tsid, 300, 400))
+
+      # Through QueryApi: data landed in a time range known to be empty.
+      cache.clear()
+      start = 1600000000
+      self.__tsdb.flag_no_data = True
+      api, retval = self.__query(cache, start, start + 100, ["some_metric"])
+      self.assertEqual(retval, -3)
+      self.__tsdb.flag_no_data = False
+      api, retval = self.__query(cache, start - 100, start + 100, \
+                                 ["some_metric"])
+      self.assertEqual(retval, 0)
+      api, retval = self.__query(cache, start, start + 50, ["some_metric"])
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.queried_metrics, [["some_metric"]])
+      self.assertEqual(cache.get_stats()['entries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
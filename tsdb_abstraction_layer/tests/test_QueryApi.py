@@ -1,22 +1,33 @@
 # -*- coding: utf-8 -*-
 
 from .context import argus_tal
+from argus_tal import basic_types as bt
+from argus_tal import exceptions as excp
 from argus_tal import query_api
+from argus_tal import query_cache as qcache
+from argus_tal import query_urlgen as qurlgen
 from argus_tal import timeseries_id as ts_id
+from argus_tal import timeseries_pattern as ts_pat
 from . import helpers as hh
 
+import json
+import numpy as np
 import unittest
 
 #import requests
 from unittest import mock
 
 
-# This method will be used by the mock to replace requests.get
+# This method will be used by the mock to replace requests.Session.get, which
+# is what the (pooled) HTTP requests made by QueryApi go through.
 def mocked_requests_get(*args, **kwargs):
     class MockResponse:
         def __init__(self, json_data, status_code):
             self.json_data = json_data
             self.status_code = status_code
+            self.content = json.dumps(json_data).encode()
+            self.raw = mock.Mock()
+            self.raw.tell.return_value = len(self.content)
 
         def json(self):
             return self.json_data
@@ -31,6 +42,8 @@ def mocked_requests_get(*args, **kwargs):
         return MockResponse(hh.get_good_msec_json_response(), 200)
     elif args[0] == hh.get_url_for_query_params_with_maxsize_64bits():
         return MockResponse(hh.get_json_response_for_maxsize_on_64bit(), 200)
+    elif args[0] == hh.get_url_for_multi_metric_query_params():
+        return MockResponse(hh.get_multi_metric_json_response(), 200)
 
     return MockResponse(None, 404)
 
@@ -63,7 +76,7 @@ class QueryApi_Tests(unittest.TestCase):
                     for ii in range(len(df))}
       self.assertEqual(result_dps, expected_dps) # verify data point
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_single_metric_query_response(self, mock_get):
       host, port, metric, query_filters, aggregator, start, end = \
         hh.get_dummy_query_params()
@@ -85,7 +98,7 @@ class QueryApi_Tests(unittest.TestCase):
       self.assertIn(mock.call(hh.get_url_for_dummy_query_params()), \
                               mock_get.call_args_list)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_single_metric_query_response_as_map(self, mock_get):
       host, port, metric, query_filters, aggregator, start, end = \
         hh.get_dummy_query_params()
@@ -108,7 +121,7 @@ class QueryApi_Tests(unittest.TestCase):
       self.assertIn(mock.call(hh.get_url_for_dummy_query_params()), \
                               mock_get.call_args_list)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_single_metric_query_response_as_dataframe_map(self, mock_get):
       host, port, metric, query_filters, aggregator, start, end = \
         hh.get_dummy_query_params()
@@ -134,7 +147,7 @@ class QueryApi_Tests(unittest.TestCase):
       self.assertIn(mock.call(hh.get_url_for_dummy_query_params()), \
                               mock_get.call_args_list)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_unknown_metric_query_404_response(self, mock_get):
       host, port, IGNORED, query_filters, aggregator, start, end = \
         hh.get_dummy_query_params()
@@ -152,7 +165,7 @@ class QueryApi_Tests(unittest.TestCase):
                               mock_get.call_args_list)
       '''
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_single_metric_query_bad_json_response(self, mock_get):
       host, port, IGNORED, query_filters, aggregator, start, end = \
         hh.get_dummy_query_params()
@@ -170,7 +183,7 @@ class QueryApi_Tests(unittest.TestCase):
                               mock_get.call_args_list)
       '''
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_single_metric_RATE_query_response(self, mock_get):
       host, port, metric, query_filters, aggregator, start, end = \
         hh.get_dummy_query_params()
@@ -192,7 +205,7 @@ class QueryApi_Tests(unittest.TestCase):
       self.assertIn(mock.call(hh.get_url_for_dummy_query_params_with_rate()), \
                               mock_get.call_args_list)
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_single_metric_query_with_millisecond_response(self, mock_get):
       host, port, metric, query_filters, aggregator, start, end = \
         hh.get_dummy_query_params_for_ms_response()
@@ -217,7 +230,7 @@ class QueryApi_Tests(unittest.TestCase):
 
     # This test case is to ensure that the largest signed 64bit number if
     # returned in the query response, doesn't cause us to crash and burn.
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def test_single_metric_query_with_maxsize_64bits(self, mock_get):
       host, port, metric, query_filters, aggregator, start, end = \
         hh.get_query_params_for_maxsize_64bits()
@@ -240,11 +253,365 @@ class QueryApi_Tests(unittest.TestCase):
       self.assertIn(mock.call(hh.get_url_for_query_params_with_maxsize_64bits()), \
                               mock_get.call_args_list)
 
+    # Timeseries with identical timestamps must share one timestamp array.
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_multi_metric_query_shares_timestamp_axis(self, mock_get):
+      host, port, metric, query_filters, aggregator, start, end = \
+        hh.get_dummy_query_params()
+      expected_dps = hh.get_sorted_datapoints()
+
+      input_tsids = [ts_id.TimeseriesID(mm, query_filters) \
+                     for mm in [metric, "other_metric", "sparse_metric"]]
+      api = query_api.QueryApi(host, port, start, end, input_tsids, aggregator)
+      retval = api.populate_ts_data()
+      self.assertTrue(retval == 0)
+
+      tsdd_list = api.get_result_set()
+      self.assertEqual(len(tsdd_list), 3)
+      self.__verify_tsdd_result_obj(tsdd_list[0], input_tsids[0], expected_dps)
+      self.__verify_tsdd_result_obj(tsdd_list[1], input_tsids[1], expected_dps)
+      self.assertTrue(tsdd_list[0].shares_timestamp_axis(tsdd_list[1]))
+      self.assertFalse(tsdd_list[0].shares_timestamp_axis(tsdd_list[2]))
+
+    # Queries with a URL too long for a GET are sent as a POST.
+    @mock.patch('requests.Session.post')
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+    def test_long_query_is_sent_as_post(self, mock_get, mock_post):
+      host, port, metric, query_filters, aggregator, start, end = \
+        hh.get_dummy_query_params()
+      mock_post.return_value = hh.mock_response(hh.get_good_json_response())
+
+      input_tsid = ts_id.TimeseriesID(metric, query_filters)
+      api = query_api.QueryApi(host, port, start, end, [input_tsid], \
+                               aggregator, max_get_url_len=40)
+      self.assertEqual(api.populate_ts_data(), 0)
+      self.__verify_tsdd_result_obj(api.get_result_set()[0], input_tsid, \
+                                    hh.get_sorted_datapoints())
+      mock_get.assert_not_called()
+      post_args, post_kwargs = mock_post.call_args
+      self.assertEqual(post_args, ("http://172.1.1.1:4242/api/query",))
+      self.assertEqual(json.loads(post_kwargs['data'])['queries'][0]['metric'],
+                       metric)
+
+      # Short enough for a GET.
+      mock_post.reset_mock()
+      api = query_api.QueryApi(host, port, start, end, [input_tsid], \
+                               aggregator)
+      self.assertEqual(api.populate_ts_data(), 0)
+      mock_post.assert_not_called()
+
+    # Streamed responses are decoded incrementally, with the same results.
+    def test_streamed_response(self):
+      host, port, metric, query_filters, aggregator, start, end = \
+        hh.get_dummy_query_params()
+      body = json.dumps(hh.get_multi_metric_json_response()).encode()
+      response = mock.Mock(status_code=200)
+      response.iter_content.return_value = \
+        [body[ii:ii + 10] for ii in range(0, len(body), 10)]
+      response.raw.tell.return_value = 123   # Compressed size.
+      response.json.side_effect = AssertionError("Response not streamed")
+
+      input_tsids = [ts_id.TimeseriesID(mm, query_filters) \
+                     for mm in [metric, "other_metric", "sparse_metric"]]
+      api = query_api.QueryApi(host, port, start, end, input_tsids, \
+                               aggregator, flag_stream_response=True)
+      with mock.patch('requests.Session.get', return_value=response) \
+           as mock_get:
+        self.assertEqual(api.populate_ts_data(), 0)
+      mock_get.assert_called_once_with( \
+        hh.get_url_for_multi_metric_query_params(), stream=True)
+
+      tsdd_list = api.get_result_set()
+      self.assertEqual(len(tsdd_list), 3)
+      self.__verify_tsdd_result_obj(tsdd_list[0], input_tsids[0], \
+                                    hh.get_sorted_datapoints())
+      self.assertEqual(dict(tsdd_list[2]), {1234510: 1, 1234570: 7})
+      self.assertTrue(tsdd_list[0].shares_timestamp_axis(tsdd_list[1]))
+      self.assertEqual(api.transfer_stats, \
+                       {'wire_bytes': 123, 'decoded_bytes': len(body)})
+
+      # Truncated response.
+      response.iter_content.return_value = [body[:-2]]
+      with mock.patch('requests.Session.get', return_value=response):
+        self.assertEqual(api.populate_ts_data(), -2)
+      response.close.assert_called_once()
+
+    def test_iter_results(self):
+      host, port, metric, query_filters, aggregator, start, end = \
+        hh.get_dummy_query_params()
+      body = json.dumps(hh.get_multi_metric_json_response()).encode()
+      body_chunks = [body[ii:ii + 10] for ii in range(0, len(body), 10)]
+      chunks_read = []
+      def iter_content(chunk_size):
+        for chunk in body_chunks:
+          chunks_read.append(chunk)
+          yield chunk
+      response = mock.Mock(status_code=200)
+      response.iter_content.side_effect = iter_content
+      response.raw.tell.return_value = 123
+
+      input_tsids = [ts_id.TimeseriesID(mm, query_filters) \
+                     for mm in [metric, "other_metric", "sparse_metric"]]
+      api = query_api.QueryApi(host, port, start, end, input_tsids, aggregator)
+      with mock.patch('requests.Session.get', return_value=response):
+        result_iter = api.iter_results()
+        first_tsdd = next(result_iter)
+        # The first timeseries is handed out before the response is read.
+        self.assertLess(len(chunks_read), len(body_chunks))
+        self.__verify_tsdd_result_obj(first_tsdd, input_tsids[0], \
+                                      hh.get_sorted_datapoints())
+        tsdd_list = [first_tsdd] + list(result_iter)
+
+      self.assertEqual([tt.get_timeseries_id() for tt in tsdd_list], \
+                       input_tsids)
+      self.assertTrue(tsdd_list[0].shares_timestamp_axis(tsdd_list[1]))
+      self.assertEqual(api.get_result_set(), tsdd_list)
+      self.assertEqual(api.http_status_code, 200)
+      self.assertEqual(api.transfer_stats, \
+                       {'wire_bytes': 123, 'decoded_bytes': len(body)})
+
+    @mock.patch('requests.Session.get')
+    def test_iter_results_errors(self, mock_get):
+      host, port, metric, query_filters, aggregator, start, end = \
+        hh.get_dummy_query_params()
+      api = query_api.QueryApi(host, port, start, end, \
+                               [ts_id.TimeseriesID(metric, query_filters)], \
+                               aggregator)
+      sub_testcase_data = [
+        # sub-test label, HTTP status, body, expected error code
+        ("HTTP error", 404, b'', -1), \
+        ("bad JSON", 200, b'[{"metric": ', -2), \
+        ("missing fields", 200, \
+         json.dumps(hh.get_truncated_json_response()).encode(), -2), \
+        ("no timeseries", 200, b'[]', -3), \
+      ]
+      for label, status_code, body, error_code in sub_testcase_data:
+        with self.subTest(msg=label):
+          mock_get.return_value = mock.Mock(status_code=status_code)
+          mock_get.return_value.iter_content.return_value = [body]
+          mock_get.return_value.raw.tell.return_value = len(body)
+          with self.assertRaises(excp.QueryFailed) as context:
+            list(api.iter_results())
+          self.assertEqual(context.exception.error_code, error_code)
+          self.assertEqual(api.http_status_code, status_code)
+
+    # Aggregated, downsampled responses: tags are only those common to the
+    # timeseries aggregated and buckets without data may be null.
+    def test_aggregated_downsampled_query(self):
+      host, port, metric, IGNORED, IGNORED, start, end = \
+        hh.get_dummy_query_params()
+      input_tsid = ts_id.TimeseriesID(metric, {"host": "m1|m2", "site": "s1"})
+      resp_data = [{"metric": metric, "tags": {"site": "s1"}, \
+                    "aggregateTags": ["host"], \
+                    "dps": {"1234500": 1.5, "1234560": None, "1234620": 3}}]
+      body = json.dumps(resp_data).encode()
+      downsample = qurlgen.Downsample("1m", bt.Aggregator.AVG, \
+                                      bt.FillPolicy.NULL)
+      expected_url = "http://%s:%d/api/query?start=%s&end=%s" \
+        "&m=sum:1m-avg-null:%s{}{host=m1|m2,site=s1}" % \
+        (host, port, start.value, end.value, metric)
+
+      for flag_stream in [False, True]:
+        with self.subTest(msg="streamed" if flag_stream else "not streamed"):
+          response = hh.mock_response(resp_data)
+          response.iter_content.return_value = [body]
+          # Caches don't apply to aggregated results, they're ignored.
+          api = query_api.QueryApi(host, port, start, end, [input_tsid], \
+                                   bt.Aggregator.SUM, downsample=downsample, \
+                                   flag_stream_response=flag_stream, \
+                                   query_cache=qcache.QueryResultCache())
+          with mock.patch('requests.Session.get', return_value=response) \
+               as mock_get:
+            self.assertEqual(api.populate_ts_data(), 0)
+          self.assertEqual(mock_get.call_args[0][0], expected_url)
+
+          tsdd_list = api.get_result_set()
+          self.assertEqual(len(tsdd_list), 1)
+          self.assertEqual(tsdd_list[0].get_timeseries_id(), \
+                           ts_id.TimeseriesID(metric, {"site": "s1"}))
+          self.assertEqual(list(tsdd_list[0].get_timestamps()), \
+                           [1234500, 1234560, 1234620])
+          values = tsdd_list[0].get_values()
+          self.assertEqual((values[0], values[2]), (1.5, 3.0))
+          self.assertTrue(np.isnan(values[1]))
+
+    def test_aggregated_result_map_for(self):
+      # Aggregates only keep the tags common to the timeseries aggregated:
+      # they're matched to the id queried for them by response order.
+      host, port, metric, IGNORED, IGNORED, start, end = \
+        hh.get_dummy_query_params()
+      tsid_ab = ts_id.TimeseriesID(metric, {"machine": "a|b", "site": "s1"})
+      tsid_cd = ts_id.TimeseriesID(metric, {"machine": "c|d", "site": "s2"})
+      tsid_e = ts_id.TimeseriesID(metric, {"machine": "e"})
+      tsid_list = [tsid_ab, tsid_cd, tsid_ab, tsid_e]
+      series = [{"metric": metric, "tags": {"site": "s1"}, \
+                 "aggregateTags": ["machine"], "dps": {"1234500": 1}}, \
+                {"metric": metric, "tags": {"site": "s2"}, \
+                 "aggregateTags": ["machine"], "dps": {"1234500": 2}}, \
+                {"metric": metric, "tags": {"machine": "e"}, \
+                 "aggregateTags": [], "dps": {"1234500": 3}}]
+      for resp_data, expected in [(series, [1, 2, 3]), \
+                                  (series[1:], [None, 2, 3])]:
+        api = query_api.QueryApi(host, port, start, end, tsid_list, \
+                                 bt.Aggregator.SUM)
+        with mock.patch('requests.Session.get', \
+                        return_value=hh.mock_response(resp_data)) as mock_get:
+          self.assertEqual(api.populate_ts_data(), 0)
+        # Each distinct id is queried once.
+        self.assertEqual(mock_get.call_args[0][0].count("&m="), 3)
+        for tsid, value in zip([tsid_ab, tsid_cd, tsid_e], expected):
+          result_map = api.get_result_map_for(tsid)
+          if value == None:
+            self.assertEqual(result_map, {})
+          else:
+            self.assertEqual([dict(tsdd) for tsdd in result_map.values()], \
+                             [{1234500: value}])
+
+    # 1 request for a pattern, fanned out into 1 result per machine.
+    def test_pattern_query(self):
+      host, port, metric, IGNORED, aggregator, start, end = \
+        hh.get_dummy_query_params()
+      pattern = ts_pat.TimeseriesPattern(metric, {"machine": "extruder_*"})
+      other_tsid = ts_id.TimeseriesID("other_metric", {"machine": "m1"})
+      resp_data = [{"metric": metric, "tags": {"machine": "extruder_%d" % ii}, \
+                    "aggregateTags": [], "dps": {"1234500": ii}} \
+                   for ii in range(40)]
+      resp_data.append({"metric": "other_metric", "tags": {"machine": "m1"}, \
+                        "aggregateTags": [], "dps": {"1234500": -1}})
+      response = hh.mock_response(resp_data)
+
+      api = query_api.QueryApi(host, port, start, end, \
+                               [pattern, other_tsid], aggregator)
+      with mock.patch('requests.Session.get', return_value=response) \
+           as mock_get:
+        self.assertEqual(api.populate_ts_data(), 0)
+      mock_get.assert_called_once()
+      self.assertIn("{machine=extruder_*}", mock_get.call_args[0][0])
+
+      result_map = api.get_result_map_for(pattern)
+      self.assertEqual(len(result_map), 40)
+      for ii in range(40):
+        tsid = ts_id.TimeseriesID(metric, {"machine": "extruder_%d" % ii})
+        self.assertEqual(dict(result_map[tsid]), {1234500: ii})
+      self.assertEqual(list(api.get_result_map_for(other_tsid).keys()), \
+                       [other_tsid])
+      self.assertEqual(len(api.get_result_map()), 41)
+
     #
     # RESUME HERE:
     #  1. Add more tests !!!!
     #  2. Add negative tests.
     #  3. Change error returns to exceptions.
 
+class QueryApiChunkedFetch_Tests(unittest.TestCase):
+    """Chunked fetch (flag_chunked_fetch=True) tests."""
+
+    def setUp(self):
+      self.__tsdb = hh.FakeTsdb()
+
+    def __query(self, start, end, metrics, **kwargs):
+      return self.__tsdb.query(start, end, metrics, **kwargs)
+
+    def __chunk_ranges(self):
+      return sorted(self.__tsdb.requested_ranges)
+
+    def test_split_time_range(self):
+      self.assertEqual(query_api._split_time_range(3600, 3600 * 3 + 5, 7200), \
+                       [(3600, 10799), (10800, 10805)])
+      self.assertEqual(query_api._split_time_range(0, 99, 100), [(0, 99)])
+
+    def test_same_result_as_single_query(self):
+      # 3 days, starting and ending off an hour boundary.
+      start, end = 1600000000 + 1234, 1600000000 + 3 * 86400 + 5
+      metrics = ["some_metric", "other_metric"]
+      single_api, retval = self.__query(start, end, metrics)
+      self.assertEqual(retval, 0)
+      chunked_api, retval = self.__query(start, end, metrics, \
+                                         flag_chunked_fetch=True, \
+                                         target_dps_per_chunk=2 * 3600)
+      self.assertEqual(retval, 0)
+
+      # Chunks tile the range exactly. All but the first start on an hour
+      # boundary. 2 timeseries at 1 dps per 10 secs i.e. 720 dps per hour:
+      # target_dps_per_chunk thus makes for 10 hour chunks.
+      chunk_ranges = self.__chunk_ranges()
+      self.assertEqual(chunk_ranges[0][0], start)
+      self.assertEqual(chunk_ranges[-1][1], end)
+      for (_, prev_end), (c_start, c_end) in zip(chunk_ranges, \
+                                                chunk_ranges[1:]):
+        self.assertEqual(c_start, prev_end + 1)
+        self.assertEqual(c_start % 3600, 0)
+      self.assertEqual(chunk_ranges[1][1] - chunk_ranges[1][0] + 1, 36000)
+
+      single_result = single_api.get_result_map()
+      chunked_result = chunked_api.get_result_map()
+      self.assertEqual(list(chunked_result.keys()), list(single_result.keys()))
+      for fqid, tsdd_obj in chunked_result.items():
+        self.assertEqual(list(tsdd_obj), list(single_result[fqid]))
+      result_list = chunked_api.get_result_set()
+      self.assertTrue(result_list[0].shares_timestamp_axis(result_list[1]))
+
+    def test_msec_response(self):
+      # Hour aligned chunks in msecs, whatever the unit of the time range.
+      start, end = 1600000000 + 1234, 1600000000 + 86400 + 5
+      metrics = ["some_metric"]
+      for q_start, q_end in [(start, end), (start * 1000, end * 1000)]:
+        api, retval = self.__query(q_start, q_end, metrics, \
+                                   flag_ms_response=True, \
+                                   flag_chunked_fetch=True, \
+                                   target_dps_per_chunk=2 * 360)
+        self.assertEqual(retval, 0)
+        chunk_ranges = self.__chunk_ranges()
+        self.assertEqual(len(chunk_ranges), 1 + 12)
+        self.assertEqual(chunk_ranges[0][0], start * 1000)
+        self.assertEqual(chunk_ranges[-1][1], end * 1000)
+        for (_, prev_end), (c_start, c_end) in zip(chunk_ranges, \
+                                                  chunk_ranges[1:]):
+          self.assertEqual(c_start, prev_end + 1)
+          self.assertEqual(c_start % 3600000, 0)
+        self.__tsdb.verify_result(self, api, q_start, q_end, metrics, \
+                                  flag_ms=True)
+
+    def test_sparse_data_uses_large_chunks(self):
+      start = 444444 * 3600   # On an hour boundary.
+      end = start + 3 * 86400 - 1
+      api, retval = self.__query(start, end, ["some_metric"], \
+                                 flag_chunked_fetch=True)
+      self.assertEqual(retval, 0)
+      # First hour, then chunks of MAX_CHUNK_HOURS.
+      self.assertEqual(len(self.__tsdb.requested_urls), 4)
+      self.assertEqual(len(api.get_result_set()[0]), 3 * 8640)
+
+    def test_chunk_errors(self):
+      start = 444444 * 3600   # On an hour boundary.
+      end = start + 86400 - 1
+      api, retval = self.__query(start, end, ["empty_metric"], \
+                                 flag_chunked_fetch=True)
+      self.assertEqual(retval, -3)   # No data in any chunk.
+
+      self.__tsdb.fail_url_containing = "start=%d" % (start + 3600)
+      api, retval = self.__query(start, end, ["some_metric"], \
+                                 flag_chunked_fetch=True, \
+                                 target_dps_per_chunk=360)
+      self.assertEqual(retval, -1)
+      self.assertEqual(api.http_status_code, 500)
+
+    def test_rates_are_not_split(self):
+      # Each sub range would lack its first rate (computed by OpenTSDB from
+      # the datapoint before the range), so a rate query is sent as is.
+      start = 444444 * 3600   # On an hour boundary.
+      end = start + 86400 - 1
+      cache = qcache.QueryResultCache()
+      for _ in range(2):
+        api, retval = self.__query(start, end, ["some_metric"], \
+                                   flag_compute_rate=True, \
+                                   flag_chunked_fetch=True, \
+                                   target_dps_per_chunk=360, \
+                                   query_cache=cache)
+        self.assertEqual(retval, 0)
+        self.assertEqual(self.__chunk_ranges(), [(start, end)])
+        self.assertIn("rate:some_metric", self.__tsdb.requested_urls[0])
+      self.assertEqual(cache.get_stats()['entries'], 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import query_cache as qcache
+from . import helpers as hh
+
+import time
+import unittest
+
+
+class QueryCache_Tests(unittest.TestCase):
+    def setUp(self):
+      self.__tsdb = hh.FakeTsdb()
+
+    def __query(self, cache, start, end, metrics, **kwargs):
+      return self.__tsdb.query(start, end, metrics, query_cache=cache, \
+                               **kwargs)
+
+    def __verify_result(self, api, start, end, metrics, flag_ms=False):
+      self.__tsdb.verify_result(self, api, start, end, metrics, flag_ms)
+
+    def test_range_helpers(self):
+      self.assertEqual(qcache._add_range([], 10, 20), [(10, 20)])
+      self.assertEqual(qcache._add_range([(10, 20)], 21, 30), [(10, 30)])
+      self.assertEqual(qcache._add_range([(10, 20), (40, 50)], 0, 5), \
+                       [(0, 5), (10, 20), (40, 50)])
+      self.assertEqual(qcache._add_range([(10, 20), (40, 50)], 15, 45), \
+                       [(10, 50)])
+      self.assertEqual(qcache._subtract_ranges(0, 100, []), [(0, 100)])
+      self.assertEqual(qcache._subtract_ranges(0, 100, [(10, 20), (40, 50)]), \
+                       [(0, 9), (21, 39), (51, 100)])
+      self.assertEqual(qcache._subtract_ranges(15, 45, [(10, 20), (40, 50)]), \
+                       [(21, 39)])
+      self.assertEqual(qcache._subtract_ranges(10, 20, [(0, 100)]), [])
+
+    def test_overlapping_queries_fetch_only_missing_ranges(self):
+      cache = qcache.QueryResultCache()
+      metrics = ["some_metric", "other_metric"]
+      start = 1600000000
+      api, retval = self.__query(cache, start, start + 3600, metrics)
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.requested_ranges, \
+                       [(start, start + 3600)])
+      self.__verify_result(api, start, start + 3600, metrics)
+
+      # Next window, padded into the previous one.
+      api, retval = self.__query(cache, start + 3000, start + 7200, metrics)
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.requested_ranges, \
+                       [(start + 3601, start + 7200)])
+      self.__verify_result(api, start + 3000, start + 7200, metrics)
+      self.assertEqual(api.http_status_code, 200)
+      result_list = api.get_result_set()
+      self.assertTrue(result_list[0].shares_timestamp_axis(result_list[1]))
+
+      # Entirely cached.
+      api, retval = self.__query(cache, start + 100, start + 7000, metrics)
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.requested_ranges, [])
+      self.__verify_result(api, start + 100, start + 7000, metrics)
+      self.assertEqual(api.http_status_code, 0)
+
+      # A gap in the middle, plus a timeseries not seen before.
+      api, retval = self.__query(cache, start + 20000, start + 21000, metrics)
+      api, retval = self.__query(cache, start, start + 21000, \
+                                 metrics + ["third_metric"])
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.requested_ranges, \
+                       [(start, start + 21000)])
+      api, retval = self.__query(cache, start - 1000, start + 25000, metrics)
+      self.assertEqual(self.__tsdb.requested_ranges, \
+                       [(start - 1000, start - 1), \
+                        (start + 21001, start + 25000)])
+      self.__verify_result(api, start - 1000, start + 25000, metrics)
+
+      stats = cache.get_stats()
+      self.assertEqual((stats['hits'], stats['partial_hits'], \
+                        stats['misses']), (1, 2, 3))
+      self.assertEqual(stats['entries'], 3)
+      self.assertEqual(stats['bytes'], 16 * (2 * 2601 + 2101))
+      self.assertEqual(stats['evictions'], 0)
+
+    def test_msec_response(self):
+      # Timestamps in msecs, whatever the unit of the time range queried.
+      cache = qcache.QueryResultCache()
+      metrics = ["some_metric"]
+      start = 1600000000
+      for _ in range(2):
+        api, retval = self.__query(cache, start, start + 600, metrics, \
+                                   flag_ms_response=True)
+        self.assertEqual(retval, 0)
+        self.__verify_result(api, start, start + 600, metrics, flag_ms=True)
+      self.assertEqual(self.__tsdb.requested_ranges, [])
+
+      # Time range in msecs, reaching past what's cached.
+      q_start, q_end = start * 1000 + 300000, start * 1000 + 1200999
+      api, retval = self.__query(cache, q_start, q_end, metrics, \
+                                 flag_ms_response=True)
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.requested_ranges, \
+                       [(start * 1000 + 600001, q_end)])
+      self.__verify_result(api, q_start, q_end, metrics, flag_ms=True)
+      stats = cache.get_stats()
+      self.assertEqual((stats['hits'], stats['partial_hits'], \
+                        stats['misses']), (1, 1, 1))
+      self.assertEqual(stats['bytes'], 16 * 121)
+
+    def test_eviction_by_bytes(self):
+      # Room for 2 timeseries of 1 hour (361 dps) each.
+      cache = qcache.QueryResultCache(max_bytes=2 * 361 * 16)
+      start = 1600000000
+      for metric in ["metric_1", "metric_2", "metric_1", "metric_3"]:
+        api, retval = self.__query(cache, start, start + 3600, [metric])
+        self.assertEqual(retval, 0)
+        self.__verify_result(api, start, start + 3600, [metric])
+      stats = cache.get_stats()
+      self.assertEqual(stats['evictions'], 1)
+      self.assertEqual(stats['entries'], 2)
+      self.assertLessEqual(stats['bytes'], 2 * 361 * 16)
+
+      # metric_2 was the least recently used.
+      for metric, expected_ranges in [("metric_1", []), ("metric_3", []), \
+                                      ("metric_2", [(start, start + 3600)])]:
+        self.__query(cache, start, start + 3600, [metric])
+        self.assertEqual(self.__tsdb.requested_ranges, expected_ranges)
+
+      # Too large to be cached at all: still answered.
+      api, retval = self.__query(cache, start, start + 86400, ["metric_1"])
+      self.assertEqual(retval, 0)
+      self.__verify_result(api, start, start + 86400, ["metric_1"])
+
+    def test_recent_data_is_not_cached(self):
+      cache = qcache.QueryResultCache(settle_time=600)
+      end = int(time.time())
+      start = end - 3600
+      api, retval = self.__query(cache, start, end, ["some_metric"])
+      self.assertEqual(retval, 0)
+      api, retval = self.__query(cache, start, end, ["some_metric"])
+      self.assertEqual(retval, 0)
+      self.assertEqual(len(self.__tsdb.requested_ranges), 1)
+      self.assertGreaterEqual(self.__tsdb.requested_ranges[0][0], end - 600)
+      self.__verify_result(api, start, end, ["some_metric"])
+
+    def test_no_data(self):
+      cache = qcache.QueryResultCache()
+      start = 1600000000
+      api, retval = self.__query(cache, start, start + 3600, ["empty_metric"])
+      self.assertEqual(retval, -3)
+      self.assertEqual(cache.get_stats()['entries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
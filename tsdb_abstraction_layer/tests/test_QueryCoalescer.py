@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import async_query_api as aqa
+from argus_tal import query_api
+from argus_tal import query_coalescer as qcoal
+from argus_tal import timeseries_id as ts_id
+from argus_tal import timestamp as ts
+from . import helpers as hh
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import unittest
+from unittest import mock
+
+
+def _slow_tsdb_get(url, **kwargs):
+    # Stands in for requests.Session.get. Slow enough for concurrent queries
+    # to overlap.
+    time.sleep(0.1)
+    return hh.mock_response(hh.get_good_json_response())
+
+
+class QueryCoalescer_Tests(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+      super(QueryCoalescer_Tests, self).__init__(*args, **kwargs)
+      self.__host, self.__port, self.__metric, self.__ts_filters, \
+      self.__aggregator, self.__start, self.__end = hh.get_dummy_query_params()
+
+    def __make_query(self, coalescer, start=None, api_class=None):
+      api_class = query_api.QueryApi if api_class == None else api_class
+      return api_class(self.__host, self.__port, \
+                       self.__start if start == None else start, self.__end, \
+                       [ts_id.TimeseriesID(self.__metric, self.__ts_filters)], \
+                       self.__aggregator, query_coalescer=coalescer)
+
+    def test_concurrent_calls_are_coalesced(self):
+      coalescer = qcoal.QueryCoalescer()
+      release = threading.Event()
+      fetch_calls = []
+      def fetch():
+        fetch_calls.append(1)
+        release.wait()
+        return "result"
+
+      with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(coalescer.run, "key", fetch) for _ in range(5)]
+        while coalescer.get_stats()['coalesced'] < 4:
+          time.sleep(0.01)
+        self.assertEqual(coalescer.get_stats()['in_flight'], 1)
+        release.set()
+        self.assertEqual([ff.result() for ff in futures], ["result"] * 5)
+
+      self.assertEqual(len(fetch_calls), 1)
+      self.assertEqual(coalescer.get_stats(), \
+                       {'fetches': 1, 'coalesced': 4, 'in_flight': 0})
+      # Once done, the next call fetches again.
+      self.assertEqual(coalescer.run("key", lambda: "new result"), \
+                       "new result")
+      self.assertEqual(coalescer.get_stats()['fetches'], 2)
+
+    def test_exception_is_raised_to_all_callers(self):
+      coalescer = qcoal.QueryCoalescer()
+      release = threading.Event()
+      def fetch():
+        release.wait()
+        raise RuntimeError("TSDB down")
+
+      with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(coalescer.run, "key", fetch) for _ in range(3)]
+        while coalescer.get_stats()['coalesced'] < 2:
+          time.sleep(0.01)
+        release.set()
+        for future in futures:
+          with self.assertRaises(RuntimeError):
+            future.result()
+      self.assertEqual(coalescer.get_stats()['in_flight'], 0)
+
+    def test_identical_queries_send_one_request(self):
+      coalescer = qcoal.QueryCoalescer()
+      query_list = [self.__make_query(coalescer) for _ in range(4)]
+      # A different window is a different query.
+      query_list.append(self.__make_query(coalescer, \
+                                          ts.Timestamp(self.__start.value - 1)))
+      with mock.patch('requests.Session.get', \
+                      side_effect=_slow_tsdb_get) as mock_get:
+        with ThreadPoolExecutor(max_workers=5) as pool:
+          rv_list = list(pool.map(lambda q_obj: q_obj.populate_ts_data(), \
+                                  query_list))
+      self.assertEqual(rv_list, [0] * 5)
+      self.assertEqual(mock_get.call_count, 2)
+      for q_obj in query_list:
+        self.assertEqual(dict(q_obj.get_result_set()[0]), \
+                         hh.get_sorted_datapoints())
+      # Results are shared, not the lists holding them.
+      self.assertIs(query_list[0].get_result_set()[0], \
+                    query_list[1].get_result_set()[0])
+      self.assertIsNot(query_list[0].get_result_set(), \
+                       query_list[1].get_result_set())
+
+    def test_iter_results(self):
+      coalescer = qcoal.QueryCoalescer()
+      with mock.patch('requests.Session.get', \
+                      side_effect=_slow_tsdb_get) as mock_get:
+        with ThreadPoolExecutor(max_workers=3) as pool:
+          result_lists = list(pool.map( \
+              lambda q_obj: list(q_obj.iter_results()), \
+              [self.__make_query(coalescer) for _ in range(3)]))
+      self.assertEqual(mock_get.call_count, 1)
+      for tsdd_list in result_lists:
+        self.assertEqual(dict(tsdd_list[0]), hh.get_sorted_datapoints())
+
+    def test_asyncio_queries(self):
+      coalescer = qcoal.QueryCoalescer()
+      query_list = [self.__make_query(coalescer, api_class=aqa.AsyncQueryApi) \
+                    for _ in range(6)]
+      with mock.patch('requests.Session.get', \
+                      side_effect=_slow_tsdb_get) as mock_get:
+        rv_list = asyncio.run(aqa.gather_queries(query_list, \
+                                                 max_concurrency=6))
+      self.assertEqual(rv_list, [0] * 6)
+      self.assertEqual(mock_get.call_count, 1)
+      self.assertEqual(coalescer.get_stats()['coalesced'], 5)
+
+    def test_default_coalescer(self):
+      default_coalescer = qcoal.get_default_coalescer()
+      self.assertIs(qcoal.get_default_coalescer(), default_coalescer)
+      new_coalescer = qcoal.QueryCoalescer()
+      qcoal.set_default_coalescer(new_coalescer)
+      try:
+        self.assertIs(qcoal.get_default_coalescer(), new_coalescer)
+      finally:
+        qcoal.set_default_coalescer(default_coalescer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import exceptions as excp
+from argus_tal import query_api
+from argus_tal import request_policy as rpol
+from argus_tal import timeseries_id as ts_id
+from . import helpers as hh
+
+import requests
+import threading
+import unittest
+from unittest import mock
+
+
+class RequestPolicy_Tests(unittest.TestCase):
+    def setUp(self):
+      self.__host, self.__port, self.__metric, self.__query_filters, \
+        self.__aggregator, IGNORED, IGNORED = hh.get_dummy_query_params()
+      # host -> list of (delay in secs, HTTP status) of its next responses.
+      self.__responses = {}
+      self.__requests = []          # (host, timeout) of each request.
+      self.__lock = threading.Lock()
+      self.__release = threading.Event()
+      self.addCleanup(self.__release.set)
+
+    def __mocked_requests_get(self, url, **kwargs):
+      host = hh.parse.urlparse(url).hostname
+      timeout = kwargs.get('timeout')
+      with self.__lock:
+        self.__requests.append((host, timeout))
+        delay, status_code = self.__responses[host].pop(0)
+      # Emulates requests: no response within the timeout raises.
+      if self.__release.wait(delay if timeout == None else min(delay, \
+                                                                timeout)):
+        raise requests.exceptions.ConnectionError("Test is over")
+      if timeout != None and delay > timeout:
+        raise requests.exceptions.ReadTimeout("Timed out")
+      return hh.mock_response(hh.get_fake_tsdb_json_response(url, 10), \
+                              status_code)
+
+    def __query(self, policy, **kwargs):
+      start = 1600000000
+      api = query_api.QueryApi(self.__host, self.__port, \
+                               hh.ts.Timestamp(start), \
+                               hh.ts.Timestamp(start + 60), \
+                               [ts_id.TimeseriesID(self.__metric, \
+                                                   self.__query_filters)], \
+                               self.__aggregator, request_policy=policy, \
+                               **kwargs)
+      with mock.patch('requests.Session.get', \
+                      side_effect=self.__mocked_requests_get):
+        retval = api.populate_ts_data()
+      return api, retval
+
+    def test_deadline(self):
+      policy = rpol.RequestPolicy(deadline=0.2, max_retries=0)
+      self.__responses[self.__host] = [(5, 200)]
+      api, retval = self.__query(policy)
+      self.assertEqual(retval, -4)
+      self.assertEqual(api.http_status_code, 0)
+      self.assertLessEqual(self.__requests[0][1], 0.2)
+      self.assertLess(api.query_telemetry['request_secs'], 1)
+      self.assertEqual(policy.get_stats()['failures'], 1)
+
+      # Also for iter_results().
+      self.__responses[self.__host] = [(5, 200)]
+      api = query_api.QueryApi(self.__host, self.__port, \
+                               hh.ts.Timestamp(1600000000), \
+                               hh.ts.Timestamp(1600000060), \
+                               [ts_id.TimeseriesID(self.__metric, \
+                                                   self.__query_filters)], \
+                               self.__aggregator, request_policy=policy)
+      with mock.patch('requests.Session.get', \
+                      side_effect=self.__mocked_requests_get):
+        with self.assertRaises(excp.QueryFailed) as context:
+          list(api.iter_results())
+      self.assertEqual(context.exception.error_code, -4)
+
+    def test_retries(self):
+      policy = rpol.RequestPolicy(max_retries=2, backoff_base=0.01, \
+                                  alternate_endpoints=[("10.0.0.2", 4242)])
+      self.__responses[self.__host] = [(0, 503), (0, 200)]
+      self.__responses["10.0.0.2"] = [(0, 200)]
+      api, retval = self.__query(policy)
+      self.assertEqual(retval, 0)
+      # The retry went to the other endpoint.
+      self.assertEqual([host for host, _ in self.__requests], \
+                       [self.__host, "10.0.0.2"])
+      self.assertEqual(api.query_telemetry['requests'], 2)
+      self.assertEqual(api.query_telemetry['retries'], 1)
+
+      # Retries exhausted: the last response is used.
+      self.__responses[self.__host] = [(0, 500), (0, 500)]
+      self.__responses["10.0.0.2"] = [(0, 502)]
+      api, retval = self.__query(policy)
+      self.assertEqual(retval, -1)
+      self.assertEqual(api.http_status_code, 500)
+      self.assertEqual(api.query_telemetry['retries'], 2)
+
+      # Not worth a retry.
+      self.__responses[self.__host] = [(0, 400)]
+      api, retval = self.__query(policy)
+      self.assertEqual(api.query_telemetry['retries'], 0)
+      self.assertEqual(policy.get_stats()['retries'], 3)
+
+    def test_hedged_request(self):
+      policy = rpol.RequestPolicy(flag_hedge=True, hedge_delay=0.05, \
+                                  alternate_endpoints=[("10.0.0.2", 4242)])
+      self.__responses[self.__host] = [(5, 200)]
+      self.__responses["10.0.0.2"] = [(0, 200)]
+      api, retval = self.__query(policy)
+      self.assertEqual(retval, 0)
+      self.assertEqual(len(api.get_result_set()), 1)
+      self.assertEqual(api.query_telemetry['hedges'], 1)
+      self.assertEqual(api.query_telemetry['hedge_wins'], 1)
+      self.assertLess(api.query_telemetry['request_secs'], 1)
+
+      # A fast response: no hedge.
+      self.__responses[self.__host] = [(0, 200)]
+      api, retval = self.__query(policy)
+      self.assertEqual(retval, 0)
+      self.assertEqual(api.query_telemetry['hedges'], 0)
+
+    def test_hedge_delay_is_observed_p95(self):
+      policy = rpol.RequestPolicy(flag_hedge=True, min_latency_samples=5)
+      self.__responses[self.__host] = [(0, 200)] * 5 + [(5, 200), (0, 200)]
+      for _ in range(5):
+        api, retval = self.__query(policy)
+        self.assertEqual(api.query_telemetry['hedges'], 0)
+      self.assertLess(policy.get_stats()['latency_p95'], 0.5)
+      # Slower than the p95: hedged (to the same endpoint).
+      api, retval = self.__query(policy)
+      self.assertEqual(retval, 0)
+      self.assertEqual(api.query_telemetry['hedge_wins'], 1)
+      self.assertEqual(policy.get_stats()['queries'], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import ring_buffer_timeseries as rbt
+from argus_tal import timeseries_datadict as tsd
+from argus_tal import timeseries_id as tid
+from argus_tal.timeseries_datadict import LookupQualifier as LQ
+from . import helpers as hh
+import numpy as np
+import unittest
+
+
+class RingBufferTimeseries_Tests(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+      super(RingBufferTimeseries_Tests, self).__init__(*args, **kwargs)
+      self.__host, self.__port, self.__metric, self.__ts_filters, \
+      self.__qualifier, self.__start, self.__end = hh.get_dummy_query_params()
+      self.__tsid = tid.TimeseriesID(self.__metric, self.__ts_filters)
+      self.__tsdd = tsd.TimeseriesDataDict(self.__tsid, \
+                                           hh.get_sorted_datapoints())
+
+    def __assertHolds(self, rb_ts, keys, values):
+      self.assertEqual(len(rb_ts), len(keys))
+      self.assertEqual(list(rb_ts), list(zip(keys, values)))
+
+    def test_append_and_lookup(self):
+      rb_ts = rbt.RingBufferTimeseries(self.__tsid, capacity=100)
+      self.assertTrue(rb_ts.is_empty())
+      empty_tsdd = tsd.TimeseriesDataDict(self.__tsid, {})
+      for get_key in ["get_min_key", "get_max_key"]:
+        with self.assertRaises(IndexError):
+          getattr(empty_tsdd, get_key)()
+        with self.assertRaises(IndexError):
+          getattr(rb_ts, get_key)()
+      for timestamp, value in self.__tsdd:
+        self.assertTrue(rb_ts.append(timestamp, value))
+      self.__assertHolds(rb_ts, list(self.__tsdd.get_timestamps()), \
+                         list(self.__tsdd.get_values()))
+      self.assertEqual(rb_ts.get_timeseries_id(), self.__tsid)
+      self.assertEqual(rb_ts.get_min_key(), self.__tsdd.get_min_key())
+      self.assertEqual(rb_ts.get_max_key(), self.__tsdd.get_max_key())
+
+      # Lookups behave exactly as they do on an equivalent TimeseriesDataDict.
+      probe_timestamps = np.arange(self.__tsdd.get_min_key() - 5, \
+                                   self.__tsdd.get_max_key() + 6)
+      for qualifier in LQ:
+        with self.subTest(msg=str(qualifier)):
+          for timestamp in probe_timestamps:
+            self.assertEqual(rb_ts.get_datapoint(timestamp, qualifier), \
+                             self.__tsdd.get_datapoint(timestamp, qualifier))
+          for actual, expected in \
+              zip(rb_ts.get_datapoints(probe_timestamps, qualifier), \
+                  self.__tsdd.get_datapoints(probe_timestamps, qualifier)):
+            np.testing.assert_array_equal(actual, expected)
+
+    def test_stale_datapoints_are_dropped(self):
+      rb_ts = rbt.RingBufferTimeseries(self.__tsid, capacity=100)
+      self.assertEqual(rb_ts.extend([10, 20, 30], [1, 2, 3]), 3)
+      self.assertFalse(rb_ts.append(30, 33))
+      self.assertFalse(rb_ts.append(25, 25))
+      # An overlapping re-query only adds the datapoints that are new.
+      self.assertEqual(rb_ts.extend([20, 30, 40, 50], [2, 3, 4, 5]), 2)
+      self.__assertHolds(rb_ts, [10, 20, 30, 40, 50], [1, 2, 3, 4, 5])
+
+    def test_eviction_by_count(self):
+      rb_ts = rbt.RingBufferTimeseries(self.__tsid, capacity=4)
+      # Enough appends to go through several compactions.
+      for timestamp in range(1, 20):
+        rb_ts.append(timestamp, timestamp * 10)
+        expected_keys = list(range(max(1, timestamp - 3), timestamp + 1))
+        self.__assertHolds(rb_ts, expected_keys, \
+                           [key * 10 for key in expected_keys])
+      # A single extend larger than capacity keeps the newest datapoints.
+      self.assertEqual(rb_ts.extend(range(100, 110), range(10)), 10)
+      self.__assertHolds(rb_ts, [106, 107, 108, 109], [6, 7, 8, 9])
+
+    def test_eviction_by_time(self):
+      rb_ts = rbt.RingBufferTimeseries(self.__tsid, capacity=100, max_age=20)
+      rb_ts.extend([10, 20, 30], [1, 2, 3])
+      self.__assertHolds(rb_ts, [10, 20, 30], [1, 2, 3])
+      rb_ts.append(45, 4)
+      self.__assertHolds(rb_ts, [30, 45], [3, 4])
+
+      self.assertEqual(rb_ts.evict_before(40), 1)
+      self.__assertHolds(rb_ts, [45], [4])
+      self.assertEqual(rb_ts.evict_before(100), 1)
+      self.assertTrue(rb_ts.is_empty())
+      # As for an empty TimeseriesDataDict.
+      with self.assertRaises(IndexError):
+        rb_ts.get_min_key()
+      with self.assertRaises(IndexError):
+        rb_ts.get_max_key()
+      # Once empty, any timestamp is accepted again.
+      self.assertTrue(rb_ts.append(5, 5))
+
+    def test_snapshot_is_frozen(self):
+      rb_ts = rbt.RingBufferTimeseries(self.__tsid, capacity=3)
+      rb_ts.extend([1, 2, 3], [10, 20, 30])
+      snapshot = rb_ts.snapshot()
+      self.assertIs(rb_ts.snapshot(), snapshot)   # No change, no new object.
+
+      # Force evictions and compactions, which must not affect the snapshot.
+      for timestamp in range(4, 20):
+        rb_ts.append(timestamp, timestamp * 10)
+      self.assertIsNot(rb_ts.snapshot(), snapshot)
+      self.assertEqual(list(snapshot), [(1, 10), (2, 20), (3, 30)])
+      self.assertFalse(snapshot.get_timestamps().flags.writeable)
+      self.assertEqual(list(rb_ts.snapshot()), [(17, 170), (18, 180), \
+                                                (19, 190)])
+
+    def test_append_while_iterating(self):
+      rb_ts = rbt.RingBufferTimeseries(self.__tsid, capacity=3)
+      rb_ts.extend([1, 2, 3], [10, 20, 30])
+      seen = []
+      for timestamp, value in rb_ts:
+        seen.append(timestamp)
+        rb_ts.append(timestamp + 100, value)
+      self.assertEqual(seen, [1, 2, 3])
+      self.__assertHolds(rb_ts, [101, 102, 103], [10, 20, 30])
+
+    def test_window(self):
+      rb_ts = rbt.RingBufferTimeseries(self.__tsid, capacity=100)
+      rb_ts.extend(self.__tsdd.get_timestamps(), self.__tsdd.get_values())
+      k_0 = self.__tsdd.get_min_key()
+      args = (k_0 + 5, LQ.NEAREST_LARGER, k_0 + 35, LQ.NEAREST_SMALLER)
+      self.assertEqual(list(rb_ts.window(*args)), \
+                       list(self.__tsdd.window(*args)))
+      self.assertEqual(rb_ts.get_iter_slice(*args), \
+                       self.__tsdd.get_iter_slice(*args))
+
+
+if __name__ == '__main__':
+    unittest.main()
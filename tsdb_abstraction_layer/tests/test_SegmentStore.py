@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import query_cache as qcache
+from argus_tal import segment_store as sstore
+from . import helpers as hh
+
+import numpy as np
+import os
+import tempfile
+import time
+import unittest
+
+
+class SegmentStore_Tests(unittest.TestCase):
+    def setUp(self):
+      self.__tsdb = hh.FakeTsdb()
+      self.__tmp_dir = tempfile.TemporaryDirectory()
+      self.__store_dir = os.path.join(self.__tmp_dir.name, "segments")
+
+    def tearDown(self):
+      self.__tmp_dir.cleanup()
+
+    def __query(self, start, end, metrics, **kwargs):
+      return self.__tsdb.query(start, end, metrics, **kwargs)
+
+    def __verify_result(self, api, start, end, metrics, flag_ms=False):
+      self.__tsdb.verify_result(self, api, start, end, metrics, flag_ms)
+
+    def test_sealed_blocks_are_fetched_once(self):
+      for flag_compress in [False, True]:
+        with self.subTest(msg="compressed" if flag_compress else "mmapped"):
+          store_dir = os.path.join(self.__store_dir, str(flag_compress))
+          store = sstore.SegmentStore(store_dir, flag_compress=flag_compress)
+          metrics = ["some_metric", "other_metric"]
+          start, end = 1600000000 + 1234, 1600000000 + 3 * 3600 + 5
+          api, retval = self.__query(start, end, metrics, segment_store=store)
+          self.assertEqual(retval, 0)
+          # Whole, hour aligned, blocks are fetched.
+          self.assertEqual(self.__tsdb.requested_ranges, \
+                           [(1599998400, 1600012799)])
+          self.__verify_result(api, start, end, metrics)
+          self.assertEqual(store.get_stats()['blocks'], 2 * 4)
+
+          # Next run: nothing fetched.
+          store = sstore.SegmentStore(store_dir, flag_compress=flag_compress)
+          self.assertEqual(store.get_stats()['blocks'], 2 * 4)
+          api, retval = self.__query(start, end - 3600, metrics, \
+                                     segment_store=store)
+          self.assertEqual(retval, 0)
+          self.assertEqual(self.__tsdb.requested_ranges, [])
+          self.__verify_result(api, start, end - 3600, metrics)
+          self.assertEqual(store.get_stats()['block_hits'], 3)
+          # Data within 1 block is used straight from the block's file.
+          api, retval = self.__query(start, start + 60, metrics, \
+                                     segment_store=store)
+          self.assertEqual(retval, 0)
+          self.assertEqual(isinstance( \
+              api.get_result_set()[0].get_values().base, np.memmap), \
+              not flag_compress)
+
+    def test_msec_response(self):
+      # Timestamps in msecs, whatever the unit of the time range queried.
+      store = sstore.SegmentStore(self.__store_dir)
+      metrics = ["some_metric"]
+      start, end = 1600000000 + 1234, 1600000000 + 3 * 3600 + 5
+      api, retval = self.__query(start, end, metrics, segment_store=store, \
+                                 flag_ms_response=True)
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.requested_ranges, \
+                       [(1599998400000, 1600012799999)])
+      self.__verify_result(api, start, end, metrics, flag_ms=True)
+      self.assertEqual(store.get_stats()['blocks'], 4)
+
+      for q_start, q_end in [(start, end), (start * 1000 + 1, end * 1000)]:
+        api, retval = self.__query(q_start, q_end, metrics, \
+                                   segment_store=store, flag_ms_response=True)
+        self.assertEqual(retval, 0)
+        self.assertEqual(self.__tsdb.requested_ranges, [])
+        self.__verify_result(api, q_start, q_end, metrics, flag_ms=True)
+      self.assertEqual(store.get_stats()['block_hits'], 2 * 4)
+
+    def test_recent_blocks_are_not_stored(self):
+      store = sstore.SegmentStore(self.__store_dir, ingestion_delay=600)
+      end = int(time.time())
+      start = end - 3 * 3600
+      for _ in range(2):
+        api, retval = self.__query(start, end, ["some_metric"], \
+                                   segment_store=store)
+        self.assertEqual(retval, 0)
+        self.__verify_result(api, start, end, ["some_metric"])
+      # Only the recent part is fetched the 2nd time round.
+      self.assertEqual(len(self.__tsdb.requested_ranges), 1)
+      self.assertGreaterEqual(self.__tsdb.requested_ranges[0][0], \
+                              end - 3600 - 600)
+      self.assertEqual(self.__tsdb.requested_ranges[0][1], end)
+
+    def test_blocks_without_data(self):
+      store = sstore.SegmentStore(self.__store_dir)
+      start = 444444 * 3600   # On an hour boundary.
+      for _ in range(2):
+        api, retval = self.__query(start, start + 3599, ["empty_metric"], \
+                                   segment_store=store)
+        self.assertEqual(retval, -3)
+      self.assertEqual(store.get_stats()['block_hits'], 1)
+
+    def test_lru_eviction(self):
+      start = 444444 * 3600
+      # Each block: 360 dps, plus its index. Room for 3 blocks.
+      block_size = 360 * 16 + 200
+      store = sstore.SegmentStore(self.__store_dir, \
+                                  max_bytes=3 * block_size + 1000)
+      for block_num in [0, 1, 2, 0, 3]:
+        b_start = start + block_num * 3600
+        self.__query(b_start, b_start + 3599, ["some_metric"], \
+                     segment_store=store)
+      stats = store.get_stats()
+      self.assertEqual(stats['blocks'], 3)
+      self.assertEqual(stats['evictions'], 1)
+      self.assertLessEqual(stats['bytes'], 3 * block_size + 1000)
+
+      # Block 1 was the least recently used (block 0 was used again).
+      for block_num, num_fetches in [(0, 0), (3, 0), (1, 1)]:
+        b_start = start + block_num * 3600
+        self.__query(b_start, b_start + 3599, ["some_metric"], \
+                     segment_store=store)
+        self.assertEqual(len(self.__tsdb.requested_ranges), num_fetches)
+
+    def test_with_query_cache(self):
+      store = sstore.SegmentStore(self.__store_dir)
+      cache = qcache.QueryResultCache()
+      start = 1600000000 + 100
+      api, retval = self.__query(start, start + 600, ["some_metric"], \
+                                 segment_store=store, query_cache=cache)
+      self.assertEqual(retval, 0)
+      self.__verify_result(api, start, start + 600, ["some_metric"])
+      api, retval = self.__query(start + 300, start + 900, ["some_metric"], \
+                                 segment_store=store, query_cache=cache)
+      self.assertEqual(retval, 0)
+      self.assertEqual(self.__tsdb.requested_ranges, [])
+      self.__verify_result(api, start + 300, start + 900, ["some_metric"])
+      self.assertEqual(cache.get_stats()['partial_hits'], 1)
+      self.assertEqual(store.get_stats()['block_hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import streaming_decoder as sdec
+from . import helpers as hh
+
+import json
+import unittest
+
+
+def _split(body, chunk_size):
+    return [body[ii:ii + chunk_size] for ii in range(0, len(body), chunk_size)]
+
+
+class StreamingDecoder_Tests(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+      super(StreamingDecoder_Tests, self).__init__(*args, **kwargs)
+      self.__response = hh.get_multi_metric_json_response()
+      # Non dps fields of all kinds, non ASCII text and a dps in list form
+      # (arrays=true), which is decoded like any other field.
+      self.__response.append({"metric": u"température", "tags": {}, \
+                              "aggregateTags": [], "query": {"index": 3}, \
+                              "dps": [[1234510, 1.5], [1234520, -2]]})
+      self.__response.append({"metric": "empty", "tags": {"a": "b"}, \
+                              "aggregateTags": [], "dps": {}})
+
+    def __verify_series(self, series, expected):
+      self.assertEqual({kk: vv for kk, vv in series.items() if kk != 'dps'}, \
+                       {kk: vv for kk, vv in expected.items() if kk != 'dps'})
+      if isinstance(expected['dps'], dict):
+        self.assertIsInstance(series['dps'], sdec.DpsColumns)
+        self.assertEqual(list(series['dps'].timestamps), \
+                         [int(kk) for kk in expected['dps'].keys()])
+        self.assertEqual(list(series['dps'].values), \
+                         list(expected['dps'].values()))
+      else:
+        self.assertEqual(series['dps'], expected['dps'])
+
+    def test_any_chunking(self):
+      for indent in [None, 2]:
+        body = json.dumps(self.__response, indent=indent).encode('utf-8')
+        for chunk_size in [1, 2, 7, 64, len(body)]:
+          with self.subTest(msg="indent %s, chunk size %d" % \
+                            (indent, chunk_size)):
+            series_list = list(sdec.iter_series(_split(body, chunk_size)))
+            self.assertEqual(len(series_list), len(self.__response))
+            for series, expected in zip(series_list, self.__response):
+              self.__verify_series(series, expected)
+
+    def test_series_are_yielded_as_decoded(self):
+      body = json.dumps(self.__response).encode('utf-8')
+      chunks_read = []
+      def chunk_iter():
+        for chunk in _split(body, 16):
+          chunks_read.append(chunk)
+          yield chunk
+      series_iter = sdec.iter_series(chunk_iter())
+      next(series_iter)
+      self.assertLess(len(chunks_read), len(body) // 16 // 2)
+
+    def test_empty_response(self):
+      self.assertEqual(list(sdec.iter_series([b' [ ] '])), [])
+
+    def test_malformed_response(self):
+      good_body = json.dumps(self.__response).encode('utf-8')
+      sub_testcase_data = [
+        ("truncated in dps", good_body[:60]),
+        ("truncated", good_body[:-1]),
+        ("not an array", b'{"error": "oops"}'),
+        ("trailing data", good_body + b'[]'),
+        ("bad datapoint", b'[{"dps": {"1234510": oops}}]'),
+        ("empty", b''),
+      ]
+      for label, body in sub_testcase_data:
+        with self.subTest(msg=label):
+          with self.assertRaises(ValueError):
+            list(sdec.iter_series(_split(body, 16)))
+
+
+if __name__ == '__main__':
+    unittest.main()
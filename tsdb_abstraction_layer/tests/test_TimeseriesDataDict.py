@@ -5,6 +5,7 @@ from argus_tal import timeseries_datadict as tsd
 from argus_tal import timeseries_id as tid
 from . import helpers as hh
 import itertools
+import numpy as np
 import unittest
 
 
@@ -134,9 +135,8 @@ class TsDataDict_Tests(unittest.TestCase):
         tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
       self.__verify_full_iteration(ts_dd)
 
-    # By design, the iterate operation creates state in the object (i.e it has
-    # side effects). We want to ascertain that any side effects from prev
-    # iteration are cleaned up (i.e. iteration is idempotent).
+    # Each iteration runs on its own cursor. We want to ascertain that nothing
+    # carries over from a previous iteration (i.e. iteration is idempotent).
     def test_iterator_repeated_iterations(self):
       ts_dd = tsd.TimeseriesDataDict( \
         tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
@@ -373,5 +373,341 @@ class TsDataDict_Tests(unittest.TestCase):
       # verify keys
       self.assertEqual(keys_returned, sorted(self.__sorted_dps.keys()))
 
+    ###########################################################################
+    # Columnar (array) access tests.
+    ###########################################################################
+    def test_columnar_arrays_UNsorted_dataset(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__UNsorted_dps)
+      expected_keys = sorted(self.__UNsorted_dps.keys())
+      self.assertEqual(list(ts_dd.get_timestamps()), expected_keys)
+      self.assertEqual(list(ts_dd.get_values()), \
+                       [self.__UNsorted_dps[kk] for kk in expected_keys])
+
+    def test_columnar_arrays_are_read_only(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      with self.assertRaises(ValueError):
+        ts_dd.get_timestamps()[0] = 0
+      with self.assertRaises(ValueError):
+        ts_dd.get_values()[0] = 0
+
+    def test_duplicate_keys_last_value_wins(self):
+      # "1234510" and 1234510 are the same timestamp.
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), \
+        {1234520: 20, 1234510: 10, "1234510": 11})
+      self.assertEqual(len(ts_dd), 2)
+      self.assertEqual([dp for dp in ts_dd], [(1234510, 11), (1234520, 20)])
+
+    def test_lookup_on_empty_dps(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), {})
+      for qualifier in tsd.LookupQualifier:
+        with self.subTest(msg=qualifier.name):
+          self.assertEqual(ts_dd.get_datapoint(self.__k_0, qualifier), \
+                           (self.__k_0, None))
+
+    ###########################################################################
+    # Vectorized (batch) lookup tests. get_datapoints() must agree with
+    # get_datapoint() for every row of the lookup qualifier test matrix.
+    ###########################################################################
+    def test_batch_lookup_matches_single_lookup(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      input_keys = [self.__k_lt_k_0, self.__k_gt_k_Max, self.__k_0, \
+                    self.__k_Max, self.__k_Arb, self.__k_betn_0_and_1, \
+                    self.__k_betn_Max_minus_1_and_Max, self.__k_betn_i_and_j]
+      for qualifier in tsd.LookupQualifier:
+        with self.subTest(msg=qualifier.name):
+          res_keys, res_values, miss_mask = \
+              ts_dd.get_datapoints(input_keys, qualifier)
+          for ii, input_key in enumerate(input_keys):
+            kk, vv = ts_dd.get_datapoint(input_key, qualifier)
+            self.assertEqual(res_keys[ii], kk)
+            self.assertEqual(miss_mask[ii], vv is None)
+            if vv is not None:
+              self.assertEqual(res_values[ii], vv)
+
+    def test_batch_lookup_on_empty_dps(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), {})
+      res_keys, res_values, miss_mask = ts_dd.get_datapoints( \
+          [self.__k_0, self.__k_Max], tsd.LookupQualifier.NEAREST_SMALLER_WEAK)
+      self.assertEqual(list(res_keys), [self.__k_0, self.__k_Max])
+      self.assertTrue(all(miss_mask))
+
+    ###########################################################################
+    # Window (view) tests.
+    ###########################################################################
+    def test_window_matches_iter_slice(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      win = ts_dd.window(self.__k_betn_0_and_1, \
+                         tsd.LookupQualifier.NEAREST_LARGER, \
+                         self.__k_Max_minus_1, tsd.LookupQualifier.EXACT_MATCH)
+      idx1, idx2 = ts_dd.get_iter_slice( \
+          self.__k_betn_0_and_1, tsd.LookupQualifier.NEAREST_LARGER, \
+          self.__k_Max_minus_1, tsd.LookupQualifier.EXACT_MATCH)
+      self.assertEqual(list(win), list(itertools.islice(ts_dd, idx1, idx2+1)))
+      self.assertEqual(len(win), idx2 - idx1 + 1)
+      self.assertEqual(win.get_timeseries_id(), ts_dd.get_timeseries_id())
+      self.assertEqual((win.get_min_key(), win.get_max_key()), \
+                       (self.__k_1, self.__k_Max_minus_1))
+
+    def test_window_lookups_are_bounded_by_window(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      win = ts_dd.window(self.__k_1, tsd.LookupQualifier.EXACT_MATCH, \
+                         self.__k_Max_minus_1, tsd.LookupQualifier.EXACT_MATCH)
+      # k_0 is outside the window, hence nothing is smaller than k_1 ...
+      self.assertEqual( \
+          win.get_datapoint(self.__k_1, tsd.LookupQualifier.NEAREST_SMALLER), \
+          (self.__k_1, None))
+      # ... and WEAK lookups clamp to the window boundary.
+      self.assertEqual( \
+          win.get_datapoint(self.__k_gt_k_Max, \
+                            tsd.LookupQualifier.NEAREST_LARGER_WEAK), \
+          (self.__k_Max_minus_1, self.__v_Max_minus_1))
+
+    def test_nested_window_shares_storage(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      win = ts_dd.window(self.__k_1, tsd.LookupQualifier.EXACT_MATCH, \
+                         self.__k_Max_minus_1, tsd.LookupQualifier.EXACT_MATCH)
+      inner_win = win.window(self.__k_Arb, tsd.LookupQualifier.EXACT_MATCH, \
+                             self.__k_Arb, tsd.LookupQualifier.EXACT_MATCH)
+      self.assertEqual(list(inner_win), [(self.__k_Arb, self.__v_Arb)])
+      self.assertTrue(np.shares_memory(inner_win.get_timestamps(), \
+                                       ts_dd.get_timestamps()))
+      self.assertTrue(np.shares_memory(inner_win.get_values(), \
+                                       ts_dd.get_values()))
+
+    def test_window_unresolved_bounds_is_empty(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      sub_testcase_data = [
+         # sub-test label, key1, lookup_qual1, key2, lookup_qual2
+         ("no exact match", self.__k_betn_0_and_1, \
+                tsd.LookupQualifier.EXACT_MATCH, \
+                self.__k_Max, tsd.LookupQualifier.EXACT_MATCH), \
+         ("inverted bounds", self.__k_Max, tsd.LookupQualifier.EXACT_MATCH, \
+                self.__k_0, tsd.LookupQualifier.EXACT_MATCH), \
+      ]
+      for test_label, key1, lk_qual1, key2, lk_qual2 in sub_testcase_data:
+        with self.subTest(msg=test_label):
+          win = ts_dd.window(key1, lk_qual1, key2, lk_qual2)
+          self.assertTrue(win.is_empty())
+          self.assertEqual(list(win), [])
+
+    ###########################################################################
+    # Cursor tests.
+    ###########################################################################
+    def test_nested_iterations_are_independent(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      pairs_returned = []
+      for k_outer, v_outer in ts_dd:
+        for k_inner, v_inner in ts_dd:
+          pairs_returned.append((k_outer, k_inner))
+      expected_keys = sorted(self.__sorted_dps.keys())
+      self.assertEqual(pairs_returned, \
+                       list(itertools.product(expected_keys, expected_keys)))
+
+    def test_cursor_reverse_iteration(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      self.assertEqual(list(ts_dd.cursor(reverse=True)), \
+                       list(reversed(list(ts_dd))))
+
+    def test_cursor_seek(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      sub_testcase_data = [
+         # sub-test label, reverse, input key, lookup qualifier, expected dps
+         ("fwd EXACT_MATCH", False, self.__k_Max_minus_1, \
+                tsd.LookupQualifier.EXACT_MATCH, \
+                [(self.__k_Max_minus_1, self.__v_Max_minus_1), \
+                 (self.__k_Max, self.__v_Max)]), \
+         ("rev NEAREST_SMALLER", True, self.__k_betn_0_and_1, \
+                tsd.LookupQualifier.NEAREST_SMALLER, \
+                [(self.__k_0, self.__v_0)]), \
+         ("fwd seek fails", False, self.__k_gt_k_Max, \
+                tsd.LookupQualifier.NEAREST_LARGER, []), \
+         ("rev seek fails", True, self.__k_0, \
+                tsd.LookupQualifier.NEAREST_SMALLER, []), \
+      ]
+      for test_label, reverse, key, lk_qual, expected_dps in sub_testcase_data:
+        with self.subTest(msg=test_label):
+          cursor = ts_dd.cursor(reverse=reverse)
+          self.assertEqual(cursor.seek(key, lk_qual), len(expected_dps) > 0)
+          self.assertEqual(list(cursor), expected_dps)
+          self.assertTrue(cursor.is_exhausted())
+
+    def test_cursor_iter_chunks(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      for reverse in [False, True]:
+        with self.subTest(msg="reverse=%s" % reverse):
+          chunks = list(ts_dd.cursor(reverse=reverse).iter_chunks(3))
+          self.assertEqual([len(kk) for kk, vv in chunks], [3, 3, 1])
+          dps_returned = [(int(kk), float(vv)) for keys_arr, values_arr \
+                            in chunks for kk, vv in zip(keys_arr, values_arr)]
+          self.assertEqual(dps_returned, list(ts_dd.cursor(reverse=reverse)))
+
+    ###########################################################################
+    # Alternate constructor tests: from_arrays() and from_dps_payload().
+    ###########################################################################
+    def test_from_arrays(self):
+      for test_label, dps in [("sorted", self.__sorted_dps), \
+                              ("UNsorted", self.__UNsorted_dps)]:
+        with self.subTest(msg=test_label):
+          timestamps = np.array(list(dps.keys()))
+          ts_dd = tsd.TimeseriesDataDict.from_arrays( \
+            tid.TimeseriesID(self.__metric, self.__ts_filters), \
+            timestamps, list(dps.values()))
+          self.__verify_full_iteration(ts_dd)
+          # Caller's array must be left untouched.
+          self.assertEqual(list(timestamps), list(dps.keys()))
+          self.assertTrue(timestamps.flags.writeable)
+
+    def test_from_dps_payload(self):
+      json_dps = hh.get_good_json_response()[0]['dps']
+      sub_testcase_data = [
+         # sub-test label, dps payload
+         ("dict payload", json_dps), \
+         ("arrays payload", [[int(kk), vv] for kk, vv in json_dps.items()]), \
+         ("empty payload", {}), \
+      ]
+      for test_label, dps_payload in sub_testcase_data:
+        with self.subTest(msg=test_label):
+          ts_dd = tsd.TimeseriesDataDict.from_dps_payload( \
+            tid.TimeseriesID(self.__metric, self.__ts_filters), dps_payload)
+          if len(dps_payload) == 0:
+            self.assertTrue(ts_dd.is_empty())
+          else:
+            self.__verify_full_iteration(ts_dd)
+
+    ###########################################################################
+    # Shared timestamp axis and alignment tests.
+    ###########################################################################
+    def test_share_timestamp_axes(self):
+      tsdd_a = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID("metric_a", self.__ts_filters), self.__sorted_dps)
+      tsdd_b = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID("metric_b", self.__ts_filters), self.__UNsorted_dps)
+      tsdd_c = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID("metric_c", self.__ts_filters), \
+        hh.get_datapoint_slice(1, 4))
+      self.assertFalse(tsdd_a.shares_timestamp_axis(tsdd_b))
+
+      shared_list = tsd.share_timestamp_axes([tsdd_a, tsdd_b, tsdd_c])
+      self.assertEqual([tt.get_timeseries_id() for tt in shared_list], \
+                       [tt.get_timeseries_id() for tt in \
+                        [tsdd_a, tsdd_b, tsdd_c]])
+      self.assertIs(shared_list[0], tsdd_a)
+      self.assertTrue(shared_list[0].shares_timestamp_axis(shared_list[1]))
+      self.assertFalse(shared_list[0].shares_timestamp_axis(shared_list[2]))
+      self.assertEqual(list(shared_list[1]), list(tsdd_b))
+
+      # Windows with identical bounds over a shared axis share it too.
+      win_a, win_b = [tt.window(self.__k_1, tsd.LookupQualifier.EXACT_MATCH, \
+                                self.__k_Arb, tsd.LookupQualifier.EXACT_MATCH) \
+                      for tt in shared_list[:2]]
+      self.assertTrue(win_a.shares_timestamp_axis(win_b))
+
+    def test_clip(self):
+      tsdd_a = tsd.TimeseriesDataDict.from_arrays( \
+        tid.TimeseriesID("metric_a", self.__ts_filters), \
+        [10, 20, 30], [1, 2, 3])
+      tsdd_b = tsd.TimeseriesDataDict.from_arrays( \
+        tid.TimeseriesID("metric_b", self.__ts_filters), [40, 50], [4, 5])
+      clipped_list = tsd.clip([tsdd_a, tsdd_b], 20, 40)
+      self.assertEqual([dict(tt) for tt in clipped_list], \
+                       [{20: 2, 30: 3}, {40: 4}])
+      self.assertEqual(tsd.clip([tsdd_a, tsdd_b], 31, 39), [])
+      clipped_list = tsd.clip([tsdd_a], 0, 100)
+      self.assertTrue(clipped_list[0].shares_timestamp_axis(tsdd_a))
+
+    def test_align(self):
+      tsdd_a = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID("metric_a", self.__ts_filters), self.__sorted_dps)
+      tsdd_b = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID("metric_b", self.__ts_filters), \
+        {self.__k_0: 1, self.__k_betn_0_and_1: 2})
+      timestamps_arr, values_matrix = tsd.align([tsdd_a, tsdd_b])
+      expected_keys = sorted(list(self.__sorted_dps.keys()) + \
+                             [self.__k_betn_0_and_1])
+      self.assertEqual(list(timestamps_arr), expected_keys)
+      self.assertEqual(values_matrix.shape, (2, len(expected_keys)))
+      self.assertEqual(list(values_matrix[1][:2]), [1, 2])
+      self.assertTrue(np.isnan(values_matrix[0][1]))
+      self.assertTrue(np.all(np.isnan(values_matrix[1][2:])))
+
+      # Shared axis: values are stacked as is.
+      shared_list = tsd.share_timestamp_axes([tsdd_a, tsdd_a])
+      timestamps_arr, values_matrix = tsd.align(shared_list)
+      self.assertIs(timestamps_arr, tsdd_a.get_timestamps())
+      self.assertEqual(values_matrix.tolist(), \
+                       [list(tsdd_a.get_values())] * 2)
+
+    ###########################################################################
+    # downsample() and range_stats() tests.
+    ###########################################################################
+    def __expected_stats(self, values):
+      return {'count': len(values), 'min': values.min(), 'max': values.max(), \
+              'mean': values.mean(), 'first': values[0], 'last': values[-1]}
+
+    def test_range_stats(self):
+      ts_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), self.__sorted_dps)
+      self.assertEqual(ts_dd.range_stats(self.__k_0, self.__k_Max), \
+          {'count': 7, 'min': 10, 'max': 70, 'mean': 40, 'first': 10, \
+           'last': 70})
+      self.assertEqual(ts_dd.range_stats(self.__k_betn_0_and_1, \
+                                         self.__k_betn_i_and_j), \
+          {'count': 3, 'min': 20, 'max': 40, 'mean': 30, 'first': 20, \
+           'last': 40})
+      self.assertEqual(ts_dd.range_stats(self.__k_lt_k_0, self.__k_0 - 1), \
+                       None)
+      empty_dd = tsd.TimeseriesDataDict( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), {})
+      self.assertEqual(empty_dd.range_stats(self.__k_0, self.__k_Max), None)
+
+    def test_range_stats_random_windows(self):
+      # Large enough that ranges are served from several pyramid levels.
+      rng = np.random.default_rng(1234)
+      keys = np.cumsum(rng.integers(1, 5, size=20000)) + self.__k_0
+      values = rng.normal(100.0, 25.0, size=20000)
+      ts_dd = tsd.TimeseriesDataDict.from_arrays( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), keys, values)
+      for _ in range(50):
+        t1, t2 = sorted(rng.integers(keys[0], keys[-1], size=2))
+        with self.subTest(msg="range [%d, %d]" % (t1, t2)):
+          expected = self.__expected_stats(values[(keys >= t1) & (keys <= t2)])
+          result = ts_dd.range_stats(t1, t2)
+          self.assertEqual(result.keys(), expected.keys())
+          for stat_name, expected_value in expected.items():
+            self.assertAlmostEqual(result[stat_name], expected_value)
+
+    def test_downsample(self):
+      rng = np.random.default_rng(1234)
+      keys = np.cumsum(rng.integers(1, 5, size=5000)) + self.__k_0
+      values = rng.normal(100.0, 25.0, size=5000)
+      ts_dd = tsd.TimeseriesDataDict.from_arrays( \
+        tid.TimeseriesID(self.__metric, self.__ts_filters), keys, values)
+      # Power of two widths come from the pyramid, others from raw data.
+      for bucket_width in [1024, 2048, 60, 1]:
+        with self.subTest(msg="bucket width %d" % bucket_width):
+          columns = ts_dd.downsample(bucket_width)
+          bucket_ids = keys // bucket_width
+          self.assertEqual(list(columns['timestamp']), \
+                           list(np.unique(bucket_ids) * bucket_width))
+          for row in [0, len(columns['timestamp']) // 2, -1]:
+            expected = self.__expected_stats( \
+                values[bucket_ids * bucket_width == columns['timestamp'][row]])
+            for stat_name, expected_value in expected.items():
+              self.assertAlmostEqual(columns[stat_name][row], expected_value)
+
 if __name__ == '__main__':
     unittest.main()
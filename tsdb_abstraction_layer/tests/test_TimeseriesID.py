@@ -81,5 +81,30 @@ class TimeseriesID_Tests(unittest.TestCase):
           "metric_id", {"tag1":"BAR", "tag2":"value2"})
       self.assertNotEqual(tsid1, tsid2)
 
+    def test_selects(self):
+      TimeseriesID = argus_tal.timeseries_id.TimeseriesID
+      query_tsid = TimeseriesID("metric_id", {"tag1": "FOO|BAR"})
+      self.assertTrue(query_tsid.selects( \
+          TimeseriesID("metric_id", {"tag1": "BAR", "tag2": "value2"})))
+      self.assertFalse(query_tsid.selects( \
+          TimeseriesID("metric_id", {"tag1": "BAZ", "tag2": "value2"})))
+      self.assertFalse(query_tsid.selects( \
+          TimeseriesID("metric_id", {"tag2": "value2"})))
+      self.assertFalse(query_tsid.selects( \
+          TimeseriesID("other_metric", {"tag1": "FOO"})))
+
+    def test_selects_aggregate(self):
+      TimeseriesID = argus_tal.timeseries_id.TimeseriesID
+      query_tsid = TimeseriesID("metric_id", {"tag1": "FOO|BAR", "tag2": "v2"})
+      # tag1 differs across the timeseries aggregated, so isn't kept.
+      self.assertTrue(query_tsid.selects_aggregate( \
+          TimeseriesID("metric_id", {"tag2": "v2"})))
+      self.assertTrue(query_tsid.selects_aggregate( \
+          TimeseriesID("metric_id", {"tag1": "BAR", "tag2": "v2"})))
+      self.assertFalse(query_tsid.selects_aggregate( \
+          TimeseriesID("metric_id", {"tag2": "other_value"})))
+      self.assertFalse(query_tsid.selects_aggregate( \
+          TimeseriesID("other_metric", {"tag2": "v2"})))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from .context import argus_tal
+from argus_tal import exceptions as tal_err
+from argus_tal.timeseries_id import TimeseriesID
+from argus_tal.timeseries_pattern import TimeseriesPattern
+import unittest
+
+class TimeseriesPattern_Tests(unittest.TestCase):
+    """Test cases for class TimeseriesPattern"""
+    def test_simple(self):
+      filters = {"machine": "extruder_*", "site": "s1|s2"}
+      pattern = TimeseriesPattern("metric_foo", filters)
+      self.assertEqual(pattern.metric_id, "metric_foo")
+      self.assertEqual(pattern.filters, filters)
+      self.assertEqual(pattern.filter_type("machine"), "wildcard")
+      self.assertEqual(pattern.filter_type("site"), "literal_or")
+
+    def test_equality(self):
+      pattern1 = TimeseriesPattern("metric_foo", {"tag1": "*"})
+      pattern2 = TimeseriesPattern("metric_foo", {"tag1": "*"})
+      self.assertEqual(pattern1, pattern2)
+      self.assertEqual(hash(pattern1), pattern1.fqid)
+      self.assertNotEqual(pattern1, \
+                          TimeseriesPattern("metric_foo", {"tag1": "a*"}))
+      # Not the same as a TimeseriesID with the same tags.
+      pattern = TimeseriesPattern("metric_foo", {"tag1": "a|b"})
+      tsid = TimeseriesID("metric_foo", {"tag1": "a|b"})
+      self.assertNotEqual(pattern, tsid)
+      self.assertNotEqual(pattern.fqid, tsid.fqid)
+
+    def test_invalid_values(self):
+      for value in ["m1|m*", "m1||m2", ""]:
+        with self.assertRaises(tal_err.InvalidTimeseriesPattern):
+          TimeseriesPattern("metric_foo", {"tag1": value})
+
+    def test_selects(self):
+      pattern = TimeseriesPattern("metric_id", \
+                                  {"tag1": "ext*_?", "tag2": "FOO|BAR"})
+      sub_testcase_data = [
+        # tags, expected
+        ({"tag1": "extruder_12_?", "tag2": "FOO"}, True), \
+        ({"tag1": "extruder_?", "tag2": "BAR", "tag3": "x"}, True), \
+        ({"tag1": "ext_?", "tag2": "BAR"}, True), \
+        ({"tag1": "extruder_1", "tag2": "FOO"}, False), \
+        ({"tag1": "extruder_?", "tag2": "BAZ"}, False), \
+        ({"tag2": "FOO"}, False), \
+      ]
+      for tags, expected in sub_testcase_data:
+        with self.subTest(msg=str(tags)):
+          self.assertEqual(pattern.selects(TimeseriesID("metric_id", tags)), \
+                           expected)
+      self.assertFalse(pattern.selects( \
+          TimeseriesID("other_metric", {"tag1": "ext_?", "tag2": "FOO"})))
+      self.assertTrue(TimeseriesPattern("metric_id", {}).selects( \
+          TimeseriesID("metric_id", {"tag1": "x"})))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -42,6 +42,21 @@ class Timestamp_Tests(unittest.TestCase):
       except tal_err.NegativeTimestamp:
         pass
 
+    def test_bounds_in_unit(self):
+      bounds_in_unit = argus_tal.timestamp.bounds_in_unit
+      # Secs with ms=true, as OpenTSDB takes them.
+      self.assertEqual(bounds_in_unit(1600000000, 1600000600, True), \
+                       (1600000000000, 1600000600000))
+      self.assertEqual(bounds_in_unit(1600000000123, 1600000600999, True), \
+                       (1600000000123, 1600000600999))
+      self.assertEqual(bounds_in_unit(1600000000, 1600000600, False), \
+                       (1600000000, 1600000600))
+      # Msecs without ms=true: rounded inwards.
+      self.assertEqual(bounds_in_unit(1600000000123, 1600000600999, False), \
+                       (1600000001, 1600000600))
+      self.assertEqual(bounds_in_unit(1600000000000, 1600000600000, False), \
+                       (1600000000, 1600000600))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -6,6 +6,8 @@ from argus_tal import exceptions as tal_err
 from argus_tal import query_urlgen as qurlg
 from argus_tal import timestamp as tstamp
 from argus_tal import timeseries_id as ts_id
+from argus_tal import timeseries_pattern as ts_pat
+import json
 import unittest
 
 class QueryURLGenerator_Tests(unittest.TestCase):
@@ -145,5 +147,143 @@ class QueryURLGenerator_Tests(unittest.TestCase):
       "&m=none:rate:machine.sensor.raw_screw_speed{port_num=1}"
     )
 
+  def test_post_url_and_body(self):
+    # Duplicate timeseries IDs are dropped.
+    url, body = qurlg.post_url_and_body(self.__tsdb_type, self.__host, \
+        self.__port, self.__start_time, self.__end_time, self.__query_agg, \
+        self.__tsid_list + [self.__tsid1, self.__tsid_multi_filter], \
+        flag_compute_rate=True)
+    self.assertEqual(url, "http://34.221.154.248:4242/api/query")
+    port_num_filters = [{"type": "literal_or", "tagk": "port_num", \
+                         "filter": "1", "groupBy": False}]
+    multi_filters = [{"type": "literal_or", "tagk": "tag%d" % ii, \
+                      "filter": "val%d" % ii, "groupBy": False} \
+                     for ii in [1, 2, 3]]
+    self.assertEqual(body, {
+      "start": 1592530632,
+      "end": 1592530682,
+      "queries": [
+        {"aggregator": "none", "rate": True, "filters": port_num_filters, \
+         "metric": "machine.sensor.raw_melt_temperature"},
+        {"aggregator": "none", "rate": True, "filters": port_num_filters, \
+         "metric": "machine.sensor.raw_melt_pressure"},
+        {"aggregator": "none", "rate": True, "filters": port_num_filters, \
+         "metric": "machine.sensor.raw_screw_speed"},
+        {"aggregator": "none", "rate": True, "filters": multi_filters, \
+         "metric": "machine.sensor.raw_melt_temperature"},
+      ]})
+    # As sent: 1 sub-query (with its filters) per distinct timeseries ID.
+    json_body = json.dumps(body)
+    self.assertEqual(json.loads(json_body), body)
+    self.assertEqual(json_body.count('"metric"'), 4)
+    self.assertEqual(json_body.count('"tagk": "port_num"'), 3)
+
+  def test_post_body_with_millisecond_response(self):
+    url, body = qurlg.post_url_and_body(self.__tsdb_type, self.__host, \
+        self.__port, self.__start_time, self.__end_time, self.__query_agg, \
+        [self.__tsid_no_filters], flag_ms_response=True)
+    self.assertEqual(body, {
+      "start": 1592530632,
+      "end": 1592530682,
+      "msResolution": True,
+      "queries": [
+        {"aggregator": "none", "rate": False, "filters": [], \
+         "metric": "machine.sensor.raw_melt_temperature"},
+      ]})
+
+  def test_downsample_spec(self):
+    self.assertEqual(str(qurlg.Downsample("1m", bt.Aggregator.AVG)), \
+                     "1m-avg")
+    self.assertEqual(str(qurlg.Downsample("1h", bt.Aggregator.MAX, \
+                                          bt.FillPolicy.ZERO)), "1h-max-zero")
+    self.assertEqual(str(qurlg.Downsample("0all", bt.Aggregator.COUNT)), \
+                     "0all-count")
+    self.assertEqual(qurlg.Downsample("500ms", bt.Aggregator.SUM), \
+                     qurlg.Downsample("500ms", bt.Aggregator.SUM))
+    for interval, aggregator in [("5 mins", bt.Aggregator.AVG), \
+                                 ("0m", bt.Aggregator.AVG), \
+                                 (60, bt.Aggregator.AVG), \
+                                 ("1m", bt.Aggregator.NONE)]:
+      with self.assertRaises(tal_err.InvalidDownsampleSpec):
+        qurlg.Downsample(interval, aggregator)
+
+  def test_aggregated_url_with_downsample(self):
+    downsample = qurlg.Downsample("1m", bt.Aggregator.AVG, bt.FillPolicy.NAN)
+    url = qurlg.url(self.__tsdb_type, self.__host, self.__port, \
+                    self.__start_time, self.__end_time, \
+                    bt.Aggregator.SUM, [self.__tsid1, self.__tsid_no_filters], \
+                    flag_compute_rate=True, downsample=downsample)
+    self.assertEqual( \
+      url, \
+      "http://34.221.154.248:4242/api/query?start=1592530632&end=1592530682"
+      "&m=sum:1m-avg-nan:rate:machine.sensor.raw_melt_temperature"
+      "{}{port_num=1}"
+      "&m=sum:1m-avg-nan:rate:machine.sensor.raw_melt_temperature{}{}"
+    )
+
+    # Downsampling each timeseries, without aggregating.
+    url = qurlg.url(self.__tsdb_type, self.__host, self.__port, \
+                    self.__start_time, self.__end_time, \
+                    self.__query_agg, [self.__tsid1], \
+                    downsample=qurlg.Downsample("1h", bt.Aggregator.MAX))
+    self.assertEqual( \
+      url, \
+      "http://34.221.154.248:4242/api/query?start=1592530632&end=1592530682"
+      "&m=none:1h-max:machine.sensor.raw_melt_temperature{port_num=1}"
+    )
+
+  def test_aggregated_post_body_with_downsample(self):
+    url, body = qurlg.post_url_and_body(self.__tsdb_type, self.__host, \
+        self.__port, self.__start_time, self.__end_time, bt.Aggregator.MAX, \
+        [self.__tsid1], \
+        downsample=qurlg.Downsample("30s", bt.Aggregator.MIN))
+    self.assertEqual(body["queries"], [
+        {"aggregator": "max", "rate": False, "downsample": "30s-min", \
+         "filters": [{"type": "literal_or", "tagk": "port_num", \
+                      "filter": "1", "groupBy": False}], \
+         "metric": "machine.sensor.raw_melt_temperature"},
+      ])
+
+  def test_pattern_url_and_post_body(self):
+    pattern = ts_pat.TimeseriesPattern("machine.sensor.raw_melt_temperature", \
+        {"machine": "extruder_*", "port_num": "1|2"})
+    url = qurlg.url(self.__tsdb_type, self.__host, self.__port, \
+                    self.__start_time, self.__end_time, \
+                    bt.Aggregator.SUM, [pattern, self.__tsid1])
+    # Unlike those of a timeseries ID, the pattern's filters group by.
+    self.assertEqual( \
+      url, \
+      "http://34.221.154.248:4242/api/query?start=1592530632&end=1592530682"
+      "&m=sum:machine.sensor.raw_melt_temperature"
+      "{machine=extruder_*,port_num=1|2}"
+      "&m=sum:machine.sensor.raw_melt_temperature{}{port_num=1}"
+    )
+
+    url, body = qurlg.post_url_and_body(self.__tsdb_type, self.__host, \
+        self.__port, self.__start_time, self.__end_time, self.__query_agg, \
+        [pattern, self.__tsid1, pattern])
+    self.assertEqual(body["queries"], [
+        {"aggregator": "none", "rate": False, \
+         "filters": [{"type": "wildcard", "tagk": "machine", \
+                      "filter": "extruder_*", "groupBy": True}, \
+                     {"type": "literal_or", "tagk": "port_num", \
+                      "filter": "1|2", "groupBy": True}], \
+         "metric": "machine.sensor.raw_melt_temperature"},
+        {"aggregator": "none", "rate": False, \
+         "filters": [{"type": "literal_or", "tagk": "port_num", \
+                      "filter": "1", "groupBy": False}], \
+         "metric": "machine.sensor.raw_melt_temperature"},
+      ])
+
+  def test_metadata_urls(self):
+    self.assertEqual(qurlg.suggest_url(self.__tsdb_type, self.__host, \
+                                       self.__port, "metrics", "machine.", 50), \
+        "http://34.221.154.248:4242/api/suggest"
+        "?type=metrics&q=machine.&max=50")
+    self.assertEqual(qurlg.lookup_url(self.__tsdb_type, self.__host, \
+                                      self.__port, "machine.sensor.x", 1000), \
+        "http://34.221.154.248:4242/api/search/lookup"
+        "?m=machine.sensor.x&limit=1000")
+
 if __name__ == '__main__':
   unittest.main()